@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import RideBooking, Payment
+from .models import RideBooking, Payment, EmailOutbox, WebhookInbox
 
 
 @admin.register(RideBooking)
@@ -11,6 +11,20 @@ class RideBookingAdmin(admin.ModelAdmin):
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
-    list_display = ("id", "booking", "amount", "status", "paynow_reference", "created_at")
+    list_display = ("id", "booking", "amount", "status", "upstream_status", "paynow_reference", "created_at")
     readonly_fields = ("created_at", "updated_at")
     search_fields = ("paynow_reference",)
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "booking", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status", "kind")
+    readonly_fields = ("created_at", "sent_at", "last_error")
+
+
+@admin.register(WebhookInbox)
+class WebhookInboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "outcome", "attempts", "received_at", "processed_at")
+    list_filter = ("status", "outcome")
+    readonly_fields = ("dedupe_hash", "body", "received_at", "processed_at", "last_error")
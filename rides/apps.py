@@ -1,7 +1,21 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class RidesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rides'
     verbose_name = 'Rides / Taxi Booking'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Compile the notification templates (and inline their CSS) once at startup
+        from .services.email_renderer import EmailRenderer
+        try:
+            EmailRenderer.warm()
+        except Exception:
+            logger.exception('Failed to precompile email templates (non-fatal)')
@@ -0,0 +1,213 @@
+"""Async variants of the booking, price estimate, Paynow poll and status wait endpoints for ASGI deployments.
+
+Routed instead of the sync APIViews when `settings.ASYNC_VIEWS` is True and the project is
+served by an ASGI server (`rides_project.asgi`). Google and Paynow calls await the async
+clients, so a process can hold many upstream calls in flight instead of one per worker thread.
+ORM work runs through `sync_to_async`; the request/response contract matches the sync views.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .models import RideBooking, Payment
+from .serializers import CreateBookingSerializer, RideBookingSerializer, PaymentSerializer, PriceEstimateSerializer
+from .services.distance import DistanceService, is_estimated
+from .services.email_service import EmailService
+from .services.payment_events import PaymentEvents
+from .services.payment_refs import poll_url_for
+from .services.paynow import PaynowService
+from .services.pricing import PricingService
+from .services.quotes import QuoteService
+from .services.reconciler import PaynowReconciler
+from .views import (
+    POLL_FIELDS,
+    _confirm_pay_on_arrival,
+    _create_booking,
+    _mark_paid_from_poll,
+    _poll_body,
+    _poll_validators,
+    _reconciled_status,
+    _record_paynow_failure,
+    _record_paynow_initiation,
+    _set_poll_validators,
+    _wait_body,
+    _wait_params,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _request_data(request):
+    """Parsed JSON or form body, or None when a JSON body is malformed."""
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST.dict()
+
+
+async def _send_emails(*calls):
+    # SMTP is slow; don't hold Django's shared sync thread while sending
+    for fn, args, kwargs in calls:
+        await sync_to_async(fn, thread_sensitive=False)(*args, **kwargs)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPriceEstimateView(View):
+    """Async PriceEstimateView."""
+
+    async def post(self, request):
+        payload = _request_data(request)
+        if payload is None:
+            return JsonResponse({'detail': 'JSON parse error'}, status=400)
+        serializer = PriceEstimateSerializer(data=payload)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        data = serializer.validated_data
+
+        distance = data.get('distance_km')
+        provisional = False
+        if distance is None:
+            origin = (data.get('pickup_lat'), data.get('pickup_lng'))
+            destination = (data.get('dropoff_lat'), data.get('dropoff_lng'))
+            try:
+                if data.get('provisional'):
+                    distance = await sync_to_async(DistanceService.estimate_distance_km)(origin, destination)
+                    provisional = True
+                else:
+                    distance = await DistanceService.aget_distance_km(origin, destination)
+                    provisional = is_estimated(distance)
+            except Exception as exc:
+                logger.exception("Distance computation failed in price estimate")
+                return JsonResponse({"detail": f"Unable to compute distance: {exc}"}, status=400)
+
+        breakdown = PricingService.calculate(
+            distance_km=distance,
+            num_adults=data.get('num_adults', 1),
+            num_kids_seated=data.get('num_kids_seated', 0),
+            num_kids_carried=data.get('num_kids_carried', 0),
+            luggage_count=data.get('luggage_count', 0),
+        )
+        if provisional:
+            breakdown['provisional'] = True
+        else:
+            breakdown['quote_token'] = QuoteService.issue(data, distance, breakdown)
+
+        return JsonResponse(breakdown)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCreateBookingView(View):
+    """Async CreateBookingView."""
+
+    async def post(self, request):
+        payload = _request_data(request)
+        if payload is None:
+            return JsonResponse({'detail': 'JSON parse error'}, status=400)
+        serializer = CreateBookingSerializer(data=payload)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        data = serializer.validated_data
+
+        distance = data.get('distance_km')
+        quote = None
+        if distance is None:
+            quote = QuoteService.redeem(data.get('quote_token'), data)
+            if quote:
+                distance = quote['distance_km']
+        if distance is None:
+            try:
+                distance = await DistanceService.aget_distance_km(
+                    (data.get('pickup_lat'), data.get('pickup_lng')),
+                    (data.get('dropoff_lat'), data.get('dropoff_lng')),
+                )
+            except Exception as exc:
+                logger.exception("Distance computation failed")
+                return JsonResponse({"detail": f"Unable to compute distance: {exc}"}, status=400)
+
+        booking = await sync_to_async(_create_booking)(data, distance, breakdown=quote and quote['breakdown'])
+
+        if data['payment_option'] == RideBooking.PAYMENT_ON_ARRIVAL:
+            await sync_to_async(_confirm_pay_on_arrival)(booking)
+            await _send_emails((EmailService.send_booking_notifications, (booking,), {'payment_status': 'PAY ON ARRIVAL'}))
+            return JsonResponse(RideBookingSerializer(booking).data, status=201)
+
+        payment = await Payment.objects.acreate(booking=booking, method='PAYNOW', amount=booking.total_amount, status=Payment.STATUS_PENDING)
+        try:
+            paynow_response = await PaynowService().acreate_transaction(amount=float(payment.amount), reference=str(payment.id), email=booking.email, phone=booking.phone)
+            redirect_url, poll_url = await sync_to_async(_record_paynow_initiation)(payment, paynow_response)
+            return JsonResponse({"payment": PaymentSerializer(payment).data, "redirect_url": redirect_url, "poll_url": poll_url}, status=201)
+        except Exception as exc:
+            logger.exception("Paynow creation failed")
+            await sync_to_async(_record_paynow_failure)(payment, exc)
+            return JsonResponse({"detail": "Payment initiation failed"}, status=500)
+
+
+class AsyncPaynowPollView(View):
+    """Async PaynowPollView: GET /rides/paynow/poll/<payment_id>/ => { paid: bool, status: str }"""
+
+    async def get(self, request, pk):
+        validators = await sync_to_async(_poll_validators)(pk)
+        if validators is not None:
+            not_modified = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+            if not_modified is not None:
+                return _set_poll_validators(not_modified, validators)
+
+        response = await self._poll(pk)
+        if response.status_code == 200:
+            _set_poll_validators(response, await sync_to_async(_poll_validators)(pk))
+        return response
+
+    async def _poll(self, pk):
+        try:
+            payment = await Payment.objects.only(*POLL_FIELDS).aget(pk=pk)
+        except Payment.DoesNotExist:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+
+        if payment.status == Payment.STATUS_PAID:
+            return JsonResponse({'paid': True, 'status': 'PAID', 'message': 'Already confirmed'})
+
+        if PaynowReconciler.enabled():
+            return JsonResponse(await sync_to_async(_reconciled_status)(payment))
+
+        poll_url = poll_url_for(payment)
+        if not poll_url:
+            return JsonResponse({'error': 'no_poll_url', 'message': 'No poll URL available for this payment.'}, status=400)
+
+        try:
+            status_obj = await PaynowReconciler.acheck_cached(payment, poll_url)
+        except Exception as e:
+            logger.exception('Error checking Paynow status: %s', e)
+            return JsonResponse({'error': 'verify_failed', 'message': str(e)}, status=500)
+
+        logger.debug('Paynow poll result for %s: %s', poll_url, status_obj)
+
+        if status_obj.get('paid'):
+            booking = await sync_to_async(_mark_paid_from_poll)(payment)
+            if booking is not None:
+                await _send_emails(
+                    (EmailService.send_payment_confirmation, (booking,), {}),
+                    (EmailService.send_owner_notification, (booking,), {'payment_status': 'PAID'}),
+                )
+            return JsonResponse({'paid': True, 'status': status_obj.get('status')})
+
+        return JsonResponse(_poll_body(status_obj))
+
+
+class AsyncPaymentStatusWaitView(View):
+    """Async PaymentStatusWaitView: a waiting page holds no worker thread between checks."""
+
+    async def get(self, request, pk):
+        last, timeout = _wait_params(request, getattr(settings, 'PAYMENT_WAIT_TIMEOUT', 25))
+        current = await PaymentEvents.await_change(pk, last, timeout)
+        if current is None:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+        return JsonResponse(_wait_body(current, last))
@@ -0,0 +1,257 @@
+"""Shared, database-backed cache tier.
+
+`LRUDatabaseCache` is a Django cache backend storing entries in the `CacheEntry` table, so every
+worker process sees the same data and entries survive restarts without running an external
+cache service. The table is bounded by `MAX_ENTRIES`: expired rows are removed first, then the
+least recently used ones. Reads refresh `accessed_at` at most once per `TOUCH_INTERVAL` seconds
+so hot keys don't turn every read into a write.
+
+Configure it as a named cache (see `CACHES["shared"]` in settings) and access it through
+`shared_cache()`.
+
+`HitCounter` keeps hit/miss counts in process memory and adds them to the shared tier in
+batches (every `CACHE_STATS_FLUSH_EVERY` events or `CACHE_STATS_FLUSH_INTERVAL` seconds, and
+whenever the totals are read), so counting a cache hit never costs a database write.
+"""
+import base64
+import logging
+import pickle
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_ALIAS = "shared"
+
+
+def has_shared_cache() -> bool:
+    return SHARED_CACHE_ALIAS in getattr(settings, "CACHES", {})
+
+
+def shared_cache():
+    """Return the cross-process cache, or the default cache when no shared tier is configured."""
+    return caches[SHARED_CACHE_ALIAS] if has_shared_cache() else caches["default"]
+
+
+class LRUDatabaseCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._touch_interval = int(options.get("TOUCH_INTERVAL", 60))
+        # Check the table size every N writes from this process rather than on every write
+        self._cull_every = max(1, int(options.get("CULL_EVERY", 50)))
+        self._writes = 0
+
+    @property
+    def _model(self):
+        from rides.models import CacheEntry
+
+        return CacheEntry
+
+    def _encode(self, value) -> str:
+        return base64.b64encode(pickle.dumps(value, self.pickle_protocol)).decode("latin1")
+
+    @staticmethod
+    def _decode(raw: str):
+        return pickle.loads(base64.b64decode(raw.encode("latin1")))
+
+    def _expiry(self, timeout):
+        exp = self.get_backend_timeout(timeout)
+        if exp is None:
+            return None
+        return datetime.fromtimestamp(exp, tz=dt_timezone.utc)
+
+    @staticmethod
+    def _expired(entry, now) -> bool:
+        return entry.expires_at is not None and entry.expires_at <= now
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(k, version=version): k for k in keys}
+        if not key_map:
+            return {}
+        now = timezone.now()
+        found, stale, touch = {}, [], []
+        for entry in self._model.objects.filter(key__in=list(key_map)):
+            if self._expired(entry, now):
+                stale.append(entry.key)
+                continue
+            found[key_map[entry.key]] = self._decode(entry.value)
+            if entry.accessed_at <= now - timedelta(seconds=self._touch_interval):
+                touch.append(entry.key)
+        if stale:
+            self._model.objects.filter(key__in=stale, expires_at__lte=now).delete()
+        if touch:
+            self._model.objects.filter(key__in=touch).update(accessed_at=now)
+        return found
+
+    def get(self, key, default=None, version=None):
+        sentinel = object()
+        value = self.get_many([key], version=version).get(key, sentinel)
+        return default if value is sentinel else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = timezone.now()
+        expires_at = self._expiry(timeout)
+        for key, value in data.items():
+            key = self.make_and_validate_key(key, version=version)
+            self._model.objects.update_or_create(
+                key=key,
+                defaults={"value": self._encode(value), "expires_at": expires_at, "accessed_at": now},
+            )
+        self._maybe_cull(len(data))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = timezone.now()
+        expires_at = self._expiry(timeout)
+        # Expired rows don't count as present
+        self._model.objects.filter(key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                self._model.objects.create(key=key, value=self._encode(value), expires_at=expires_at, accessed_at=now)
+        except IntegrityError:
+            return False
+        self._maybe_cull(1)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = timezone.now()
+        return bool(
+            self._model.objects.filter(key=key).exclude(expires_at__lte=now)
+            .update(expires_at=self._expiry(timeout), accessed_at=now)
+        )
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = timezone.now()
+        with transaction.atomic():
+            entry = self._model.objects.select_for_update().filter(key=key).exclude(expires_at__lte=now).first()
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = self._decode(entry.value) + delta
+            entry.value = self._encode(value)
+            entry.accessed_at = now
+            entry.save(update_fields=["value", "accessed_at"])
+        return value
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(k, version=version) for k in keys]
+        if not keys:
+            return False
+        deleted, _ = self._model.objects.filter(key__in=keys).delete()
+        return bool(deleted)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._model.objects.filter(key=key).exclude(expires_at__lte=timezone.now()).exists()
+
+    def clear(self):
+        self._model.objects.all().delete()
+
+    def _maybe_cull(self, writes: int) -> None:
+        self._writes += writes
+        if self._writes < self._cull_every:
+            return
+        self._writes = 0
+        try:
+            self.cull()
+        except Exception:
+            logger.exception("Shared cache cull failed (non-fatal)")
+
+    def cull(self) -> int:
+        """Delete expired rows, then least recently used rows until the table fits MAX_ENTRIES."""
+        now = timezone.now()
+        removed, _ = self._model.objects.filter(expires_at__lte=now).delete()
+        count = self._model.objects.count()
+        if count <= self._max_entries:
+            return removed
+        # Like Django's backends, free an extra 1/CULL_FREQUENCY so we don't cull on every write
+        excess = count - self._max_entries + (self._max_entries // self._cull_frequency if self._cull_frequency else 0)
+        oldest = list(self._model.objects.order_by("accessed_at").values_list("key", flat=True)[:excess])
+        deleted, _ = self._model.objects.filter(key__in=oldest).delete()
+        return removed + deleted
+
+
+class HitCounter:
+    """Hit/miss counters for one cache, counted in process and flushed to the shared tier in batches.
+
+    Counts not yet flushed when a process exits are lost; the totals are for monitoring only.
+    """
+
+    def __init__(self, prefix: str):
+        self.hits_key = f"{prefix}:hits"
+        self.misses_key = f"{prefix}:misses"
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # time.monotonic() of the oldest unflushed event, or None
+        self._since = None
+
+    def record(self, hits: int = 0, misses: int = 0) -> None:
+        if not hits and not misses:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._hits += hits
+            self._misses += misses
+            if self._since is None:
+                self._since = now
+            due = (
+                self._hits + self._misses >= getattr(settings, "CACHE_STATS_FLUSH_EVERY", 100)
+                or now - self._since >= getattr(settings, "CACHE_STATS_FLUSH_INTERVAL", 60)
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Add this process's pending counts to the shared totals."""
+        with self._lock:
+            hits, misses = self._hits, self._misses
+            self._hits = self._misses = 0
+            self._since = None
+        if not hits and not misses:
+            return
+        try:
+            for key, n in ((self.hits_key, hits), (self.misses_key, misses)):
+                if n:
+                    shared_cache().add(key, 0, timeout=None)
+                    shared_cache().incr(key, n)
+        except Exception:
+            logger.debug("Failed to flush cache stats %s (non-fatal)", self.hits_key, exc_info=True)
+            with self._lock:
+                self._hits += hits
+                self._misses += misses
+                if self._since is None:
+                    self._since = time.monotonic()
+
+    def stats(self) -> dict:
+        """Return the shared hit/miss totals (after flushing this process) and the hit rate."""
+        self.flush()
+        values = shared_cache().get_many([self.hits_key, self.misses_key])
+        hits = int(values.get(self.hits_key) or 0)
+        misses = int(values.get(self.misses_key) or 0)
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": (hits / total) if total else 0.0}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hits = self._misses = 0
+            self._since = None
+        shared_cache().delete_many([self.hits_key, self.misses_key])
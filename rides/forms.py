@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from .models import RideBooking
 from .services.distance import DistanceService
+from .services.quotes import QuoteService
 
 
 class BookingForm(forms.Form):
@@ -18,12 +19,18 @@ class BookingForm(forms.Form):
     num_kids_seated = forms.IntegerField(min_value=0, initial=0)
     num_kids_carried = forms.IntegerField(min_value=0, initial=0)
     luggage_count = forms.IntegerField(min_value=0, initial=0)
+    pickup_at = forms.DateTimeField(required=False)
 
     phone = forms.CharField(max_length=32)
     email = forms.EmailField()
 
     payment_option = forms.ChoiceField(choices=[(RideBooking.PAYMENT_ON_ARRIVAL, 'Pay on Arrival'), (RideBooking.PAYMENT_PAYNOW, 'Pay Online')])
 
+    # Total shown by the fare preview; re-checked against the server price, never trusted
+    quoted_total = forms.DecimalField(required=False, max_digits=10, decimal_places=2)
+    # Signed quote from the fare preview; lets clean() skip the distance lookup
+    quote_token = forms.CharField(required=False)
+
     def clean(self):
         cleaned = super().clean()
         distance = cleaned.get('distance_km')
@@ -33,12 +40,17 @@ class BookingForm(forms.Form):
             missing = [c for c in coords if cleaned.get(c) is None]
             if missing:
                 raise ValidationError(f"Either provide distance_km or coordinates for pickup and dropoff. Missing: {', '.join(missing)}")
-            # compute distance via DistanceService
-            try:
-                distance = DistanceService.get_distance_km((cleaned.get('pickup_lat'), cleaned.get('pickup_lng')),
-                                                          (cleaned.get('dropoff_lat'), cleaned.get('dropoff_lng')))
-            except Exception as exc:
-                raise ValidationError(f"Unable to compute distance: {exc}")
+            quote = QuoteService.redeem(cleaned.get('quote_token'), cleaned)
+            if quote:
+                distance = quote['distance_km']
+                cleaned['quote'] = quote
+            else:
+                # compute distance via DistanceService
+                try:
+                    distance = DistanceService.get_distance_km((cleaned.get('pickup_lat'), cleaned.get('pickup_lng')),
+                                                              (cleaned.get('dropoff_lat'), cleaned.get('dropoff_lng')))
+                except Exception as exc:
+                    raise ValidationError(f"Unable to compute distance: {exc}")
 
             cleaned['distance_km'] = distance
 
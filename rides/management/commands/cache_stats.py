@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from rides.services.distance import DistanceService
+from rides.services.webhooks import WebhookService
+
+
+class Command(BaseCommand):
+    help = "Show cache hit/miss counters (distance lookups, Paynow webhook dedupe)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        # Worker processes flush their counts in batches, so the latest few may not be included yet
+        stats = {'distance': DistanceService.stats.stats(), 'webhook_dedupe': WebhookService.stats.stats()}
+        for name, counts in stats.items():
+            self.stdout.write(
+                f"{name}: hits={counts['hits']} misses={counts['misses']} hit_rate={counts['hit_rate']:.1%}"
+            )
+
+        if options['reset']:
+            DistanceService.stats.reset()
+            WebhookService.stats.reset()
+            self.stdout.write('Counters reset.')
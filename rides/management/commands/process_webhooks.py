@@ -0,0 +1,42 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from rides.services.webhooks import WebhookService
+
+
+class Command(BaseCommand):
+    help = "Process Paynow notifications stored in the webhook inbox (PAYNOW_WEBHOOK_MODE=inbox)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process everything currently due, then exit')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the inbox is empty')
+        parser.add_argument('--replay', nargs='*', type=int, metavar='ID', help='Re-process stored notifications (the given ids, or all with --since)')
+        parser.add_argument('--since', help='With --replay: only notifications received at or after this ISO datetime')
+
+    def handle(self, *args, **options):
+        if options['replay'] is not None:
+            since = None
+            if options['since']:
+                try:
+                    since = datetime.fromisoformat(options['since'])
+                except ValueError:
+                    raise CommandError(f"Invalid --since datetime: {options['since']}")
+                if timezone.is_naive(since):
+                    since = timezone.make_aware(since)
+            if not options['replay'] and since is None:
+                raise CommandError('--replay needs notification ids or --since')
+            queued = WebhookService.replay(ids=options['replay'], since=since)
+            self.stdout.write(f'Queued {queued} notifications for replay.')
+
+        while True:
+            counts = WebhookService.process_pending(limit=options['batch_size'])
+            if counts:
+                self.stdout.write(' '.join(f'{k}={v}' for k, v in sorted(counts.items())))
+            elif options['once'] or options['replay'] is not None:
+                return
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rides.services.reconciler import PaynowReconciler
+
+
+class Command(BaseCommand):
+    help = "Poll pending Paynow payments centrally (PAYNOW_POLL_MODE=reconciler)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Check every due payment once, then exit')
+        parser.add_argument('--workers', type=int, default=None, help='Concurrent Paynow checks (default PAYNOW_RECONCILE_WORKERS)')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep between scans')
+
+    def handle(self, *args, **options):
+        reconciler = PaynowReconciler(workers=options['workers'])
+        while True:
+            counts = reconciler.run_once()
+            if counts:
+                self.stdout.write(' '.join(f'{k}={v}' for k, v in sorted(counts.items())))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
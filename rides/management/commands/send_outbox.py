@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rides.services.outbox import OutboxService
+
+
+class Command(BaseCommand):
+    help = "Deliver queued notification emails (EMAIL_OUTBOX_ENABLED) in batches over one SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver everything currently due, then exit')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50))
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            counts = OutboxService.deliver_batch(limit=options['batch_size'])
+            if any(counts.values()):
+                self.stdout.write(f"sent={counts['sent']} retried={counts['retried']} failed={counts['failed']}")
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0004_emailoutbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ridebooking",
+            name="pickup_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+import django.db.models.deletion
+import django.utils.timezone
+from urllib.parse import parse_qs, urlparse
+
+from django.db import migrations, models
+
+
+def backfill_references(apps, schema_editor):
+    Payment = apps.get_model("rides", "Payment")
+    PaymentReference = apps.get_model("rides", "PaymentReference")
+
+    def guid(pr):
+        pr = pr or {}
+        response = pr.get("response") or {}
+        url = pr.get("pollUrl") or pr.get("poll_url") or response.get("poll_url") or response.get("pollUrl") or response.get("data", {}).get("poll_url")
+        if not url:
+            return None
+        try:
+            return (parse_qs(urlparse(url).query).get("guid") or [None])[0]
+        except ValueError:
+            return None
+
+    batch = []
+    for payment in Payment.objects.only("id", "paynow_reference", "paynow_response").iterator(chunk_size=500):
+        pr = payment.paynow_response or {}
+        data = (pr.get("response") or {}).get("data") or {}
+        aliases = [(str(payment.id), "local"), (payment.paynow_reference, "paynow"), (guid(pr), "poll")]
+        aliases += [(source.get(key), "paynow") for key in ("paynowreference", "paynow_reference", "paynowReference") for source in (pr, data)]
+        batch.extend(PaymentReference(payment_id=payment.id, alias=str(alias)[:255], kind=kind) for alias, kind in aliases if alias)
+        if len(batch) >= 1000:
+            PaymentReference.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    PaymentReference.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0005_ridebooking_pickup_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentReference",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("alias", models.CharField(db_index=True, max_length=255)),
+                ("kind", models.CharField(choices=[("local", "Local id"), ("paynow", "Paynow reference"), ("poll", "Poll GUID")], max_length=16)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("payment", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="references", to="rides.payment")),
+            ],
+            options={
+                "constraints": [models.UniqueConstraint(fields=("alias", "payment"), name="rides_paymentref_alias_payment_uniq")],
+            },
+        ),
+        migrations.RunPython(backfill_references, migrations.RunPython.noop),
+    ]
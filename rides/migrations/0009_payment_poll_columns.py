@@ -0,0 +1,48 @@
+from django.db import migrations, models
+
+
+def backfill_columns(apps, schema_editor):
+    Payment = apps.get_model("rides", "Payment")
+
+    batch = []
+    for payment in Payment.objects.only("id", "paynow_response").exclude(paynow_response=None).iterator(chunk_size=500):
+        pr = payment.paynow_response
+        if not isinstance(pr, dict):
+            continue
+        response = pr.get("response") or {}
+        status = response.get("status") or pr.get("status")
+        payment.poll_url = pr.get("pollUrl") or pr.get("poll_url") or response.get("poll_url") or response.get("pollUrl") or response.get("data", {}).get("poll_url")
+        payment.redirect_url = pr.get("redirectUrl") or pr.get("redirect_url") or response.get("redirect_url")
+        payment.upstream_status = str(status)[:64] if status else None
+        if payment.poll_url or payment.redirect_url or payment.upstream_status:
+            batch.append(payment)
+        if len(batch) >= 500:
+            Payment.objects.bulk_update(batch, ["poll_url", "redirect_url", "upstream_status"])
+            batch = []
+    Payment.objects.bulk_update(batch, ["poll_url", "redirect_url", "upstream_status"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0008_payment_status_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="poll_url",
+            field=models.CharField(blank=True, max_length=512, null=True),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="redirect_url",
+            field=models.CharField(blank=True, max_length=512, null=True),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="upstream_status",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+from urllib.parse import parse_qs
+
+from django.db import migrations, models
+
+
+def backfill_reference(apps, schema_editor):
+    WebhookInbox = apps.get_model("rides", "WebhookInbox")
+
+    batch = []
+    for row in WebhookInbox.objects.only("id", "body").iterator(chunk_size=500):
+        data = {k: v[0] for k, v in parse_qs(row.body).items()}
+        row.reference = (data.get("reference") or data.get("paynowreference") or "")[:255]
+        if row.reference:
+            batch.append(row)
+        if len(batch) >= 500:
+            WebhookInbox.objects.bulk_update(batch, ["reference"])
+            batch = []
+    WebhookInbox.objects.bulk_update(batch, ["reference"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rides", "0009_payment_poll_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookinbox",
+            name="reference",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="webhookinbox",
+            index=models.Index(fields=["reference", "received_at"], name="rides_webhook_ref_idx"),
+        ),
+        migrations.RunPython(backfill_reference, migrations.RunPython.noop),
+    ]
@@ -36,6 +36,9 @@ class RideBooking(models.Model):
     num_kids_carried = models.PositiveSmallIntegerField(default=0)
     luggage_count = models.PositiveSmallIntegerField(default=0)
 
+    # Requested pickup time; empty means as soon as possible
+    pickup_at = models.DateTimeField(null=True, blank=True)
+
     phone = models.CharField(max_length=32)
     email = models.EmailField()
 
@@ -65,8 +68,115 @@ class Payment(models.Model):
     status = models.CharField(max_length=16, choices=[(STATUS_PENDING, 'Pending'), (STATUS_PAID, 'Paid'), (STATUS_FAILED, 'Failed')], default=STATUS_PENDING)
     paynow_reference = models.CharField(max_length=128, blank=True, null=True, db_index=True)
     paynow_response = JSONField(null=True, blank=True)
+    # Copied out of the initiation response when it is saved (rides.signals), so polls read
+    # these columns instead of parsing paynow_response
+    poll_url = models.CharField(max_length=512, blank=True, null=True)
+    redirect_url = models.CharField(max_length=512, blank=True, null=True)
+    upstream_status = models.CharField(max_length=64, blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Pending-payment scans of the Paynow reconciler (rides.services.reconciler)
+            models.Index(fields=['status', 'created_at'], name='rides_payment_status_idx'),
+        ]
+
     def __str__(self):
         return f"Payment {self.id} - {self.status} ({self.amount})"
+
+
+class CacheEntry(models.Model):
+    """Row of the shared, cross-process cache (see `rides.cache.LRUDatabaseCache`)."""
+
+    key = models.CharField(max_length=255, primary_key=True)
+    value = models.TextField()
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+class EmailOutbox(models.Model):
+    """A queued notification email, delivered by `manage.py send_outbox` (see `rides.services.outbox`).
+
+    Rows are written in the caller's transaction, so the worker only sees them once the booking
+    or payment change that triggered them has committed.
+    """
+
+    STATUS_PENDING = 'PENDING'
+    STATUS_SENT = 'SENT'
+    STATUS_FAILED = 'FAILED'
+
+    kind = models.CharField(max_length=32)
+    booking = models.ForeignKey(RideBooking, on_delete=models.CASCADE, related_name='emails')
+    payment_status = models.CharField(max_length=32, blank=True, null=True)
+    status = models.CharField(max_length=16, choices=[(STATUS_PENDING, 'Pending'), (STATUS_SENT, 'Sent'), (STATUS_FAILED, 'Failed')], default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='rides_outbox_due_idx')]
+
+    def __str__(self):
+        return f"{self.kind} email for {self.booking_id} - {self.status}"
+
+
+class PaymentReference(models.Model):
+    """Every identifier a payment is known by (local id, Paynow reference, poll GUID).
+
+    Lets Paynow webhooks resolve their payment with one indexed lookup, whichever of the
+    identifiers they carry (see `rides.services.payment_refs`).
+    """
+
+    KIND_LOCAL = 'local'
+    KIND_PAYNOW = 'paynow'
+    KIND_POLL = 'poll'
+
+    alias = models.CharField(max_length=255, db_index=True)
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='references')
+    kind = models.CharField(max_length=16, choices=[(KIND_LOCAL, 'Local id'), (KIND_PAYNOW, 'Paynow reference'), (KIND_POLL, 'Poll GUID')])
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['alias', 'payment'], name='rides_paymentref_alias_payment_uniq')]
+
+    def __str__(self):
+        return f"{self.kind} {self.alias} -> {self.payment_id}"
+
+
+class WebhookInbox(models.Model):
+    """A verified Paynow result notification, stored raw and processed by `manage.py process_webhooks`.
+
+    `dedupe_hash` is the SHA-256 of the raw body, so a notification Paynow re-sends is only
+    stored (and processed) once. `reference` is the payment reference the notification is
+    about; rows for one reference are processed strictly in `received_at` order.
+    """
+
+    STATUS_PENDING = 'PENDING'
+    STATUS_PROCESSED = 'PROCESSED'
+    STATUS_FAILED = 'FAILED'
+
+    dedupe_hash = models.CharField(max_length=64, unique=True)
+    reference = models.CharField(max_length=255, blank=True, default='')
+    body = models.TextField()
+    status = models.CharField(max_length=16, choices=[(STATUS_PENDING, 'Pending'), (STATUS_PROCESSED, 'Processed'), (STATUS_FAILED, 'Failed')], default=STATUS_PENDING)
+    outcome = models.CharField(max_length=32, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='rides_webhook_due_idx'),
+            models.Index(fields=['reference', 'received_at'], name='rides_webhook_ref_idx'),
+        ]
+
+    def __str__(self):
+        return f"Webhook {self.pk} - {self.status}"
@@ -1,3 +1,6 @@
+import math
+
+from django.conf import settings
 from rest_framework import serializers
 from .models import RideBooking, Payment
 
@@ -7,7 +10,7 @@ class RideBookingSerializer(serializers.ModelSerializer):
         model = RideBooking
         fields = [
             'id', 'pickup_address', 'pickup_lat', 'pickup_lng', 'dropoff_address', 'dropoff_lat', 'dropoff_lng',
-            'distance_km', 'num_adults', 'num_kids_seated', 'num_kids_carried', 'luggage_count', 'phone', 'email', 'payment_option', 'status', 'price_breakdown', 'total_amount', 'created_at'
+            'distance_km', 'num_adults', 'num_kids_seated', 'num_kids_carried', 'luggage_count', 'pickup_at', 'phone', 'email', 'payment_option', 'status', 'price_breakdown', 'total_amount', 'created_at'
         ]
         read_only_fields = ('id', 'status', 'price_breakdown', 'total_amount', 'created_at')
 
@@ -35,12 +38,19 @@ class CreateBookingSerializer(serializers.Serializer):
     num_kids_seated = serializers.IntegerField(min_value=0, default=0)
     num_kids_carried = serializers.IntegerField(min_value=0, default=0)
     luggage_count = serializers.IntegerField(min_value=0, default=0)
+    # Scheduled pickup; omitted for "as soon as possible"
+    pickup_at = serializers.DateTimeField(required=False, allow_null=True)
 
     phone = serializers.CharField(max_length=32)
     email = serializers.EmailField()
 
     payment_option = serializers.ChoiceField(choices=[(RideBooking.PAYMENT_ON_ARRIVAL, 'Pay on Arrival'), (RideBooking.PAYMENT_PAYNOW, 'Pay Online')])
 
+    # Total shown to the customer by the client-side evaluator; re-checked, never trusted
+    quoted_total = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, allow_null=True)
+    # Signed quote from the price estimate (rides.services.quotes); saves the distance lookup
+    quote_token = serializers.CharField(required=False, allow_blank=True)
+
 
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -61,6 +71,9 @@ class PriceEstimateSerializer(serializers.Serializer):
     num_kids_carried = serializers.IntegerField(min_value=0, default=0)
     luggage_count = serializers.IntegerField(min_value=0, default=0)
 
+    # Quote instantly from the offline estimator instead of calling Google
+    provisional = serializers.BooleanField(default=False)
+
     def validate(self, data):
         if data.get('distance_km') is None:
             coords = ('pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng')
@@ -68,3 +81,37 @@ class PriceEstimateSerializer(serializers.Serializer):
             if missing:
                 raise serializers.ValidationError("Either 'distance_km' or full coordinates are required to estimate price")
         return data
+
+
+class PriceBatchSerializer(serializers.Serializer):
+    """Batch quote request: rows of {distance_km, num_adults, num_kids_seated, num_kids_carried, luggage_count}.
+
+    Rows are checked in one plain loop rather than a nested serializer per row, which would
+    cost more than pricing them.
+    """
+    rows = serializers.ListField(allow_empty=False)
+    # False returns only the totals
+    breakdown = serializers.BooleanField(default=True)
+
+    COUNT_FIELDS = (('num_adults', 1, 1), ('num_kids_seated', 0, 0), ('num_kids_carried', 0, 0), ('luggage_count', 0, 0))
+
+    def validate_rows(self, rows):
+        limit = getattr(settings, 'PRICE_BATCH_MAX_ROWS', 5000)
+        if len(rows) > limit:
+            raise serializers.ValidationError(f"At most {limit} rows per request")
+
+        parsed = []
+        for i, row in enumerate(rows):
+            if not isinstance(row, dict):
+                raise serializers.ValidationError(f"row {i}: expected an object")
+            distance = row.get('distance_km')
+            if isinstance(distance, bool) or not isinstance(distance, (int, float)) or not math.isfinite(distance) or distance < 0:
+                raise serializers.ValidationError(f"row {i}: distance_km must be a non-negative number")
+            values = [distance]
+            for field, default, minimum in self.COUNT_FIELDS:
+                value = row.get(field, default)
+                if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+                    raise serializers.ValidationError(f"row {i}: {field} must be an integer >= {minimum}")
+                values.append(value)
+            parsed.append(tuple(values))
+        return parsed
@@ -0,0 +1,219 @@
+"""Circuit breakers for upstream APIs, with state shared across worker processes.
+
+A breaker counts successes and failures of calls to one upstream (e.g. "google", "paynow") in
+the shared cache, so every worker sees the same failure rate. When the failure rate over the
+last window reaches `failure_rate` (with at least `min_calls` calls), the circuit opens and
+calls fail immediately with `CircuitOpenError` instead of tying up a worker for the full
+timeout. After `reset_timeout` seconds the circuit is half-open: a single caller (across all
+processes) is allowed through as a probe; success closes the circuit, failure re-opens it.
+
+So that a healthy upstream costs no cache round trips, successes are counted in process and
+added to the shared buckets every `flush_every` calls or `state_ttl` seconds, and the shared
+`opened_at` is re-read at most every `state_ttl` seconds (always when half-open). Failures are
+written, with any pending successes, straight away, so a worker seeing errors opens the
+circuit immediately and the others notice within `state_ttl`.
+
+Breakers are attached to the pooled HTTP clients (see `rides.services.http`), so every call
+made through those clients is tracked. Per-upstream settings can be overridden with
+`settings.CIRCUIT_BREAKERS`, e.g. {"paynow": {"reset_timeout": 60}}. Cache errors never block
+calls: if the shared cache is unavailable the breaker lets traffic through.
+"""
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+from rides.cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BREAKER_CONFIG = {
+    "enabled": True,
+    "failure_rate": 0.5,
+    "min_calls": 10,
+    "window": 60,
+    "reset_timeout": 30,
+    "state_ttl": 5,
+    "flush_every": 20,
+}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose circuit is open.
+
+    Subclasses ConnectionError so existing `requests` error handling treats a fast-fail like
+    an unreachable host.
+    """
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10, window: int = 60, reset_timeout: int = 30, enabled: bool = True,
+                 state_ttl: float = 5, flush_every: int = 20):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.enabled = enabled
+        self.state_ttl = state_ttl
+        self.flush_every = flush_every
+        # Process-local hint so an open circuit fast-fails without a cache round trip
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+        # Last shared `opened_at` read and when it was read; refreshed every `state_ttl` seconds
+        self._opened_at = None
+        self._state_read_at = None
+        # Successes not yet added to the shared buckets: {bucket key: count}
+        self._pending = {}
+        self._pending_since = None
+
+    def _key(self, suffix: str) -> str:
+        return f"circuit:{self.name}:{suffix}"
+
+    def _bucket_keys(self, now: float):
+        bucket = int(now // self.window)
+        return [self._key(f"{b}:{kind}") for b in (bucket, bucket - 1) for kind in ("ok", "fail")]
+
+    def _read_opened_at(self, now: float, refresh: bool = False):
+        """The shared `opened_at`, re-read at most every `state_ttl` seconds unless `refresh`."""
+        if refresh or self._state_read_at is None or now - self._state_read_at >= self.state_ttl:
+            self._opened_at = shared_cache().get(self._key("opened_at"))
+            self._state_read_at = now
+        return self._opened_at
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the circuit is open; admit one probe when half-open."""
+        if not self.enabled:
+            return
+        now = time.time()
+        if now < self._open_until:
+            raise CircuitOpenError(f"{self.name} circuit open")
+        try:
+            opened_at = self._read_opened_at(now)
+            if opened_at is not None and now - opened_at >= self.reset_timeout:
+                # Possibly half-open: check the shared state, another worker may have re-opened or closed it
+                opened_at = self._read_opened_at(now, refresh=True)
+        except Exception:
+            logger.debug("circuit %s: state unavailable; allowing call", self.name, exc_info=True)
+            return
+        if opened_at is None:
+            return
+        if now - opened_at < self.reset_timeout:
+            self._open_until = opened_at + self.reset_timeout
+            raise CircuitOpenError(f"{self.name} circuit open")
+        # Half-open: only one caller across all workers probes the upstream
+        try:
+            probe = shared_cache().add(self._key("probe"), 1, timeout=self.reset_timeout)
+        except Exception:
+            probe = True
+        if not probe:
+            raise CircuitOpenError(f"{self.name} circuit half-open; probe in flight")
+        logger.info("circuit %s half-open: probing upstream", self.name)
+
+    def _incr(self, kind: str, now: float, n: int = 1) -> None:
+        key = self._key(f"{int(now // self.window)}:{kind}")
+        c = shared_cache()
+        c.add(key, 0, timeout=self.window * 2)
+        c.incr(key, n)
+
+    def flush(self) -> None:
+        """Add this process's pending successes to the shared buckets."""
+        with self._lock:
+            pending, self._pending, self._pending_since = self._pending, {}, None
+        try:
+            for key, n in pending.items():
+                shared_cache().add(key, 0, timeout=self.window * 2)
+                shared_cache().incr(key, n)
+        except Exception:
+            logger.debug("circuit %s: failed to flush successes (non-fatal)", self.name, exc_info=True)
+
+    def record_success(self) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            if self._opened_at is not None:
+                # A successful half-open probe closes the circuit for every worker
+                shared_cache().delete_many([self._key("opened_at"), self._key("probe")] + self._bucket_keys(now))
+                self._opened_at = None
+                self._state_read_at = now
+                logger.warning("circuit %s closed after successful probe", self.name)
+        except Exception:
+            logger.debug("circuit %s: failed to record success (non-fatal)", self.name, exc_info=True)
+        self._open_until = 0.0
+        key = self._key(f"{int(now // self.window)}:ok")
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+            if self._pending_since is None:
+                self._pending_since = now
+            due = sum(self._pending.values()) >= self.flush_every or now - self._pending_since >= self.state_ttl
+        if due:
+            self.flush()
+
+    def record_failure(self) -> None:
+        if not self.enabled:
+            return
+        try:
+            now = time.time()
+            if self._read_opened_at(now, refresh=True) is not None:
+                # A failed half-open probe re-opens the circuit for another reset period
+                self._open(now)
+                return
+            # Failures are counted right away, with any pending successes, so the rate is current
+            self.flush()
+            self._incr("fail", now)
+            counts = shared_cache().get_many(self._bucket_keys(now))
+            fails = sum(v for k, v in counts.items() if k.endswith(":fail"))
+            total = fails + sum(v for k, v in counts.items() if k.endswith(":ok"))
+            if total >= self.min_calls and fails / total >= self.failure_rate:
+                self._open(now)
+        except Exception:
+            logger.debug("circuit %s: failed to record failure (non-fatal)", self.name, exc_info=True)
+
+    def _open(self, now: float) -> None:
+        c = shared_cache()
+        c.set(self._key("opened_at"), now, timeout=self.reset_timeout * 10)
+        c.delete(self._key("probe"))
+        self._opened_at = now
+        self._state_read_at = now
+        self._open_until = now + self.reset_timeout
+        logger.error("circuit %s opened; failing fast for %ss", self.name, self.reset_timeout)
+
+    def is_open(self) -> bool:
+        now = time.time()
+        if now < self._open_until:
+            return True
+        try:
+            opened_at = self._read_opened_at(now)
+        except Exception:
+            return False
+        return opened_at is not None and now - opened_at < self.reset_timeout
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pending, self._pending_since = {}, None
+        self._open_until = 0.0
+        self._opened_at = self._state_read_at = None
+        shared_cache().delete_many([self._key("opened_at"), self._key("probe")] + self._bucket_keys(time.time()))
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def breaker_config(name: str) -> dict:
+    config = dict(DEFAULT_BREAKER_CONFIG)
+    config.update(getattr(settings, "CIRCUIT_BREAKERS", {}).get(name, {}))
+    return config
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name, **breaker_config(name))
+    return breaker
@@ -1,66 +1,378 @@
-from typing import Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 import logging
+import threading
+import time
 import requests
+from asgiref.sync import sync_to_async
 from django.core.cache import cache
 from django.conf import settings
+from django.db import connections
+
+from rides.cache import HitCounter, has_shared_cache, shared_cache
+from .circuit import CircuitOpenError, get_breaker
+from .distance_estimator import DistanceEstimator
+from .http import arequest, get_session
+from .singleflight import AsyncSingleFlight, SingleFlight
+from . import geo
 
 logger = logging.getLogger(__name__)
 
+Coord = Tuple[float, float]
+
+_distance_flight = SingleFlight(
+    "distance",
+    lock_timeout=getattr(settings, "GOOGLE_DISTANCE_TIMEOUT", 10) + 5,
+    wait_timeout=getattr(settings, "GOOGLE_DISTANCE_TIMEOUT", 10) + 1,
+)
+_adistance_flight = AsyncSingleFlight()
+
+# Keys with a background revalidation running in this process
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+class DistanceUnavailable(RuntimeError):
+    """Google could not be reached, timed out or answered with a transient status (UNKNOWN_ERROR, OVER_QUERY_LIMIT)."""
+
+
+class EstimatedKm(float):
+    """A distance from the offline estimator rather than Google (`is_estimated` is True)."""
+
+    estimated = True
+
+
+def is_estimated(km) -> bool:
+    """True if a distance returned by DistanceService is an offline estimate."""
+    return getattr(km, "estimated", False)
+
 
 class DistanceService:
     """DistanceService implementation using Google Distance Matrix API with server-side caching.
 
-    Public method:
+    Public methods:
         get_distance_km(origin: Tuple[float,float], destination: Tuple[float,float], use_cache: bool = True) -> float
+        get_distances_km(pairs: Iterable[Tuple[origin, destination]], use_cache: bool = True) -> List[Optional[float]]
+        aget_distance_km(origin, destination, use_cache: bool = True) -> float  (async, for ASGI views)
 
     Caching:
-        Stores results in Django cache under key `distance:{lat1:.6f}:{lng1:.6f}:{lat2:.6f}:{lng2:.6f}`
-        Timeout controlled with `settings.GOOGLE_DISTANCE_CACHE_TIMEOUT` (seconds).
+        Timeout controlled with `settings.GOOGLE_DISTANCE_CACHE_TIMEOUT` (seconds). The cache key
+        depends on `settings.DISTANCE_CACHE_QUANTIZATION`:
+          - "exact": `distance:{lat1:.6f}:{lng1:.6f}:{lat2:.6f}:{lng2:.6f}` (~10 cm, the default)
+          - "grid": both endpoints snapped to a `DISTANCE_CACHE_CELL_METERS` metric grid
+          - "geohash": both endpoints encoded as geohashes of `DISTANCE_CACHE_GEOHASH_PRECISION`
+        With `DISTANCE_CACHE_SYMMETRIC` the endpoints are ordered so A->B and B->A share a key.
+        Cached values are `{"km": ..., "error_km": ...}` where `error_km` bounds how far any two
+        points sharing the key can be apart (both endpoints). Hits and misses are counted by
+        `DistanceService.stats` (a `rides.cache.HitCounter`), in process memory with batched
+        flushes, so an L1 hit runs no SQL.
+
+        Lookups go through two tiers: the per-process default cache (L1, kept for
+        `DISTANCE_L1_CACHE_TIMEOUT` seconds) and the cross-process shared cache (L2, see
+        `rides.cache`). L2 hits are copied into L1; new results are written to both. L2 errors
+        are logged and treated as misses.
+
+    Coalescing:
+        Concurrent misses for the same cache key are coalesced by `SingleFlight`: one caller per
+        process calls Google while the others wait for its result, and a shared-cache lock makes
+        other processes wait for the published cache entry instead of calling Google too.
+
+    Batching:
+        `get_distances_km` looks up every pair in the cache with one `get_many`, packs the misses
+        into Distance Matrix requests within the API limits (25 origins, 25 destinations and 100
+        elements per request) and writes all results back with one `set_many`. Google bills per
+        element, so pairs are grouped by shared origin or destination and a request never bills
+        more than `MAX_ELEMENT_RATIO` elements per wanted pair.
+
+    Fallback:
+        Google requests are bounded by `settings.GOOGLE_DISTANCE_TIMEOUT` (seconds). When the
+        request fails, times out or returns a transient status (`DistanceUnavailable`),
+        `get_distance_km` falls back to the offline `DistanceEstimator` (unless
+        `settings.DISTANCE_ESTIMATE_FALLBACK` is False) and returns an `EstimatedKm`, which
+        `is_estimated` recognises. Estimates are never written to the cache. Configuration errors
+        (no API key, REQUEST_DENIED, INVALID_REQUEST) and per-route errors such as ZERO_RESULTS
+        still raise.
+        Google calls go through the "google" circuit breaker: while it is open, calls fail fast
+        and fall back to the estimate without waiting for the timeout.
+
+    Stale-while-revalidate:
+        Cached values carry `fresh_until`; entries are kept for a further `DISTANCE_STALE_TTL`
+        seconds after that. A stale hit is returned immediately and refreshed by a background
+        thread (one per key across processes, skipped while the circuit is open), so a slow or
+        unavailable Google never delays a request that has any cached answer.
     """
 
+    MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+    # Google Distance Matrix per-request limits
+    MAX_ORIGINS = 25
+    MAX_DESTINATIONS = 25
+    MAX_ELEMENTS = 100
+    # Most elements billed per wanted pair when requests are merged (see _pack_batches)
+    MAX_ELEMENT_RATIO = 1.5
+
+    # Hit/miss counts; kept in process and flushed to the shared cache in batches
+    stats = HitCounter("distance:stats")
+
+    # Google Distance Matrix top-level statuses that indicate upstream trouble rather than a bad request
+    TRANSIENT_STATUSES = ("UNKNOWN_ERROR", "OVER_QUERY_LIMIT")
+
+    @staticmethod
+    def _quantization() -> str:
+        return getattr(settings, "DISTANCE_CACHE_QUANTIZATION", "exact")
+
+    @staticmethod
+    def _cell_token(lat: float, lng: float, mode: str) -> str:
+        if mode == "grid":
+            row, col = geo.grid_cell(lat, lng, float(getattr(settings, "DISTANCE_CACHE_CELL_METERS", 100)))
+            return f"{row}:{col}"
+        if mode == "geohash":
+            return geo.geohash_encode(lat, lng, int(getattr(settings, "DISTANCE_CACHE_GEOHASH_PRECISION", 7)))
+        return f"{lat:.6f}:{lng:.6f}"
+
     @staticmethod
     def _cache_key(lat1: float, lng1: float, lat2: float, lng2: float) -> str:
-        return f"distance:{lat1:.6f}:{lng1:.6f}:{lat2:.6f}:{lng2:.6f}"
+        mode = DistanceService._quantization()
+        a = DistanceService._cell_token(lat1, lng1, mode)
+        b = DistanceService._cell_token(lat2, lng2, mode)
+        if mode == "exact":
+            prefix = "distance"
+        elif mode == "grid":
+            prefix = f"distance:g{int(getattr(settings, 'DISTANCE_CACHE_CELL_METERS', 100))}"
+        else:
+            prefix = f"distance:h{int(getattr(settings, 'DISTANCE_CACHE_GEOHASH_PRECISION', 7))}"
+        if getattr(settings, "DISTANCE_CACHE_SYMMETRIC", False):
+            a, b = sorted((a, b))
+            prefix += ":s"
+        return f"{prefix}:{a}:{b}"
 
     @staticmethod
-    def get_distance_km(origin: Tuple[float, float], destination: Tuple[float, float], use_cache: bool = True) -> float:
-        if not origin or not destination or len(origin) != 2 or len(destination) != 2:
-            raise ValueError("origin and destination must be (lat, lng) tuples")
+    def _error_bound_km(lat1: float, lat2: float) -> float:
+        """Worst-case endpoint displacement (km) between two routes that share a cache key."""
+        mode = DistanceService._quantization()
+        if mode == "grid":
+            cell = float(getattr(settings, "DISTANCE_CACHE_CELL_METERS", 100))
+            diagonal = cell * 2 ** 0.5
+            return round(2 * diagonal / 1000.0, 3)
+        if mode == "geohash":
+            precision = int(getattr(settings, "DISTANCE_CACHE_GEOHASH_PRECISION", 7))
+            total = 0.0
+            for lat in (lat1, lat2):
+                height, width = geo.geohash_cell_size_m(lat, precision)
+                total += (height ** 2 + width ** 2) ** 0.5
+            return round(total / 1000.0, 3)
+        return 0.0
+
+    @staticmethod
+    def _cache_value(km: float, lat1: float, lat2: float) -> dict:
+        return {
+            "km": km,
+            "error_km": DistanceService._error_bound_km(lat1, lat2),
+            "fresh_until": time.time() + DistanceService._cache_timeout(),
+        }
+
+    @staticmethod
+    def _is_stale(value) -> bool:
+        # Values without a freshness stamp predate stale-while-revalidate and are treated as fresh
+        return isinstance(value, dict) and value.get("fresh_until") is not None and value["fresh_until"] < time.time()
+
+    @staticmethod
+    def _cached_km(value) -> Optional[float]:
+        # Entries written before quantization was introduced are bare floats
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            return float(value["km"])
+        return float(value)
 
+    @staticmethod
+    def _api_key() -> str:
         # Prefer a server-specific key; fall back to the legacy single key if not provided
         api_key = getattr(settings, "GOOGLE_MAPS_SERVER_KEY", None) or getattr(settings, "GOOGLE_MAPS_API_KEY", None)
         if not api_key:
             raise RuntimeError("GOOGLE_MAPS_SERVER_KEY or GOOGLE_MAPS_API_KEY is not configured in settings")
+        return api_key
 
-        lat1, lng1 = float(origin[0]), float(origin[1])
-        lat2, lng2 = float(destination[0]), float(destination[1])
+    @staticmethod
+    def _normalize(point) -> Coord:
+        if not point or len(point) != 2:
+            raise ValueError("origin and destination must be (lat, lng) tuples")
+        return float(point[0]), float(point[1])
 
-        key = DistanceService._cache_key(lat1, lng1, lat2, lng2)
-        if use_cache:
-            cached = cache.get(key)
-            if cached is not None:
-                logger.debug("distance cache hit for %s -> %s = %s km", origin, destination, cached)
-                return float(cached)
+    @staticmethod
+    def _cache_timeout() -> int:
+        return getattr(settings, "GOOGLE_DISTANCE_CACHE_TIMEOUT", 6 * 3600)
 
-        url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-        params = {
+    @staticmethod
+    def _stale_ttl() -> int:
+        return int(getattr(settings, "DISTANCE_STALE_TTL", 24 * 3600))
+
+    @staticmethod
+    def _l1_timeout() -> int:
+        return int(getattr(settings, "DISTANCE_L1_CACHE_TIMEOUT", 300))
+
+    @classmethod
+    def _cache_get_many(cls, keys: List[str]) -> dict:
+        found = cache.get_many(keys)
+        missing = [k for k in keys if k not in found]
+        if missing and has_shared_cache():
+            try:
+                shared = shared_cache().get_many(missing)
+            except Exception:
+                logger.exception("Failed to read shared distance cache (non-fatal)")
+                shared = {}
+            if shared:
+                cache.set_many(shared, timeout=cls._l1_timeout())
+                found.update(shared)
+        return found
+
+    @classmethod
+    def _cache_set_many(cls, data: dict) -> None:
+        timeout = cls._cache_timeout() + cls._stale_ttl()
+        cache.set_many(data, timeout=min(timeout, cls._l1_timeout()))
+        if has_shared_cache():
+            try:
+                shared_cache().set_many(data, timeout=timeout)
+            except Exception:
+                logger.exception("Failed to set shared distance cache (non-fatal)")
+
+    @staticmethod
+    def _request_timeout() -> float:
+        return float(getattr(settings, "GOOGLE_DISTANCE_TIMEOUT", 10))
+
+    @staticmethod
+    def _matrix_params(origins: List[Coord], destinations: List[Coord], api_key: str) -> dict:
+        return {
             "units": "metric",
-            "origins": f"{lat1},{lng1}",
-            "destinations": f"{lat2},{lng2}",
+            "origins": "|".join(f"{lat},{lng}" for lat, lng in origins),
+            "destinations": "|".join(f"{lat},{lng}" for lat, lng in destinations),
             "key": api_key,
         }
 
+    @classmethod
+    def _check_matrix_status(cls, data: dict) -> dict:
+        if data.get("status") != "OK":
+            logger.error("Google API returned non-OK status: %s", data)
+            if data.get("status") in cls.TRANSIENT_STATUSES:
+                get_breaker("google").record_failure()
+                raise DistanceUnavailable(f"Google Distance Matrix API error: {data.get('status')}")
+            # REQUEST_DENIED, INVALID_REQUEST etc. are configuration errors: never mask them with an estimate
+            raise RuntimeError(f"Google Distance Matrix API error: {data.get('status')}")
+        return data
+
+    @classmethod
+    def _fetch_matrix(cls, origins: List[Coord], destinations: List[Coord], api_key: str) -> dict:
+        """Perform one Distance Matrix request and return the decoded, top-level-OK payload."""
+        params = cls._matrix_params(origins, destinations, api_key)
+
         try:
-            resp = requests.get(url, params=params, timeout=10)
+            resp = get_session("google").get(cls.MATRIX_URL, params=params, timeout=cls._request_timeout())
             resp.raise_for_status()
             data = resp.json()
+        except CircuitOpenError as exc:
+            logger.warning("Google Distance Matrix circuit open; failing fast")
+            raise DistanceUnavailable(f"Error calling Google Distance Matrix API: {exc}")
         except requests.RequestException as exc:
             logger.exception("Google Distance Matrix request failed")
-            raise RuntimeError(f"Error calling Google Distance Matrix API: {exc}")
+            raise DistanceUnavailable(f"Error calling Google Distance Matrix API: {exc}")
 
-        if data.get("status") != "OK":
-            logger.error("Google API returned non-OK status: %s", data)
-            raise RuntimeError(f"Google Distance Matrix API error: {data.get('status')}")
+        return cls._check_matrix_status(data)
+
+    @classmethod
+    async def _afetch_matrix(cls, origins: List[Coord], destinations: List[Coord], api_key: str) -> dict:
+        """Async `_fetch_matrix` over the pooled async client."""
+        params = cls._matrix_params(origins, destinations, api_key)
+
+        try:
+            resp = await arequest("google", "GET", cls.MATRIX_URL, params=params, timeout=cls._request_timeout())
+            if resp.status_code >= 400:
+                raise requests.HTTPError(f"{resp.status_code} Error for url: {cls.MATRIX_URL}")
+            data = resp.json()
+        except CircuitOpenError as exc:
+            logger.warning("Google Distance Matrix circuit open; failing fast")
+            raise DistanceUnavailable(f"Error calling Google Distance Matrix API: {exc}")
+        except (requests.RequestException, ValueError) as exc:
+            logger.exception("Google Distance Matrix request failed")
+            raise DistanceUnavailable(f"Error calling Google Distance Matrix API: {exc}")
+
+        return await sync_to_async(cls._check_matrix_status)(data)
+
+    @staticmethod
+    def _element_km(element: dict) -> float:
+        if element.get("status") != "OK":
+            logger.error("Element status not OK: %s", element)
+            raise RuntimeError(f"Route not available: {element.get('status')}")
+        return float(element["distance"]["value"]) / 1000.0
+
+    @staticmethod
+    def get_distance_km(origin: Tuple[float, float], destination: Tuple[float, float], use_cache: bool = True) -> float:
+        if not origin or not destination or len(origin) != 2 or len(destination) != 2:
+            raise ValueError("origin and destination must be (lat, lng) tuples")
+
+        lat1, lng1 = float(origin[0]), float(origin[1])
+        lat2, lng2 = float(destination[0]), float(destination[1])
+
+        key = DistanceService._cache_key(lat1, lng1, lat2, lng2)
+        if not use_cache:
+            return DistanceService._fetch_distance(key, (lat1, lng1), (lat2, lng2))
+
+        value = DistanceService._cache_get_many([key]).get(key)
+        cached = DistanceService._cached_km(value)
+        if cached is not None:
+            logger.debug("distance cache hit for %s -> %s = %s km", origin, destination, cached)
+            DistanceService.stats.record(hits=1)
+            if DistanceService._is_stale(value):
+                DistanceService._revalidate(key, (lat1, lng1), (lat2, lng2))
+            return cached
+        DistanceService.stats.record(misses=1)
+
+        # Concurrent misses for the same key share one upstream call (in-process and cross-process)
+        return _distance_flight.do(
+            key,
+            lambda: DistanceService._fetch_distance(key, (lat1, lng1), (lat2, lng2)),
+            lookup=lambda: DistanceService._cached_km(DistanceService._cache_get_many([key]).get(key)),
+        )
+
+    @staticmethod
+    async def aget_distance_km(origin: Tuple[float, float], destination: Tuple[float, float], use_cache: bool = True) -> float:
+        """Async `get_distance_km` for ASGI views.
+
+        Cache reads and writes run in Django's sync thread; the Google call awaits the async
+        client, so many lookups can be in flight at once. Concurrent misses for a key are
+        coalesced within the event loop only (no cross-process lock wait).
+        """
+        if not origin or not destination or len(origin) != 2 or len(destination) != 2:
+            raise ValueError("origin and destination must be (lat, lng) tuples")
+
+        lat1, lng1 = float(origin[0]), float(origin[1])
+        lat2, lng2 = float(destination[0]), float(destination[1])
+
+        key = DistanceService._cache_key(lat1, lng1, lat2, lng2)
+        if not use_cache:
+            return await DistanceService._afetch_distance(key, (lat1, lng1), (lat2, lng2))
+
+        value = (await sync_to_async(DistanceService._cache_get_many)([key])).get(key)
+        cached = DistanceService._cached_km(value)
+        if cached is not None:
+            await sync_to_async(DistanceService.stats.record)(hits=1)
+            if DistanceService._is_stale(value):
+                await sync_to_async(DistanceService._revalidate)(key, (lat1, lng1), (lat2, lng2))
+            return cached
+        await sync_to_async(DistanceService.stats.record)(misses=1)
+
+        return await _adistance_flight.do(key, lambda: DistanceService._afetch_distance(key, (lat1, lng1), (lat2, lng2)))
+
+    @staticmethod
+    async def _afetch_distance(key: str, origin: Coord, destination: Coord) -> float:
+        (lat1, lng1), (lat2, lng2) = origin, destination
+        api_key = DistanceService._api_key()
+        try:
+            data = await DistanceService._afetch_matrix([(lat1, lng1)], [(lat2, lng2)], api_key)
+        except DistanceUnavailable:
+            if not getattr(settings, "DISTANCE_ESTIMATE_FALLBACK", True):
+                raise
+            estimate = await sync_to_async(DistanceService.estimate_distance_km)((lat1, lng1), (lat2, lng2))
+            logger.warning("Distance Matrix unavailable; using offline estimate %s km for %s -> %s", estimate, origin, destination)
+            return estimate
 
         try:
             element = data["rows"][0]["elements"][0]
@@ -68,20 +380,191 @@ class DistanceService:
             logger.exception("Unexpected Distance Matrix response format")
             raise RuntimeError("Unexpected Distance Matrix response format") from exc
 
-        if element.get("status") != "OK":
-            logger.error("Element status not OK: %s", element)
-            raise RuntimeError(f"Route not available: {element.get('status')}")
+        distance_km = DistanceService._element_km(element)
+        try:
+            await sync_to_async(DistanceService._cache_set_many)({key: DistanceService._cache_value(distance_km, lat1, lat2)})
+        except Exception:
+            logger.exception("Failed to set distance cache (non-fatal)")
+        return distance_km
+
+    @staticmethod
+    def _revalidate(key: str, origin: Coord, destination: Coord) -> Optional[threading.Thread]:
+        """Refresh a stale cache entry in a background thread; returns the thread if one started."""
+        if get_breaker("google").is_open():
+            return None
+        with _revalidating_lock:
+            if key in _revalidating:
+                return None
+            _revalidating.add(key)
+        try:
+            # Only one process refreshes a given key; the marker expires with the request timeout
+            if not shared_cache().add(f"distance:revalidate:{key}", 1, timeout=int(DistanceService._request_timeout()) + 5):
+                with _revalidating_lock:
+                    _revalidating.discard(key)
+                return None
+        except Exception:
+            logger.debug("Revalidation marker unavailable for %s (non-fatal)", key, exc_info=True)
+
+        def run():
+            try:
+                DistanceService._fetch_distance(key, origin, destination, fallback=False)
+            except Exception:
+                logger.warning("Background refresh of %s failed; keeping stale distance", key, exc_info=True)
+            finally:
+                with _revalidating_lock:
+                    _revalidating.discard(key)
+                connections.close_all()
+
+        thread = threading.Thread(target=run, name=f"distance-revalidate:{key}", daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def _fetch_distance(key: str, origin: Coord, destination: Coord, fallback: bool = True) -> float:
+        (lat1, lng1), (lat2, lng2) = origin, destination
+        api_key = DistanceService._api_key()
+        try:
+            data = DistanceService._fetch_matrix([(lat1, lng1)], [(lat2, lng2)], api_key)
+        except DistanceUnavailable:
+            if not fallback or not getattr(settings, "DISTANCE_ESTIMATE_FALLBACK", True):
+                raise
+            estimate = DistanceService.estimate_distance_km((lat1, lng1), (lat2, lng2))
+            logger.warning("Distance Matrix unavailable; using offline estimate %s km for %s -> %s", estimate, origin, destination)
+            return estimate
+
+        try:
+            element = data["rows"][0]["elements"][0]
+        except Exception as exc:
+            logger.exception("Unexpected Distance Matrix response format")
+            raise RuntimeError("Unexpected Distance Matrix response format") from exc
 
-        meters = element["distance"]["value"]
-        distance_km = float(meters) / 1000.0
+        distance_km = DistanceService._element_km(element)
 
         # Cache result
-        timeout = getattr(settings, "GOOGLE_DISTANCE_CACHE_TIMEOUT", 6 * 3600)
         try:
-            cache.set(key, distance_km, timeout=timeout)
+            DistanceService._cache_set_many({key: DistanceService._cache_value(distance_km, lat1, lat2)})
         except Exception:
             logger.exception("Failed to set distance cache (non-fatal)")
 
         logger.debug("Computed distance %s km for %s -> %s", distance_km, origin, destination)
         return distance_km
 
+    @classmethod
+    def _pair_groups(cls, pairs: List[Tuple[Coord, Coord]]) -> List[List[Tuple[Coord, Coord]]]:
+        """Split pairs into rows (one origin, its destinations) and columns (one destination, its origins).
+
+        An origin with several destinations becomes a row. The remaining pairs are grouped by
+        destination, so a pair that shares neither end with another is a group of its own.
+        Every group is within the per-request limits and bills exactly one element per pair.
+        """
+        by_origin: Dict[Coord, List[Coord]] = {}
+        for o, d in sorted(set(pairs)):
+            by_origin.setdefault(o, []).append(d)
+
+        groups = []
+        by_destination: Dict[Coord, List[Coord]] = {}
+        for o, ds in by_origin.items():
+            if len(ds) == 1:
+                by_destination.setdefault(ds[0], []).append(o)
+                continue
+            for i in range(0, len(ds), cls.MAX_DESTINATIONS):
+                groups.append([(o, d) for d in ds[i:i + cls.MAX_DESTINATIONS]])
+        for d, os_ in by_destination.items():
+            for i in range(0, len(os_), cls.MAX_ORIGINS):
+                groups.append([(o, d) for o in os_[i:i + cls.MAX_ORIGINS]])
+        return groups
+
+    @classmethod
+    def _pack_batches(cls, pairs: List[Tuple[Coord, Coord]]) -> List[Tuple[List[Coord], List[Coord]]]:
+        """Pack (origin, destination) pairs into matrix requests within the API limits.
+
+        Google bills every element of the origins x destinations product, so groups from
+        `_pair_groups` are merged into one request only while the billed elements stay within
+        `MAX_ELEMENT_RATIO` times the pairs actually wanted. Unrelated pairs therefore cost one
+        element each (in separate requests) rather than a mostly unused cross product.
+        """
+        batches = []  # [origins, destinations, wanted pair count]
+        for group in sorted(cls._pair_groups(pairs), key=len, reverse=True):
+            g_origins = list(dict.fromkeys(o for o, _ in group))
+            g_destinations = list(dict.fromkeys(d for _, d in group))
+            for batch in batches:
+                origins = batch[0] + [o for o in g_origins if o not in batch[0]]
+                destinations = batch[1] + [d for d in g_destinations if d not in batch[1]]
+                billed = len(origins) * len(destinations)
+                if (
+                    len(origins) <= cls.MAX_ORIGINS and len(destinations) <= cls.MAX_DESTINATIONS
+                    and billed <= cls.MAX_ELEMENTS and billed <= cls.MAX_ELEMENT_RATIO * (batch[2] + len(group))
+                ):
+                    batch[0], batch[1], batch[2] = origins, destinations, batch[2] + len(group)
+                    break
+            else:
+                batches.append([g_origins, g_destinations, len(group)])
+        return [(origins, destinations) for origins, destinations, _ in batches]
+
+    @classmethod
+    def get_distances_km(cls, pairs: Iterable[Tuple[Coord, Coord]], use_cache: bool = True) -> List[Optional[float]]:
+        """Return road distances (km) for many (origin, destination) pairs, in input order.
+
+        Pairs whose route is not available (element status other than OK) yield None instead of
+        failing the whole batch. Request-level failures (network, non-OK API status) raise
+        RuntimeError like `get_distance_km`.
+        """
+        normalized = [(cls._normalize(o), cls._normalize(d)) for o, d in pairs]
+        if not normalized:
+            return []
+
+        api_key = cls._api_key()
+
+        keys = {pair: cls._cache_key(pair[0][0], pair[0][1], pair[1][0], pair[1][1]) for pair in normalized}
+        by_key: Dict[str, Optional[float]] = {}
+
+        if use_cache:
+            try:
+                cached = cls._cache_get_many(list(set(keys.values())))
+            except Exception:
+                logger.exception("Failed to read distance cache (non-fatal)")
+                cached = {}
+            for key, value in cached.items():
+                km = cls._cached_km(value)
+                if km is not None:
+                    by_key[key] = km
+            cls.stats.record(hits=len(by_key), misses=len(set(keys.values())) - len(by_key))
+
+        # Fetch one representative pair per missing cache key
+        representatives: Dict[str, Tuple[Coord, Coord]] = {}
+        for pair, key in keys.items():
+            if key not in by_key:
+                representatives.setdefault(key, pair)
+        misses = list(representatives.values())
+        logger.debug("distance batch: %d pairs, %d keys cached, %d to fetch", len(keys), len(by_key), len(misses))
+
+        to_cache = {}
+        for origins, destinations in cls._pack_batches(misses):
+            data = cls._fetch_matrix(origins, destinations, api_key)
+            wanted = [pair for pair in misses if pair[0] in origins and pair[1] in destinations and keys[pair] not in by_key]
+            for pair in wanted:
+                try:
+                    element = data["rows"][origins.index(pair[0])]["elements"][destinations.index(pair[1])]
+                except Exception as exc:
+                    logger.exception("Unexpected Distance Matrix response format")
+                    raise RuntimeError("Unexpected Distance Matrix response format") from exc
+                try:
+                    km = cls._element_km(element)
+                except RuntimeError:
+                    by_key[keys[pair]] = None
+                    continue
+                by_key[keys[pair]] = km
+                to_cache[keys[pair]] = cls._cache_value(km, pair[0][0], pair[1][0])
+
+        if to_cache:
+            try:
+                cls._cache_set_many(to_cache)
+            except Exception:
+                logger.exception("Failed to set distance cache (non-fatal)")
+
+        return [by_key.get(keys[pair]) for pair in normalized]
+
+    @staticmethod
+    def estimate_distance_km(origin: Tuple[float, float], destination: Tuple[float, float]) -> EstimatedKm:
+        """Instant offline estimate (no network call), suitable for provisional quotes."""
+        return EstimatedKm(DistanceEstimator.estimate_km(origin, destination))
@@ -0,0 +1,97 @@
+from typing import Tuple
+import logging
+import math
+from statistics import median
+from django.core.cache import cache
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DistanceEstimator:
+    """Offline road-distance estimator: great-circle distance times a road-circuity factor.
+
+    The circuity factor is calibrated from bookings that already store both coordinates and a
+    road `distance_km` (median of road / haversine ratios). Until enough samples exist, the
+    configured `DISTANCE_CIRCUITY_FACTOR` is used. The calibrated factor is cached so an
+    estimate costs no network call and, on a warm cache, no database query.
+
+    Used by DistanceService as a fallback when Google is slow or unavailable, and for
+    instant provisional quotes.
+    """
+
+    EARTH_RADIUS_KM = 6371.0088
+    CALIBRATION_CACHE_KEY = "distance:circuity_factor"
+
+    # Ignore very short trips (GPS noise dominates) and implausible ratios when calibrating
+    MIN_SAMPLE_KM = 1.0
+    MIN_RATIO = 1.0
+    MAX_RATIO = 3.0
+
+    @classmethod
+    def haversine_km(cls, origin: Tuple[float, float], destination: Tuple[float, float]) -> float:
+        lat1, lng1 = math.radians(float(origin[0])), math.radians(float(origin[1]))
+        lat2, lng2 = math.radians(float(destination[0])), math.radians(float(destination[1]))
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        return 2 * cls.EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+    @staticmethod
+    def default_factor() -> float:
+        return float(getattr(settings, "DISTANCE_CIRCUITY_FACTOR", 1.3))
+
+    @classmethod
+    def calibrate(cls) -> float:
+        """Compute the circuity factor from stored bookings and refresh the cached value."""
+        from rides.models import RideBooking
+
+        sample_size = int(getattr(settings, "DISTANCE_CIRCUITY_SAMPLE_SIZE", 500))
+        min_samples = int(getattr(settings, "DISTANCE_CIRCUITY_MIN_SAMPLES", 20))
+
+        rows = (
+            RideBooking.objects
+            .exclude(pickup_lat=None).exclude(pickup_lng=None)
+            .exclude(dropoff_lat=None).exclude(dropoff_lng=None)
+            .filter(distance_km__gt=0)
+            .order_by("-created_at")
+            .values_list("pickup_lat", "pickup_lng", "dropoff_lat", "dropoff_lng", "distance_km")[:sample_size]
+        )
+
+        ratios = []
+        for plat, plng, dlat, dlng, road_km in rows:
+            straight = cls.haversine_km((plat, plng), (dlat, dlng))
+            if straight < cls.MIN_SAMPLE_KM:
+                continue
+            ratio = float(road_km) / straight
+            if cls.MIN_RATIO <= ratio <= cls.MAX_RATIO:
+                ratios.append(ratio)
+
+        if len(ratios) >= min_samples:
+            factor = median(ratios)
+            logger.info("Calibrated circuity factor %.3f from %d bookings", factor, len(ratios))
+        else:
+            factor = cls.default_factor()
+            logger.debug("Only %d calibration samples; using default circuity factor %.3f", len(ratios), factor)
+
+        timeout = getattr(settings, "DISTANCE_CIRCUITY_CACHE_TIMEOUT", 24 * 3600)
+        try:
+            cache.set(cls.CALIBRATION_CACHE_KEY, factor, timeout=timeout)
+        except Exception:
+            logger.exception("Failed to cache circuity factor (non-fatal)")
+        return factor
+
+    @classmethod
+    def circuity_factor(cls) -> float:
+        cached = cache.get(cls.CALIBRATION_CACHE_KEY)
+        if cached is not None:
+            return float(cached)
+        try:
+            return cls.calibrate()
+        except Exception:
+            logger.exception("Circuity calibration failed; using default factor")
+            return cls.default_factor()
+
+    @classmethod
+    def estimate_km(cls, origin: Tuple[float, float], destination: Tuple[float, float]) -> float:
+        if not origin or not destination or len(origin) != 2 or len(destination) != 2:
+            raise ValueError("origin and destination must be (lat, lng) tuples")
+        return round(cls.haversine_km(origin, destination) * cls.circuity_factor(), 3)
@@ -0,0 +1,124 @@
+"""Notification email rendering with templates compiled once per process.
+
+`EmailRenderer` loads each email template once, compiles it and keeps the compiled template
+for the life of the process (cleared when the TEMPLATES setting changes). The `<style>` rules
+of the HTML templates are inlined into `style` attributes when the template is compiled, so
+email clients that drop `<style>` blocks still get the styling without any per-message
+CSS work. `render_event` renders every variant for one booking (e.g. owner + customer)
+against a single shared context.
+"""
+import re
+import threading
+from typing import Iterable, List, Tuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import Context, engines
+
+_STYLE_BLOCK = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_CSS_RULE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_SIMPLE_SELECTOR = re.compile(r'^([a-zA-Z][a-zA-Z0-9]*)?(?:\.([\w-]+))?$')
+_OPEN_TAG = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)((?:\s[^<>]*?)?)(/?)>')
+_ATTR = r'\s{name}\s*=\s*"([^"]*)"'
+
+
+def inline_css(source: str) -> str:
+    """Copy `tag`, `.class` and `tag.class` rules of the <style> blocks into style attributes.
+
+    Element rules come first, then class rules, then the element's own style attribute, which
+    roughly follows CSS specificity. Other selectors are left to the <style> block.
+    """
+    rules = []
+    for block in _STYLE_BLOCK.findall(source):
+        for selectors, body in _CSS_RULE.findall(_CSS_COMMENT.sub('', block)):
+            declarations = ';'.join(d.strip() for d in body.split(';') if d.strip()).replace('"', "'")
+            if not declarations:
+                continue
+            for selector in selectors.split(','):
+                m = _SIMPLE_SELECTOR.match(selector.strip())
+                if m and (m.group(1) or m.group(2)):
+                    tag, cls = m.group(1), m.group(2)
+                    rules.append((bool(cls), (tag or '').lower(), cls, declarations))
+    if not rules:
+        return source
+    rules.sort(key=lambda r: r[0])
+
+    body_start = re.search(r'<body[\s>]', source, re.I)
+    head, body = (source[:body_start.start()], source[body_start.start():]) if body_start else ('', source)
+
+    def apply(match):
+        tag, attrs, closing = match.group(1), match.group(2), match.group(3)
+        cls_match = re.search(_ATTR.format(name='class'), attrs, re.I)
+        classes = set(cls_match.group(1).split()) if cls_match else set()
+        styles = [d for _, t, c, d in rules if (not t or t == tag.lower()) and (not c or c in classes)]
+        if not styles:
+            return match.group(0)
+        style_match = re.search(_ATTR.format(name='style'), attrs, re.I)
+        if style_match:
+            styles.append(style_match.group(1).strip().rstrip(';'))
+            attrs = attrs[:style_match.start()] + attrs[style_match.end():]
+        return f'<{tag}{attrs} style="{";".join(styles)}"{closing}>'
+
+    return head + _OPEN_TAG.sub(apply, body)
+
+
+class EmailRenderer:
+    # kind -> template base name (".txt" and ".html" variants)
+    TEMPLATES = {
+        'owner': 'rides/email_owner',
+        'customer': 'rides/email_customer',
+        'payment_confirmation': 'rides/email_payment_confirm',
+        'owner_digest': 'rides/email_owner_digest',
+    }
+
+    _compiled = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_template(cls, name: str):
+        """Compiled template for `name`; HTML templates have their CSS inlined."""
+        template = cls._compiled.get(name)
+        if template is None:
+            with cls._lock:
+                template = cls._compiled.get(name)
+                if template is None:
+                    engine = engines['django'].engine
+                    source = engine.get_template(name).source
+                    if name.endswith('.html'):
+                        source = inline_css(source)
+                    template = cls._compiled[name] = engine.from_string(source)
+        return template
+
+    @classmethod
+    def warm(cls) -> None:
+        """Compile every notification template up front (called at startup)."""
+        for base in cls.TEMPLATES.values():
+            cls.get_template(f'{base}.txt')
+            cls.get_template(f'{base}.html')
+
+    @staticmethod
+    def shared_context(**values) -> dict:
+        return dict(values, taxi_owner_phone=settings.TAXI_OWNER_PHONE)
+
+    @classmethod
+    def render(cls, kind: str, context: Context) -> Tuple[str, str]:
+        base = cls.TEMPLATES[kind]
+        return cls.get_template(f'{base}.txt').render(context), cls.get_template(f'{base}.html').render(context)
+
+    @classmethod
+    def render_event(cls, booking, variants: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Render [(kind, payment_status), ...] for one booking; returns [(text, html), ...] in order."""
+        context = Context(cls.shared_context(booking=booking), autoescape=True)
+        rendered = []
+        for kind, payment_status in variants:
+            with context.push(payment_status=payment_status):
+                rendered.append(cls.render(kind, context))
+        return rendered
+
+
+@receiver(setting_changed)
+def _reset_templates(setting, **kwargs):
+    if setting == 'TEMPLATES':
+        EmailRenderer._compiled.clear()
@@ -1,58 +1,140 @@
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from datetime import timedelta
+import math
+
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.conf import settings
+from django.template import Context
+from django.utils import timezone
 import logging
 
+from .email_renderer import EmailRenderer
+
 logger = logging.getLogger(__name__)
 
 
 class EmailService:
+    """Booking and payment notifications.
+
+    With `settings.EMAIL_OUTBOX_ENABLED` the `send_*` methods only queue the notification in the
+    `EmailOutbox` table (see `rides.services.outbox`); `manage.py send_outbox` renders and
+    delivers it later. Otherwise they render and send over SMTP immediately, as before.
+
+    With the outbox and `settings.OWNER_DIGEST_ENABLED`, owner notifications that are not
+    urgent are held until the end of the current `OWNER_DIGEST_WINDOW` (seconds) and sent as
+    one digest email. A booking is urgent when its pickup is within `OWNER_DIGEST_URGENT_MINUTES`
+    or it has no pickup time (as soon as possible); urgent notifications are sent on their own.
+    """
+
+    KIND_OWNER = 'owner'
+    KIND_CUSTOMER = 'customer'
+    KIND_PAYMENT_CONFIRMATION = 'payment_confirmation'
+    KIND_OWNER_DIGEST = 'owner_digest'
+
     @staticmethod
-    def send_owner_notification(booking, payment_status: str = "UNPAID"):
-        subject = f"New ride booking: {booking.id}"
-        context = {"booking": booking, "payment_status": payment_status, "taxi_owner_phone": settings.TAXI_OWNER_PHONE}
+    def _outbox_enabled() -> bool:
+        return getattr(settings, 'EMAIL_OUTBOX_ENABLED', False)
 
-        text = render_to_string("rides/email_owner.txt", context)
-        html = render_to_string("rides/email_owner.html", context)
+    @staticmethod
+    def _digest_enabled() -> bool:
+        return getattr(settings, 'OWNER_DIGEST_ENABLED', False)
 
+    @staticmethod
+    def is_urgent(booking) -> bool:
+        if booking.pickup_at is None:
+            return True
+        minutes = getattr(settings, 'OWNER_DIGEST_URGENT_MINUTES', 120)
+        return booking.pickup_at - timezone.now() <= timedelta(minutes=minutes)
+
+    @staticmethod
+    def digest_send_at():
+        """End of the current digest window; every notification queued in the window waits until then."""
+        window = getattr(settings, 'OWNER_DIGEST_WINDOW', 900)
+        now = timezone.now()
+        return now + timedelta(seconds=math.ceil(now.timestamp() / window) * window - now.timestamp())
+
+    @classmethod
+    def _envelope(cls, kind: str, booking) -> tuple:
+        """(subject, recipient) for one notification kind."""
+        if kind == cls.KIND_OWNER:
+            return f"New ride booking: {booking.id}", settings.TAXI_OWNER_EMAIL
+        if kind == cls.KIND_CUSTOMER:
+            return f"Your booking: {booking.id}", booking.email
+        if kind == cls.KIND_PAYMENT_CONFIRMATION:
+            return f"Payment confirmed for booking: {booking.id}", booking.email
+        raise ValueError(f"Unknown email kind: {kind}")
+
+    @staticmethod
+    def _message(kind: str, to: str, subject: str, text: str, html: str, connection=None) -> EmailMultiAlternatives:
         # In debug mode, log the rendered email to the console for visibility
         if settings.DEBUG:
-            logger.info('Sending owner email to %s: %s', settings.TAXI_OWNER_EMAIL, subject)
-            print('\n--- Owner email (text) ---\n')
+            logger.info('Sending %s email to %s: %s', kind, to, subject)
+            print(f'\n--- {kind} email (text) ---\n')
             print(text)
-            print('\n--- Owner email (html truncated) ---\n')
+            print(f'\n--- {kind} email (html truncated) ---\n')
             print((html or '')[:2000])
 
-        send_mail(subject, text, settings.DEFAULT_FROM_EMAIL, [settings.TAXI_OWNER_EMAIL], html_message=html)
+        message = EmailMultiAlternatives(subject, text, settings.DEFAULT_FROM_EMAIL, [to], connection=connection)
+        message.attach_alternative(html, "text/html")
+        return message
 
-    @staticmethod
-    def send_customer_notification(booking, payment_status: str = "UNPAID"):
-        subject = f"Your booking: {booking.id}"
-        context = {"booking": booking, "payment_status": payment_status, "taxi_owner_phone": settings.TAXI_OWNER_PHONE}
+    @classmethod
+    def build_messages(cls, booking, variants, connection=None) -> list:
+        """Render [(kind, payment_status), ...] for one booking in one pass (not sent)."""
+        variants = list(variants)
+        envelopes = [cls._envelope(kind, booking) for kind, _ in variants]
+        rendered = EmailRenderer.render_event(booking, variants)
+        return [
+            cls._message(kind, to, subject, text, html, connection=connection)
+            for (kind, _), (subject, to), (text, html) in zip(variants, envelopes, rendered)
+        ]
 
-        text = render_to_string("rides/email_customer.txt", context)
-        html = render_to_string("rides/email_customer.html", context)
+    @classmethod
+    def build_message(cls, kind: str, booking, payment_status: str = None, connection=None) -> EmailMultiAlternatives:
+        """Render one notification as a text+HTML message (not sent)."""
+        return cls.build_messages(booking, [(kind, payment_status)], connection=connection)[0]
 
-        if settings.DEBUG:
-            logger.info('Sending customer email to %s: %s', booking.email, subject)
-            print('\n--- Customer email (text) ---\n')
-            print(text)
-            print('\n--- Customer email (html truncated) ---\n')
-            print((html or '')[:2000])
+    @classmethod
+    def build_digest(cls, items, connection=None) -> EmailMultiAlternatives:
+        """Render one owner email for [(booking, payment_status), ...], soonest pickup first."""
+        items = sorted(
+            ({"booking": booking, "payment_status": payment_status} for booking, payment_status in items),
+            key=lambda i: (i["booking"].pickup_at is not None, i["booking"].pickup_at or i["booking"].created_at),
+        )
+        subject = f"{len(items)} ride booking update{'s' if len(items) != 1 else ''}"
+        context = Context(EmailRenderer.shared_context(items=items), autoescape=True)
+        text, html = EmailRenderer.render(cls.KIND_OWNER_DIGEST, context)
+        return cls._message(cls.KIND_OWNER_DIGEST, settings.TAXI_OWNER_EMAIL, subject, text, html, connection=connection)
 
-        send_mail(subject, text, settings.DEFAULT_FROM_EMAIL, [booking.email], html_message=html)
+    @classmethod
+    def _send(cls, kind: str, booking, payment_status: str = None):
+        if cls._outbox_enabled():
+            from .outbox import OutboxService
+            if kind == cls.KIND_OWNER and cls._digest_enabled() and not cls.is_urgent(booking):
+                OutboxService.enqueue(cls.KIND_OWNER_DIGEST, booking, payment_status=payment_status, send_at=cls.digest_send_at())
+            else:
+                OutboxService.enqueue(kind, booking, payment_status=payment_status)
+            return
+        cls.build_message(kind, booking, payment_status).send()
+
+    @classmethod
+    def send_booking_notifications(cls, booking, payment_status: str = "UNPAID"):
+        """Owner and customer notifications for one booking, rendered in one pass and sent over one connection."""
+        variants = [(cls.KIND_OWNER, payment_status), (cls.KIND_CUSTOMER, payment_status)]
+        if cls._outbox_enabled():
+            for kind, status in variants:
+                cls._send(kind, booking, status)
+            return
+        connection = get_connection()
+        connection.send_messages(cls.build_messages(booking, variants, connection=connection))
 
     @staticmethod
-    def send_payment_confirmation(booking):
-        subject = f"Payment confirmed for booking: {booking.id}"
-        context = {"booking": booking}
-        text = render_to_string("rides/email_payment_confirm.txt", context)
-        html = render_to_string("rides/email_payment_confirm.html", context)
-        if settings.DEBUG:
-            logger.info('Sending payment confirmation to %s: %s', booking.email, subject)
-            print('\n--- Payment confirmation (text) ---\n')
-            print(text)
-            print('\n--- Payment confirmation (html truncated) ---\n')
-            print((html or '')[:2000])
+    def send_owner_notification(booking, payment_status: str = "UNPAID"):
+        EmailService._send(EmailService.KIND_OWNER, booking, payment_status)
 
-        send_mail(subject, text, settings.DEFAULT_FROM_EMAIL, [booking.email], html_message=html)
+    @staticmethod
+    def send_customer_notification(booking, payment_status: str = "UNPAID"):
+        EmailService._send(EmailService.KIND_CUSTOMER, booking, payment_status)
+
+    @staticmethod
+    def send_payment_confirmation(booking):
+        EmailService._send(EmailService.KIND_PAYMENT_CONFIRMATION, booking)
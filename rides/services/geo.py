@@ -0,0 +1,60 @@
+"""Coordinate quantization helpers used to build distance cache keys.
+
+Two points in the same cell share a cache key, so nearby customers (same hotel, same
+street) reuse one Distance Matrix result. Cells are either a metric grid or a geohash.
+"""
+from typing import Tuple
+import math
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def grid_cell(lat: float, lng: float, cell_m: float) -> Tuple[int, int]:
+    """Return integer (row, col) indices of the roughly `cell_m` x `cell_m` cell containing the point.
+
+    Rows are fixed-height bands of latitude; the column width is computed at the band's centre
+    latitude so cells stay close to square away from the equator.
+    """
+    dlat = cell_m / METERS_PER_DEGREE_LAT
+    row = math.floor(lat / dlat)
+    centre_lat = (row + 0.5) * dlat
+    dlng = cell_m / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(centre_lat)), 0.01))
+    col = math.floor(lng / dlng)
+    return row, col
+
+
+def geohash_encode(lat: float, lng: float, precision: int) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_cell_size_m(lat: float, precision: int) -> Tuple[float, float]:
+    """Return (height_m, width_m) of a geohash cell of the given precision at latitude `lat`."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    height = (180.0 / 2 ** lat_bits) * METERS_PER_DEGREE_LAT
+    width = (360.0 / 2 ** lng_bits) * METERS_PER_DEGREE_LAT * math.cos(math.radians(lat))
+    return height, width
@@ -0,0 +1,288 @@
+"""Process-wide pooled HTTP clients for upstream APIs (Google, Paynow).
+
+Each named client is a `requests.Session` created once per process, with keep-alive connection
+pooling (bounded per host), a urllib3 retry/backoff policy and default timeouts, so repeated
+calls reuse TCP+TLS connections instead of handshaking on every request. Each client also has a
+circuit breaker (see `rides.services.circuit`) that fails fast while its upstream is degraded.
+
+Per-client settings can be overridden with `settings.HTTP_CLIENTS`, e.g.
+    HTTP_CLIENTS = {"paynow": {"pool_maxsize": 20, "read_timeout": 20}}
+
+For ASGI views, `arequest` is the async counterpart: it uses a pooled `httpx.AsyncClient` per
+event loop when httpx is installed, so one process can hold many upstream calls in flight, and
+otherwise runs the pooled `requests` session in a worker thread.
+
+`request_capped` and `arequest(..., max_bytes=...)` stream the body and stop reading after
+`max_bytes`, for replies that should be small (e.g. Paynow status messages).
+"""
+import asyncio
+import json
+import logging
+import threading
+import weakref
+from typing import Iterable, Tuple
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .circuit import CircuitBreaker, get_breaker
+
+try:
+    import httpx
+except ImportError:  # optional; async calls fall back to the requests session in a thread
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIENT_CONFIG = {
+    # Connections kept alive per host; requests beyond this open short-lived extra connections
+    "pool_maxsize": 10,
+    "connect_timeout": 3.05,
+    "read_timeout": 10,
+    # Connection failures are always safe to retry; status retries only apply to idempotent methods
+    "connect_retries": 2,
+    "status_retries": 1,
+    "backoff_factor": 0.2,
+    "status_forcelist": (502, 503, 504),
+    # Upper bound on concurrent connections per async client (event loop)
+    "async_max_connections": 100,
+}
+
+CLIENT_DEFAULTS = {
+    # Read retries are disabled so GOOGLE_DISTANCE_TIMEOUT stays a real latency budget
+    "google": {},
+    # Never retry a POST whose body may have reached Paynow (initiation is not idempotent)
+    "paynow": {"read_timeout": 15},
+}
+
+_sessions = {}
+_lock = threading.Lock()
+# event loop -> {(name, verify): httpx.AsyncClient}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class PooledSession(requests.Session):
+    """Session applying a default (connect, read) timeout when the caller passes none.
+
+    When a circuit breaker is attached, calls raise `CircuitOpenError` without touching the
+    network while the circuit is open; transport errors and 5xx responses count as failures.
+    """
+
+    def __init__(self, default_timeout, breaker: CircuitBreaker = None):
+        super().__init__()
+        self.default_timeout = default_timeout
+        self.breaker = breaker
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        if self.breaker is None:
+            return super().request(method, url, **kwargs)
+
+        self.breaker.before_call()
+        try:
+            resp = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
+
+class CappedResponse:
+    """Response whose body was read up to a byte limit; `truncated` is True if it was cut off."""
+
+    def __init__(self, status_code: int, content: bytes, truncated: bool, encoding: str = None):
+        self.status_code = status_code
+        self.content = content
+        self.truncated = truncated
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def read_capped(chunks: Iterable[bytes], max_bytes: int) -> Tuple[bytes, bool]:
+    """Join body chunks, stopping once more than `max_bytes` arrived; returns (body, truncated)."""
+    body = bytearray()
+    for chunk in chunks:
+        body += chunk
+        if len(body) > max_bytes:
+            return bytes(body[:max_bytes]), True
+    return bytes(body), False
+
+
+def client_config(name: str) -> dict:
+    config = dict(DEFAULT_CLIENT_CONFIG)
+    config.update(CLIENT_DEFAULTS.get(name, {}))
+    config.update(getattr(settings, "HTTP_CLIENTS", {}).get(name, {}))
+    return config
+
+
+def _build_session(name: str) -> PooledSession:
+    config = client_config(name)
+    retry = Retry(
+        total=None,
+        connect=config["connect_retries"],
+        read=0,
+        status=config["status_retries"],
+        backoff_factor=config["backoff_factor"],
+        status_forcelist=config["status_forcelist"],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config["pool_maxsize"], max_retries=retry)
+    session = PooledSession(default_timeout=(config["connect_timeout"], config["read_timeout"]), breaker=get_breaker(name))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    logger.debug("Created pooled HTTP client %s: %s", name, config)
+    return session
+
+
+def get_session(name: str) -> PooledSession:
+    """Return the process-wide pooled session for `name`, creating it on first use."""
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _sessions[name] = _build_session(name)
+    return session
+
+
+def request_capped(name: str, method: str, url: str, max_bytes: int, **kwargs) -> CappedResponse:
+    """Request through `get_session(name)`, reading at most `max_bytes` of the body."""
+    resp = get_session(name).request(method, url, stream=True, **kwargs)
+    try:
+        content, truncated = read_capped(resp.iter_content(chunk_size=1024), max_bytes)
+    finally:
+        resp.close()
+    return CappedResponse(resp.status_code, content, truncated, resp.encoding)
+
+
+def close_all() -> None:
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class SDKTransport:
+    """Stand-in for the `requests` module inside a third-party SDK.
+
+    The Paynow SDK calls module-level `requests.post`, which opens a new connection per call.
+    Replacing the SDK module's `requests` reference with this object routes those calls through
+    a pooled session (with its default timeout); every other attribute resolves to `requests`.
+    """
+
+    def __init__(self, session: requests.Session):
+        self._session = session
+
+    def get(self, url, **kwargs):
+        return self._session.get(url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self._session.post(url, data=data, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def install_sdk_transport(module, name: str) -> None:
+    """Point `module.requests` at the pooled client `name` (idempotent)."""
+    if not isinstance(getattr(module, "requests", None), SDKTransport):
+        module.requests = SDKTransport(get_session(name))
+
+
+def _get_async_client(name: str, verify: bool = True):
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get((name, verify))
+    if client is None:
+        config = client_config(name)
+        client = clients[(name, verify)] = httpx.AsyncClient(
+            timeout=httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"]),
+            limits=httpx.Limits(
+                max_connections=config["async_max_connections"],
+                max_keepalive_connections=config["pool_maxsize"],
+            ),
+            # httpx transport retries cover connection failures only, like `connect_retries`
+            transport=httpx.AsyncHTTPTransport(verify=verify, retries=config["connect_retries"]),
+        )
+        logger.debug("Created async HTTP client %s (verify=%s)", name, verify)
+    return client
+
+
+def _httpx_timeout(timeout):
+    if timeout is None:
+        return None
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+async def arequest(name: str, method: str, url: str, *, params=None, data=None, timeout=None, verify: bool = True, allow_redirects: bool = True, max_bytes: int = None):
+    """Async request through client `name`, guarded by the same circuit breaker as `get_session`.
+
+    Takes requests-style arguments and raises `requests` exceptions (Timeout, ConnectionError,
+    RequestException) so callers handle both paths the same way. The response exposes
+    `status_code`, `text` and `json()`; check `status_code` instead of `raise_for_status()`.
+    With `max_bytes`, the body is streamed and read only up to that size (a `CappedResponse`).
+    """
+    if httpx is None:
+        if max_bytes is not None:
+            return await sync_to_async(request_capped, thread_sensitive=False)(
+                name, method, url, max_bytes, params=params, data=data, timeout=timeout, verify=verify, allow_redirects=allow_redirects,
+            )
+        session = get_session(name)
+        return await sync_to_async(session.request, thread_sensitive=False)(
+            method, url, params=params, data=data, timeout=timeout, verify=verify, allow_redirects=allow_redirects,
+        )
+
+    breaker = get_breaker(name)
+    await sync_to_async(breaker.before_call)()
+    client = _get_async_client(name, verify)
+    kwargs = {"params": params, "data": data, "follow_redirects": allow_redirects}
+    if timeout is not None:
+        kwargs["timeout"] = _httpx_timeout(timeout)
+    try:
+        if max_bytes is None:
+            resp = await client.request(method, url, **kwargs)
+        else:
+            async with client.stream(method, url, **kwargs) as streamed:
+                content, truncated = bytearray(), False
+                async for chunk in streamed.aiter_bytes():
+                    content += chunk
+                    if len(content) > max_bytes:
+                        content, truncated = content[:max_bytes], True
+                        break
+                resp = CappedResponse(streamed.status_code, bytes(content), truncated, streamed.encoding)
+    except httpx.HTTPError as exc:
+        await sync_to_async(breaker.record_failure)()
+        if isinstance(exc, httpx.TimeoutException):
+            raise requests.Timeout(str(exc)) from exc
+        if isinstance(exc, httpx.TransportError):
+            raise requests.ConnectionError(str(exc)) from exc
+        raise requests.RequestException(str(exc)) from exc
+    if resp.status_code >= 500:
+        await sync_to_async(breaker.record_failure)()
+    else:
+        await sync_to_async(breaker.record_success)()
+    return resp
+
+
+async def aclose_all() -> None:
+    """Close the async clients of the running event loop (e.g. on ASGI lifespan shutdown)."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
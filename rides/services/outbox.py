@@ -0,0 +1,143 @@
+"""Email outbox: notifications are queued in the request and delivered by a background worker.
+
+`EmailService.send_*` call `OutboxService.enqueue` when `settings.EMAIL_OUTBOX_ENABLED` is
+True, which only inserts an `EmailOutbox` row (in the caller's transaction). The
+`send_outbox` management command claims due rows in batches, renders them and sends each
+batch over one SMTP connection. Failed rows are retried with exponential backoff
+(`EMAIL_OUTBOX_RETRY_BASE` doubling up to `EMAIL_OUTBOX_RETRY_MAX` seconds) and marked FAILED
+after `EMAIL_OUTBOX_MAX_ATTEMPTS` attempts.
+
+Rows are claimed with a conditional UPDATE that pushes `next_attempt_at` out by
+`EMAIL_OUTBOX_LEASE` seconds, so several workers can run without sending a message twice, and
+a worker that dies mid-batch only delays its rows until the lease expires.
+
+Owner digest rows (`EmailService.KIND_OWNER_DIGEST`) are queued with `next_attempt_at` at
+the end of their digest window; the due ones in a batch are rendered into one email and
+succeed or fail together.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from rides.models import EmailOutbox
+from .email_service import EmailService
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxService:
+    @staticmethod
+    def enqueue(kind: str, booking, payment_status: str = None, send_at=None) -> EmailOutbox:
+        return EmailOutbox.objects.create(kind=kind, booking=booking, payment_status=payment_status, next_attempt_at=send_at or timezone.now())
+
+    @staticmethod
+    def retry_delay(attempts: int) -> timedelta:
+        base = getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE', 30)
+        cap = getattr(settings, 'EMAIL_OUTBOX_RETRY_MAX', 3600)
+        return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+    @staticmethod
+    def claim(limit: int) -> list:
+        """Lease up to `limit` due rows to this worker, oldest first."""
+        now = timezone.now()
+        lease_until = now + timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LEASE', 300))
+        due = (
+            EmailOutbox.objects.filter(status=EmailOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', 'next_attempt_at')[:limit]
+        )
+        claimed = [
+            pk for pk, next_attempt_at in due
+            # Loses the race (updates 0 rows) if another worker claimed the row first
+            if EmailOutbox.objects.filter(pk=pk, status=EmailOutbox.STATUS_PENDING, next_attempt_at=next_attempt_at).update(next_attempt_at=lease_until)
+        ]
+        return list(EmailOutbox.objects.filter(pk__in=claimed).select_related('booking').order_by('id'))
+
+    @classmethod
+    def _record_failure(cls, row: EmailOutbox, exc: Exception) -> str:
+        attempts = row.attempts + 1
+        if attempts >= getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 8):
+            status = EmailOutbox.STATUS_FAILED
+            logger.error('Giving up on %s email %s after %s attempts: %s', row.kind, row.pk, attempts, exc)
+        else:
+            status = EmailOutbox.STATUS_PENDING
+        EmailOutbox.objects.filter(pk=row.pk).update(
+            status=status,
+            attempts=attempts,
+            last_error=str(exc)[:2000],
+            next_attempt_at=timezone.now() + cls.retry_delay(attempts),
+        )
+        return 'failed' if status == EmailOutbox.STATUS_FAILED else 'retried'
+
+    @classmethod
+    def deliver_batch(cls, limit: int = None, connection=None) -> dict:
+        """Send one batch of due emails over a single connection; returns counts by outcome."""
+        limit = limit or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+        counts = {'sent': 0, 'retried': 0, 'failed': 0}
+        rows = cls.claim(limit)
+        if not rows:
+            return counts
+
+        connection = connection or get_connection()
+        # Render all of a booking's emails in one pass; owner digest rows become one email
+        digest = [row for row in rows if row.kind == EmailService.KIND_OWNER_DIGEST]
+        by_booking = {}
+        for row in rows:
+            if row.kind != EmailService.KIND_OWNER_DIGEST:
+                by_booking.setdefault(row.booking_id, []).append(row)
+
+        jobs = []
+        for group in by_booking.values():
+            try:
+                messages = EmailService.build_messages(group[0].booking, [(row.kind, row.payment_status) for row in group], connection=connection)
+            except Exception as exc:
+                logger.exception('Failed to render emails %s', [row.pk for row in group])
+                for row in group:
+                    counts[cls._record_failure(row, exc)] += 1
+                continue
+            jobs.extend(([row], message) for row, message in zip(group, messages))
+        if digest:
+            try:
+                jobs.append((digest, EmailService.build_digest([(row.booking, row.payment_status) for row in digest], connection=connection)))
+            except Exception as exc:
+                logger.exception('Failed to render owner digest %s', [row.pk for row in digest])
+                for row in digest:
+                    counts[cls._record_failure(row, exc)] += 1
+
+        if not jobs:
+            return counts
+        try:
+            connection.open()
+        except Exception as exc:
+            logger.exception('Unable to open email connection; rescheduling %s emails', len(jobs))
+            for job, _ in jobs:
+                for row in job:
+                    counts[cls._record_failure(row, exc)] += 1
+            return counts
+
+        try:
+            for job, message in jobs:
+                try:
+                    connection.send_messages([message])
+                except Exception as exc:
+                    logger.exception('Failed to send %s email %s (attempt %s)', job[0].kind, [row.pk for row in job], job[0].attempts + 1)
+                    for row in job:
+                        counts[cls._record_failure(row, exc)] += 1
+                    # The server may have dropped the session; start a fresh one for the rest
+                    try:
+                        connection.close()
+                        connection.open()
+                    except Exception:
+                        logger.exception('Failed to reopen email connection (non-fatal)')
+                    continue
+                EmailOutbox.objects.filter(pk__in=[row.pk for row in job]).update(
+                    status=EmailOutbox.STATUS_SENT, attempts=F('attempts') + 1, sent_at=timezone.now(), last_error='',
+                )
+                counts['sent'] += len(job)
+        finally:
+            connection.close()
+        return counts
@@ -0,0 +1,104 @@
+"""Payment status change notifications for the long-poll status endpoint.
+
+`PaymentStateService` publishes every transition it makes (after the transaction commits):
+the new status is written to the local and shared caches under `paynow:status:<payment id>`
+and waiters in the same process are woken at once. `wait` / `await_change` return as soon as
+the status differs from the one the browser last saw, or after the timeout.
+
+Waiters re-check the local (in-memory) cache every `PAYMENT_WAIT_INTERVAL` seconds, which
+runs no SQL. A local entry lives for `PAYMENT_WAIT_REFRESH` seconds; after that the next
+reader in the process fetches the status from the shared cache (or, the first time, from the
+Payment row) and re-primes it. So however many pages wait on one payment, a process reads the
+database for it at most once per `PAYMENT_WAIT_REFRESH`, and a transition made in another
+process is seen within that time.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from rides.cache import shared_cache
+from rides.models import Payment
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentEvents:
+    KEY_PREFIX = "paynow:status:"
+
+    _changed = threading.Condition()
+
+    @classmethod
+    def key(cls, payment_id) -> str:
+        return f"{cls.KEY_PREFIX}{payment_id}"
+
+    @staticmethod
+    def _local_timeout() -> float:
+        return getattr(settings, "PAYMENT_WAIT_REFRESH", 5)
+
+    @classmethod
+    def publish(cls, payment_id, status: str) -> None:
+        cache.set(cls.key(payment_id), status, timeout=cls._local_timeout())
+        try:
+            shared_cache().set(cls.key(payment_id), status, timeout=getattr(settings, "PAYMENT_EVENT_TTL", 3600))
+        except Exception:
+            logger.exception("Failed to publish status of payment %s (non-fatal)", payment_id)
+        with cls._changed:
+            cls._changed.notify_all()
+
+    @classmethod
+    def current(cls, payment_id) -> Optional[str]:
+        """Latest known status of a payment, or None if it does not exist."""
+        key = cls.key(payment_id)
+        status = cache.get(key)
+        if status is not None:
+            return status
+        try:
+            status = shared_cache().get(key)
+        except Exception:
+            logger.debug("Payment status cache lookup failed (non-fatal)", exc_info=True)
+            status = None
+        if status is None:
+            status = Payment.objects.filter(pk=payment_id).values_list("status", flat=True).first()
+            if status is not None:
+                try:
+                    # add, not set: never overwrite a transition published since our read
+                    shared_cache().add(key, status, timeout=getattr(settings, "PAYMENT_EVENT_TTL", 3600))
+                except Exception:
+                    logger.debug("Failed to prime payment status cache (non-fatal)", exc_info=True)
+        if status is not None:
+            cache.add(key, status, timeout=cls._local_timeout())
+        return status
+
+    @classmethod
+    def wait(cls, payment_id, last_status: Optional[str], timeout: float) -> Optional[str]:
+        """Block until the status differs from `last_status` or `timeout` elapses; returns the status."""
+        interval = getattr(settings, "PAYMENT_WAIT_INTERVAL", 1.0)
+        deadline = time.monotonic() + timeout
+        while True:
+            status = cls.current(payment_id)
+            remaining = deadline - time.monotonic()
+            if status is None or status != last_status or remaining <= 0:
+                return status
+            with cls._changed:
+                cls._changed.wait(min(interval, remaining))
+
+    @classmethod
+    async def await_change(cls, payment_id, last_status: Optional[str], timeout: float) -> Optional[str]:
+        """Async `wait`: checks the local cache every PAYMENT_WAIT_INTERVAL seconds without holding a thread."""
+        interval = getattr(settings, "PAYMENT_WAIT_INTERVAL", 1.0)
+        deadline = time.monotonic() + timeout
+        while True:
+            # A local hit needs no thread; only a refresh from the shared tier does
+            status = cache.get(cls.key(payment_id))
+            if status is None:
+                status = await sync_to_async(cls.current)(payment_id)
+            remaining = deadline - time.monotonic()
+            if status is None or status != last_status or remaining <= 0:
+                return status
+            await asyncio.sleep(min(interval, remaining))
@@ -0,0 +1,107 @@
+"""Alias index for resolving Paynow notifications to payments.
+
+Every identifier a payment is known by is stored as a `PaymentReference` row: our payment id
+(sent to Paynow as the merchant reference), the Paynow reference and the GUID of the poll
+URL. Rows are added when a payment is saved (`rides.signals`), when Paynow answers the
+initiation and when a webhook brings a new identifier. `resolve` then finds the payment for
+any of a webhook's candidate identifiers with one indexed query.
+
+The helpers below also read the poll URL, redirect URL and status out of Paynow's initiation
+response, wherever the SDK or the HTTP fallback put them. `fill_from_response` copies them
+into the payment's own columns once, when the response is saved.
+"""
+import logging
+from typing import Iterable, Optional
+from urllib.parse import parse_qs, urlparse
+
+from rides.models import Payment, PaymentReference
+
+logger = logging.getLogger(__name__)
+
+
+def poll_url_from_response(pr: Optional[dict]) -> Optional[str]:
+    """The poll URL from a stored Paynow initiation response, wherever the SDK put it."""
+    pr = pr or {}
+    response = pr.get('response') or {}
+    return pr.get('pollUrl') or pr.get('poll_url') or response.get('poll_url') or response.get('pollUrl') or response.get('data', {}).get('poll_url')
+
+
+def redirect_url_from_response(pr: Optional[dict]) -> Optional[str]:
+    pr = pr or {}
+    return pr.get('redirectUrl') or pr.get('redirect_url') or (pr.get('response') or {}).get('redirect_url')
+
+
+def upstream_status_from_response(pr: Optional[dict]) -> Optional[str]:
+    pr = pr or {}
+    status = (pr.get('response') or {}).get('status') or pr.get('status')
+    return str(status)[:64] if status else None
+
+
+def fill_from_response(payment: Payment) -> None:
+    """Set the poll_url / redirect_url / upstream_status columns still empty from paynow_response."""
+    pr = payment.paynow_response
+    if not isinstance(pr, dict):
+        return
+    payment.poll_url = payment.poll_url or poll_url_from_response(pr)
+    payment.redirect_url = payment.redirect_url or redirect_url_from_response(pr)
+    payment.upstream_status = payment.upstream_status or upstream_status_from_response(pr)
+
+
+def poll_url_for(payment: Payment) -> Optional[str]:
+    """Find the URL Paynow exposes for checking this payment, or None."""
+    poll_url = payment.poll_url
+
+    # As a last resort attempt to compose a Paynow check URL using the paynow_reference
+    if not poll_url and payment.paynow_reference:
+        poll_url = f"https://www.paynow.co.zw/Interface/CheckPayment/?guid={payment.paynow_reference}"
+    return poll_url
+
+
+def poll_guid(poll_url: Optional[str]) -> Optional[str]:
+    if not poll_url:
+        return None
+    try:
+        return (parse_qs(urlparse(poll_url).query).get('guid') or [None])[0]
+    except ValueError:
+        return None
+
+
+class PaymentReferenceService:
+    @staticmethod
+    def aliases_for(payment: Payment) -> list:
+        """(alias, kind) pairs known from the payment row itself."""
+        aliases = [(str(payment.pk), PaymentReference.KIND_LOCAL)]
+        if payment.paynow_reference:
+            aliases.append((payment.paynow_reference, PaymentReference.KIND_PAYNOW))
+        # Paynow's own reference can also sit in the stored initiation response
+        pr = payment.paynow_response or {}
+        data = (pr.get('response') or {}).get('data') or {}
+        for key in ('paynowreference', 'paynow_reference', 'paynowReference'):
+            for source in (pr, data):
+                if source.get(key):
+                    aliases.append((str(source[key]), PaymentReference.KIND_PAYNOW))
+        guid = poll_guid(payment.poll_url or poll_url_from_response(pr))
+        if guid:
+            aliases.append((guid, PaymentReference.KIND_POLL))
+        return aliases
+
+    @staticmethod
+    def register(payment_id, aliases: Iterable) -> None:
+        """Index (alias, kind) pairs for a payment; existing pairs are left alone."""
+        rows = [PaymentReference(payment_id=payment_id, alias=str(alias)[:255], kind=kind) for alias, kind in aliases if alias]
+        if rows:
+            PaymentReference.objects.bulk_create(rows, ignore_conflicts=True)
+
+    @staticmethod
+    def resolve(candidates: Iterable[Optional[str]]) -> Optional[Payment]:
+        """The payment for the first candidate identifier that is indexed, in one query."""
+        candidates = [str(c) for c in candidates if c]
+        if not candidates:
+            return None
+        matches = {}
+        for ref in PaymentReference.objects.filter(alias__in=candidates).select_related('payment').order_by('-payment__created_at'):
+            matches.setdefault(ref.alias, ref.payment)
+        for alias in candidates:
+            if alias in matches:
+                return matches[alias]
+        return None
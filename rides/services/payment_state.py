@@ -0,0 +1,66 @@
+"""Payment status transitions as conditional UPDATEs.
+
+Each transition is one `UPDATE rides_payment SET status=... WHERE id=... AND status IN (...)`
+and, when it applies, one `UPDATE rides_ridebooking ... WHERE id = (SELECT booking_id ...)`
+in the same transaction. No row is read or locked first. The row count tells the caller
+whether it made the transition: when a webhook and a poll race to mark a payment PAID,
+exactly one of them gets True and sends the confirmation emails.
+
+Allowed transitions:
+    PENDING/FAILED -> PAID     (booking -> CONFIRMED; Paynow may report success after a failure)
+    PENDING/FAILED -> FAILED   (records the latest upstream response)
+PAID is final.
+
+Every transition made is published to `PaymentEvents` once the transaction commits, which
+wakes pages long-polling the payment's status.
+"""
+import logging
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from rides.models import Payment, RideBooking
+from .payment_events import PaymentEvents
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = (Payment.STATUS_PENDING, Payment.STATUS_FAILED)
+
+
+class PaymentStateService:
+    @staticmethod
+    def mark_paid(payment_id) -> bool:
+        """PENDING/FAILED -> PAID and confirm the booking; True if this call made the transition."""
+        now = timezone.now()
+        with transaction.atomic():
+            won = Payment.objects.filter(pk=payment_id, status__in=OPEN_STATUSES).update(status=Payment.STATUS_PAID, updated_at=now)
+            if won:
+                RideBooking.objects.filter(pk__in=Payment.objects.filter(pk=payment_id).values('booking_id')).update(
+                    status=RideBooking.STATUS_CONFIRMED, updated_at=now,
+                )
+        if won:
+            logger.info('Payment %s marked PAID', payment_id)
+            transaction.on_commit(lambda: PaymentEvents.publish(payment_id, Payment.STATUS_PAID))
+        return bool(won)
+
+    @staticmethod
+    def mark_failed(payment_id, paynow_response: Optional[dict] = None, upstream_status: Optional[str] = None) -> bool:
+        """PENDING/FAILED -> FAILED, optionally replacing paynow_response; False if already PAID."""
+        fields = {'status': Payment.STATUS_FAILED, 'updated_at': timezone.now()}
+        if paynow_response is not None:
+            fields['paynow_response'] = paynow_response
+        if upstream_status:
+            fields['upstream_status'] = upstream_status[:64]
+        won = Payment.objects.filter(pk=payment_id, status__in=OPEN_STATUSES).update(**fields)
+        if won:
+            transaction.on_commit(lambda: PaymentEvents.publish(payment_id, Payment.STATUS_FAILED))
+        return bool(won)
+
+    @staticmethod
+    def record_response(payment_id, paynow_response: dict, upstream_status: Optional[str] = None) -> bool:
+        """Store an intermediate upstream response on a payment that is not PAID; status is unchanged."""
+        fields = {'paynow_response': paynow_response, 'updated_at': timezone.now()}
+        if upstream_status:
+            fields['upstream_status'] = upstream_status[:64]
+        return bool(Payment.objects.filter(pk=payment_id, status__in=OPEN_STATUSES).update(**fields))
@@ -6,6 +6,12 @@ from django.conf import settings
 import logging
 import time
 
+from asgiref.sync import sync_to_async
+
+from .circuit import get_breaker
+from .http import arequest, get_session, install_sdk_transport, request_capped
+from .paynow_status import PaynowStatusError, parse_status
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,25 +29,48 @@ class PaynowService:
 
     CREATE_URL = "https://www.paynow.co.zw/interface/initiatetransaction"
 
+    # SDK clients reused across requests in this process, keyed by class and credentials
+    _sdk_clients = {}
+
     def __init__(self):
         self.integration_id = settings.PAYNOW_INTEGRATION_ID
         self.integration_key = settings.PAYNOW_INTEGRATION_KEY
         self.return_url = settings.PAYNOW_RETURN_URL
         self.result_url = settings.PAYNOW_RESULT_URL
 
+    def _sdk_client(self):
+        """Return a process-wide Paynow SDK client whose HTTP calls use the pooled 'paynow' session."""
+        import paynow.model
+        from paynow import Paynow
+
+        install_sdk_transport(paynow.model, 'paynow')
+        key = (Paynow, self.integration_id, self.integration_key, self.return_url, self.result_url)
+        client = PaynowService._sdk_clients.get(key)
+        if client is None:
+            client = PaynowService._sdk_clients[key] = Paynow(self.integration_id, self.integration_key, self.return_url, self.result_url)
+        return client
+
     def create_transaction(self, amount: float, reference: str, email: str, phone: str, return_url: str = None) -> dict:
        
         if not self.integration_id or not self.integration_key:
             raise RuntimeError("Paynow integration credentials not set")
 
+        # While Paynow is failing, don't tie up the worker on the SDK and HTTP attempts
+        if get_breaker('paynow').is_open():
+            logger.warning('Paynow circuit open; not initiating payment %s', reference)
+            return {
+                'reference': reference,
+                'redirectUrl': None,
+                'raw_response': '',
+                'status_code': None,
+                'error': 'circuit_open',
+                'message': 'Paynow is temporarily unavailable',
+            }
+
         # Try to use the paynow library if available
         # 
         try:
-            from paynow import Paynow
-            paynow = Paynow(self.integration_id,
-                             self.integration_key,
-                             self.return_url, 
-                             self.result_url)
+            paynow = self._sdk_client()
 
     
 
@@ -164,7 +193,7 @@ class PaynowService:
             verify_ssl = getattr(settings, 'PAYNOW_VERIFY_SSL', True)
 
             try:
-                resp = requests.post(self.CREATE_URL, data=payload, timeout=15, verify=verify_ssl)
+                resp = get_session('paynow').post(self.CREATE_URL, data=payload, timeout=15, verify=verify_ssl)
             except requests.exceptions.SSLError as e:
                 logger.exception('SSL error when contacting Paynow init endpoint: %s', e)
                 return {
@@ -297,6 +326,12 @@ class PaynowService:
         post_hash = request.POST.get('hash')
         if post_hash:
             logger.debug('Found post hash: %s', post_hash[:64])
+            # Paynow's documented scheme: SHA-512 over the field values in order plus the key
+            try:
+                if parse_status(raw, self.integration_key).hash_valid:
+                    return True
+            except PaynowStatusError:
+                pass
             # normalize
             incoming = post_hash.strip().lower()
             # compute possibilities
@@ -379,66 +414,53 @@ class PaynowService:
         return False
 
     def verify_payment(self, poll_url: str) -> dict:
-        """Check transaction status using SDK if available or HTTP poll"""
+        """Check a transaction's status by POSTing to its poll URL and parsing the reply."""
+        if get_breaker('paynow').is_open():
+            return {'paid': False, 'status': 'poll_error: Paynow circuit open'}
         try:
-            from paynow import Paynow
-            paynow = Paynow(self.integration_id, self.integration_key, self.return_url, self.result_url)
-            status = paynow.check_transaction_status(poll_url)
-            return {'paid': getattr(status, 'paid', False), 'status': getattr(status, 'status', None)}
-        except Exception:
-            # Fallback to an HTTP probe that attempts to handle common Paynow responses.
-            # This is more tolerant for environments without the Paynow SDK.
-            try:
-                verify_ssl = getattr(settings, 'PAYNOW_VERIFY_SSL', True)
-                resp = requests.get(poll_url, timeout=10, verify=verify_ssl, allow_redirects=True)
-            except Exception as e:
-                logger.exception('HTTP poll to Paynow failed: %s', e)
-                # Give up gracefully: return pending with error status
-                return {'paid': False, 'status': f'poll_error: {e}'}
-
-            text = (resp.text or '')
-            # Try parse JSON first
-            try:
-                data = resp.json()
-            except Exception:
-                data = None
-
-            # Inspect JSON response for common fields
-            if isinstance(data, dict):
-                # Known keys that may indicate payment
-                paid = False
-                status_val = None
-                # boolean 'paid'
-                if 'paid' in data and isinstance(data.get('paid'), bool):
-                    paid = data.get('paid')
-                    status_val = str(data.get('status') or data.get('message') or data.get('result') or status_val)
-                    return {'paid': bool(paid), 'status': status_val or 'paid' if paid else 'pending'}
-
-                # textual status fields
-                for k in ('status', 'payment_status', 'result', 'message'):
-                    if k in data and data[k] is not None:
-                        try:
-                            s = str(data[k])
-                        except Exception:
-                            s = None
-                        if s:
-                            low = s.lower()
-                            if any(x in low for x in ('paid', 'success', 'completed')):
-                                return {'paid': True, 'status': s}
-                            if any(x in low for x in ('pending', 'awaiting', 'awaiting delivery', 'awaiting payment')):
-                                return {'paid': False, 'status': s}
-                            status_val = s
-                # Fallback: return unknown textual status
-                return {'paid': False, 'status': status_val or 'unknown'}
-
-            # No JSON — inspect HTML/text for keywords
-            low = text.lower()
-            if any(k in low for k in ('paid', 'payment received', 'payment successful', 'success')):
-                return {'paid': True, 'status': 'Paid (scraped)'}
-            if any(k in low for k in ('awaiting delivery', 'awaiting payment', 'pending', 'not paid')):
-                return {'paid': False, 'status': 'Pending (scraped)'}
-
-            # If nothing matched, return pending with a snippet for diagnostics
-            snippet = (text or '')[:1000]
-            logger.debug('Paynow poll HTTP response snippet: %s', snippet[:800])
-            return {'paid': False, 'status': 'Unknown (scraped)'}
+            verify_ssl = getattr(settings, 'PAYNOW_VERIFY_SSL', True)
+            resp = request_capped(
+                'paynow', 'POST', poll_url, getattr(settings, 'PAYNOW_STATUS_MAX_BYTES', 8192),
+                data={}, timeout=10, verify=verify_ssl,
+            )
+        except Exception as e:
+            logger.exception('HTTP poll to Paynow failed: %s', e)
+            # Give up gracefully: return pending with error status
+            return {'paid': False, 'status': f'poll_error: {e}'}
+        return self._poll_result(resp)
+
+    async def averify_payment(self, poll_url: str) -> dict:
+        """Async `verify_payment` for ASGI views, using the pooled async client."""
+        if await sync_to_async(get_breaker('paynow').is_open)():
+            return {'paid': False, 'status': 'poll_error: Paynow circuit open'}
+        try:
+            verify_ssl = getattr(settings, 'PAYNOW_VERIFY_SSL', True)
+            resp = await arequest(
+                'paynow', 'POST', poll_url, data={}, timeout=10, verify=verify_ssl,
+                max_bytes=getattr(settings, 'PAYNOW_STATUS_MAX_BYTES', 8192),
+            )
+        except Exception as e:
+            logger.exception('HTTP poll to Paynow failed: %s', e)
+            return {'paid': False, 'status': f'poll_error: {e}'}
+        return self._poll_result(resp)
+
+    async def acreate_transaction(self, *args, **kwargs) -> dict:
+        """Async `create_transaction`; the SDK is synchronous, so it runs in a worker thread."""
+        return await sync_to_async(self.create_transaction, thread_sensitive=False)(*args, **kwargs)
+
+    def _poll_result(self, resp) -> dict:
+        """paid/status from a capped poll reply; anything but a valid status message is a poll_error."""
+        if resp.status_code != 200:
+            return {'paid': False, 'status': f'poll_error: HTTP {resp.status_code}'}
+        if getattr(resp, 'truncated', False):
+            logger.warning('Paynow poll reply exceeded %s bytes; not a status message', len(resp.content))
+            return {'paid': False, 'status': 'poll_error: reply too large'}
+        try:
+            status = parse_status(resp.content, self.integration_key)
+        except PaynowStatusError as e:
+            logger.warning('Unparseable Paynow poll reply (%s): %r', e, resp.content[:200])
+            return {'paid': False, 'status': f'poll_error: {e}'}
+        if status.hash_valid is False:
+            logger.warning('Paynow poll reply for %s failed hash verification', status.reference or 'unknown reference')
+            return {'paid': False, 'status': 'poll_error: hash mismatch'}
+        return status.as_result()
@@ -0,0 +1,96 @@
+"""Parser for Paynow status messages (poll replies and result notifications).
+
+Paynow answers a poll URL, and posts to the result URL, with a urlencoded body such as
+``reference=..&paynowreference=..&amount=10.00&status=Paid&pollurl=..&hash=..``. The hash is
+the uppercase hex SHA-512 of every other value, in the order sent, followed by the
+integration key. `parse_status` checks it and returns a `PaynowStatus`. Statuses are compared
+as whole words, so "Not paid" is never read as "Paid".
+
+Poll replies are read with `rides.services.http.request_capped` / `arequest(max_bytes=...)`,
+so a reply larger than `PAYNOW_STATUS_MAX_BYTES` (an HTML page, say) is rejected after that
+many bytes instead of being downloaded and searched.
+"""
+import hashlib
+import hmac
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Mapping, Optional, Union
+from urllib.parse import parse_qsl
+
+PAID_STATUSES = frozenset({'paid'})
+# Only these end a payment as FAILED; other statuses ('Sent', 'Awaiting Delivery', ...) are intermediate
+FAILURE_STATUSES = frozenset({'failed', 'cancelled', 'expired'})
+
+
+class PaynowStatusError(ValueError):
+    """The body is not a Paynow status message."""
+
+
+@dataclass(frozen=True)
+class PaynowStatus:
+    status: str
+    reference: str = ''
+    paynow_reference: str = ''
+    amount: Optional[Decimal] = None
+    poll_url: str = ''
+    error: str = ''
+    # None when there was no integration key to check the hash against
+    hash_valid: Optional[bool] = None
+    fields: dict = field(default_factory=dict, compare=False, repr=False)
+
+    @property
+    def paid(self) -> bool:
+        return self.status.strip().lower() in PAID_STATUSES
+
+    @property
+    def failed(self) -> bool:
+        return self.status.strip().lower() in FAILURE_STATUSES
+
+    def as_result(self) -> dict:
+        """The {'paid', 'status'} shape returned by `PaynowService.verify_payment`."""
+        return {'paid': self.paid, 'status': self.status.strip().lower()}
+
+
+def _amount(value: Optional[str]) -> Optional[Decimal]:
+    try:
+        return Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+
+
+def status_from_fields(fields: Mapping[str, str], hash_valid: Optional[bool] = None) -> PaynowStatus:
+    """Typed view of already-decoded status fields (e.g. a verified notification's POST data)."""
+    fields = {str(k).lower(): v for k, v in fields.items()}
+    if not fields.get('status'):
+        raise PaynowStatusError('no status field')
+    return PaynowStatus(
+        status=fields['status'],
+        reference=fields.get('reference') or '',
+        paynow_reference=fields.get('paynowreference') or '',
+        amount=_amount(fields.get('amount')),
+        poll_url=fields.get('pollurl') or '',
+        error=fields.get('error') or '',
+        hash_valid=hash_valid,
+        fields=fields,
+    )
+
+
+def expected_hash(pairs, integration_key: str) -> str:
+    values = ''.join(value for key, value in pairs if key.lower() != 'hash')
+    return hashlib.sha512((values + integration_key).encode('utf-8')).hexdigest().upper()
+
+
+def parse_status(body: Union[bytes, str], integration_key: Optional[str] = None) -> PaynowStatus:
+    """Parse a urlencoded status message and check its hash against `integration_key`."""
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    try:
+        pairs = parse_qsl(body.strip(), keep_blank_values=True, strict_parsing=True)
+    except ValueError as exc:
+        raise PaynowStatusError(f'not urlencoded: {exc}') from None
+
+    hash_valid = None
+    if integration_key:
+        sent = next((value for key, value in pairs if key.lower() == 'hash'), '')
+        hash_valid = bool(sent) and hmac.compare_digest(expected_hash(pairs, integration_key), sent.strip().upper())
+    return status_from_fields(dict(pairs), hash_valid=hash_valid)
@@ -1,5 +1,336 @@
+from bisect import bisect_right
+import hashlib
+import json
 from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable, List, Optional, Sequence, Tuple
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+try:
+    import numpy as np
+except ImportError:  # optional; calculate_many falls back to a per-row loop
+    np = None
+
+# (numerator, denominator) of an exact rational amount
+Ratio = Tuple[int, int]
+
+# (distance_km, num_adults, num_kids_seated, num_kids_carried, luggage_count)
+QuoteRow = Sequence
+
+# Distances are vectorized as integer micro-km, i.e. up to 6 decimal places
+_MICRO = 10 ** 6
+# Headroom kept below 2**63 for the int64 intermediate products of calculate_many
+_INT64_SAFE = float(2 ** 62)
+
+
+def _ratio(value) -> Ratio:
+    return Decimal(str(value)).as_integer_ratio()
+
+
+def _decimal_places(ratio: Ratio) -> Optional[int]:
+    """Smallest k such that the ratio times 10**k is an integer (None if not a finite decimal)."""
+    den = ratio[1]
+    for k in range(19):
+        if (10 ** k) % den == 0:
+            return k
+    return None
+
+
+def _cents(num: int, den: int) -> Tuple[int, bool]:
+    """Round num/den dollars half-up (away from zero) to whole cents; also report exact half-cent ties."""
+    scaled = 200 * abs(num)
+    cents = (scaled + den) // (2 * den)
+    tie = scaled % (2 * den) == den
+    return (-cents if num < 0 else cents), tie
+
+
+class PricingEngine:
+    """Pricing rules compiled once from a `settings.PRICING` dict.
+
+    Bracket boundaries are kept as sorted Decimals and looked up with `bisect`; money amounts
+    are exact integer ratios, so a quote is a handful of integer operations rounded half-up to
+    whole cents. Results are identical to `PricingService._calculate_reference`, including its
+    quirks: distances in a gap between brackets (e.g. 15 < d < 16) fall back to the first
+    bracket's price, and the above-35 km rule always starts from $40 at 35 km.
+
+    The reference divides by 3 with 28-digit Decimal precision, which can only change a result
+    when the base price is not a multiple of 3 and the exact amount sits on a half-cent tie;
+    those (rare) quotes are delegated to it.
+    """
+
+    ABOVE_THRESHOLD_KM = Decimal("35")
+    ABOVE_BASE_PRICE: Ratio = (40, 1)
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.min_distance = Decimal(str(config.get("MIN_DISTANCE_KM", 13.0)))
+
+        brackets = [(Decimal(b["min"]), Decimal(b["max"]), _ratio(b["price"])) for b in config.get("BRACKETS", [])]
+        # The reference takes the first matching bracket in list order; bisect gives the same
+        # answer only when brackets do not overlap, otherwise keep the linear scan.
+        ordered = sorted(brackets, key=lambda b: b[0])
+        self.bisectable = all(ordered[i][1] < ordered[i + 1][0] for i in range(len(ordered) - 1))
+        self.brackets = ordered if self.bisectable else brackets
+        self.lows = [b[0] for b in self.brackets]
+        self.fallback_price = brackets[0][2] if brackets else None
+
+        self.per_km = _ratio(config.get("ABOVE_35_PER_KM", 1.3))
+        self.extra_adult_fee = _ratio(config.get("EXTRA_ADULT_FEE", 10.0))
+        self.kid_factor = _ratio(config.get("KID_SEATED_FACTOR", 0.5))
+        self.luggage_fee = _ratio(config.get("LUGGAGE_FEE", 5.0))
+        self._vector = None
+        self._rules = None
+
+    def _bracket_price(self, effective: Decimal):
+        if self.bisectable:
+            i = bisect_right(self.lows, effective) - 1
+            if i >= 0 and effective <= self.brackets[i][1]:
+                return self.brackets[i][2]
+            return None
+        for low, high, price in self.brackets:
+            if low <= effective <= high:
+                return price
+        return None
+
+    def calculate(self, distance_km: float, num_adults: int = 1, num_kids_seated: int = 0, num_kids_carried: int = 0, luggage_count: int = 0) -> dict:
+        if distance_km is None:
+            raise ValueError("distance_km is required")
+        if num_adults < 1:
+            raise ValueError("At least one adult is required")
+        if num_kids_seated < 0 or num_kids_carried < 0 or luggage_count < 0:
+            raise ValueError("Counts cannot be negative")
+
+        distance = Decimal(str(distance_km))
+        if not distance.is_finite():
+            return PricingService._calculate_reference(distance_km, num_adults, num_kids_seated, num_kids_carried, luggage_count)
+        effective = self.min_distance if self.min_distance > distance else distance
+
+        base = self._bracket_price(effective)
+        if base is None:
+            if effective > self.ABOVE_THRESHOLD_KM:
+                en, ed = effective.as_integer_ratio()
+                rn, rd = self.per_km
+                b0n, b0d = self.ABOVE_BASE_PRICE
+                base = (b0n * rd * ed + b0d * rn * (en - 35 * ed), b0d * rd * ed)
+            else:
+                base = self.fallback_price
+        bn, bd = base
+
+        extra_adults = max(0, num_adults - 3)
+        an, ad = self.extra_adult_fee
+        fn, fd = self.kid_factor
+        ln, ld = self.luggage_fee
+        kn, kd = bn * fn * num_kids_seated, bd * fd * 3
+
+        base_cents, _ = _cents(bn, bd)
+        extra_cents, _ = _cents(an * extra_adults, ad)
+        kids_cents, kids_tie = _cents(kn, kd)
+        luggage_cents, _ = _cents(ln * luggage_count, ld)
+        sub_den = bd * ad * kd * ld
+        sub_num = (bn * ad * kd * ld) + (an * extra_adults * bd * kd * ld) + (kn * bd * ad * ld) + (ln * luggage_count * bd * ad * kd)
+        total_cents, total_tie = _cents(sub_num, sub_den)
+
+        # base / 3 is exact in Decimal when 3 divides the numerator; otherwise a tie may round either way
+        if num_kids_seated and (kids_tie or total_tie) and bn % 3:
+            return PricingService._calculate_reference(distance_km, num_adults, num_kids_seated, num_kids_carried, luggage_count)
+
+        return {
+            "distance_km": float(distance),
+            "effective_distance_km": float(effective),
+            "base_distance_price": base_cents / 100,
+            "extra_adults": int(extra_adults),
+            "extra_adults_fee": extra_cents / 100,
+            "kids_seated": int(num_kids_seated),
+            "kids_seated_fee": kids_cents / 100,
+            "kids_carried": int(num_kids_carried),
+            "luggage_count": int(luggage_count),
+            "luggage_fee": luggage_cents / 100,
+            "subtotal": total_cents / 100,
+            "total": total_cents / 100,
+        }
+
+    def rules(self) -> dict:
+        """Export of the rules for client-side quoting (static/js/pricing.js), with a content version.
+
+        Numbers are decimal strings so the client can evaluate them exactly; `brackets` keep the
+        configured order because the first bracket is also the gap fallback.
+        """
+        if self._rules is None:
+            cfg = self.config
+            rules = {
+                "min_distance_km": str(self.min_distance),
+                "brackets": [{"min": str(Decimal(b["min"])), "max": str(Decimal(b["max"])), "price": str(Decimal(str(b["price"])))} for b in cfg.get("BRACKETS", [])],
+                "above_threshold_km": str(self.ABOVE_THRESHOLD_KM),
+                "above_base_price": str(self.ABOVE_BASE_PRICE[0] / self.ABOVE_BASE_PRICE[1]),
+                "above_per_km": str(Decimal(str(cfg.get("ABOVE_35_PER_KM", 1.3)))),
+                "included_adults": 3,
+                "extra_adult_fee": str(Decimal(str(cfg.get("EXTRA_ADULT_FEE", 10.0)))),
+                "kid_seated_factor": str(Decimal(str(cfg.get("KID_SEATED_FACTOR", 0.5)))),
+                "luggage_fee": str(Decimal(str(cfg.get("LUGGAGE_FEE", 5.0)))),
+            }
+            canonical = json.dumps(rules, sort_keys=True, separators=(",", ":"))
+            rules["version"] = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+            self._rules = rules
+        return self._rules
+
+    def _vector_constants(self) -> Optional[dict]:
+        """Integer constants for the NumPy path, or None when the rules can't be vectorized exactly.
+
+        Money is scaled to units of 1/B dollars (B a power of ten) so bracket prices, fees and the
+        above-35 km rate are integers; seated-kid fees share the extra denominator 3 * 10**fk.
+        """
+        if self._vector is not None:
+            return self._vector or None
+        self._vector = {}
+        if np is None or not self.bisectable or not self.brackets:
+            return None
+
+        money = [price for _, _, price in self.brackets] + [self.fallback_price, self.extra_adult_fee, self.luggage_fee]
+        rk = _decimal_places(self.per_km)
+        fk = _decimal_places(self.kid_factor)
+        places = [_decimal_places(m) for m in money]
+        bounds = [b[0] for b in self.brackets] + [b[1] for b in self.brackets] + [self.min_distance]
+        if rk is None or fk is None or None in places or any((x * _MICRO) % 1 for x in bounds):
+            return None
+
+        scale = max([6 + rk] + places)
+        B = 10 ** scale
+
+        def units(ratio: Ratio) -> int:
+            return ratio[0] * B // ratio[1]
+
+        self._vector = {
+            "B": B,
+            "lows": np.array([int(b[0] * _MICRO) for b in self.brackets], dtype=np.int64),
+            "highs": np.array([int(b[1] * _MICRO) for b in self.brackets], dtype=np.int64),
+            "prices": np.array([units(b[2]) for b in self.brackets], dtype=np.int64),
+            "fallback": units(self.fallback_price),
+            "min": int(self.min_distance * _MICRO),
+            "min_float": float(self.min_distance),
+            # per-micro-km rate in 1/B dollar units
+            "rate": self.per_km[0] * (B // (_MICRO * 10 ** rk)) * (10 ** rk // self.per_km[1]),
+            "above_base": self.ABOVE_BASE_PRICE[0] * B // self.ABOVE_BASE_PRICE[1],
+            "above_threshold": int(self.ABOVE_THRESHOLD_KM * _MICRO),
+            "extra": units(self.extra_adult_fee),
+            "luggage": units(self.luggage_fee),
+            "kid_num": self.kid_factor[0] * (10 ** fk // self.kid_factor[1]),
+            "kid_den": 3 * 10 ** fk,
+            "max_price": max(p[0] / p[1] for p in money) + self.ABOVE_BASE_PRICE[0],
+        }
+        return self._vector
+
+    def calculate_many(self, rows: Iterable[QuoteRow]) -> List[dict]:
+        """Quote many rows at once; each result equals `calculate(*row)`.
+
+        Rows whose distance has at most 6 decimal places (and whose amounts fit in int64) are
+        priced in one vectorized NumPy pass; the rest, and exact half-cent ties with seated kids,
+        go through `calculate`. Without NumPy every row goes through `calculate`.
+        """
+        rows = [tuple(r) for r in rows]
+        for i, row in enumerate(rows):
+            if len(row) != 5:
+                raise ValueError(f"row {i}: expected (distance_km, num_adults, num_kids_seated, num_kids_carried, luggage_count)")
+            if row[0] is None:
+                raise ValueError(f"row {i}: distance_km is required")
+            if row[1] < 1:
+                raise ValueError(f"row {i}: At least one adult is required")
+            if row[2] < 0 or row[3] < 0 or row[4] < 0:
+                raise ValueError(f"row {i}: Counts cannot be negative")
+
+        vec = self._vector_constants()
+        if vec is None or not rows:
+            return [self.calculate(*row) for row in rows]
+
+        cols = np.array(rows, dtype=np.float64).T
+        d, adults, kids, carried, luggage = cols
+        B, KD = vec["B"], vec["kid_den"]
+
+        # Rows the integer path can price exactly; everything else is quoted by `calculate`
+        with np.errstate(invalid="ignore", over="ignore"):
+            micro = np.rint(d * _MICRO)
+            extra_adults_f = np.maximum(adults - 3, 0)
+            bound = (vec["max_price"] + float(self.per_km[0]) / self.per_km[1] * np.abs(d)) * B
+            bound = (bound + (vec["extra"] * extra_adults_f + vec["luggage"] * luggage)) * KD + bound * vec["kid_num"] * kids
+            ok = np.isfinite(d) & (micro / _MICRO == d) & (bound * 200 < _INT64_SAFE)
+            ok &= (cols[1:] == np.rint(cols[1:])).all(axis=0)
+        micro = np.where(ok, micro, 0).astype(np.int64)
+        extra_adults = np.where(ok, extra_adults_f, 0).astype(np.int64)
+        kids_i = np.where(ok, kids, 0).astype(np.int64)
+        luggage_i = np.where(ok, luggage, 0).astype(np.int64)
+
+        effective = np.maximum(micro, vec["min"])
+        idx = np.searchsorted(vec["lows"], effective, side="right") - 1
+        safe_idx = np.clip(idx, 0, len(vec["lows"]) - 1)
+        in_bracket = (idx >= 0) & (effective <= vec["highs"][safe_idx])
+        above = vec["above_base"] + vec["rate"] * (effective - vec["above_threshold"])
+        base = np.where(in_bracket, vec["prices"][safe_idx],
+                        np.where(effective > vec["above_threshold"], above, vec["fallback"]))
+
+        extra_fee = vec["extra"] * extra_adults
+        luggage_fee = vec["luggage"] * luggage_i
+        kids_fee = base * vec["kid_num"] * kids_i
+        subtotal = (base + extra_fee + luggage_fee) * KD + kids_fee
+
+        def cents(x, den):
+            return (200 * x + den) // (2 * den), (200 * x) % (2 * den) == den
+
+        base_c, _ = cents(base, B)
+        extra_c, _ = cents(extra_fee, B)
+        luggage_c, _ = cents(luggage_fee, B)
+        kids_c, kids_tie = cents(kids_fee, B * KD)
+        total_c, total_tie = cents(subtotal, B * KD)
+        ok &= ~((kids_i > 0) & (kids_tie | total_tie) & (base % 3 != 0))
+
+        effective_f = np.where(d < vec["min_float"], vec["min_float"], d)
+        columns = zip(
+            ok.tolist(), d.tolist(), effective_f.tolist(), (base_c / 100).tolist(), extra_adults.tolist(),
+            (extra_c / 100).tolist(), (kids_c / 100).tolist(), (luggage_c / 100).tolist(), (total_c / 100).tolist(),
+        )
+        results = []
+        for row, (exact, dist, eff, base_p, n_extra, extra_p, kids_p, luggage_p, total) in zip(rows, columns):
+            if not exact:
+                results.append(self.calculate(*row))
+                continue
+            results.append({
+                "distance_km": dist,
+                "effective_distance_km": eff,
+                "base_distance_price": base_p,
+                "extra_adults": n_extra,
+                "extra_adults_fee": extra_p,
+                "kids_seated": int(row[2]),
+                "kids_seated_fee": kids_p,
+                "kids_carried": int(row[3]),
+                "luggage_count": int(row[4]),
+                "luggage_fee": luggage_p,
+                "subtotal": total,
+                "total": total,
+            })
+        return results
+
+
+_engine = None
+
+
+def get_engine() -> PricingEngine:
+    """Return the engine for the current `settings.PRICING`, compiling it on first use or after a change.
+
+    Changes are detected when `settings.PRICING` is replaced (or via `override_settings`); edit
+    the pricing rules by assigning a new dict rather than mutating the existing one.
+    """
+    global _engine
+    config = settings.PRICING
+    engine = _engine
+    if engine is None or engine.config is not config:
+        engine = _engine = PricingEngine(config)
+    return engine
+
+
+@receiver(setting_changed)
+def _reset_engine(setting, **kwargs):
+    global _engine
+    if setting == "PRICING":
+        _engine = None
 
 
 class PricingService:
@@ -18,6 +349,9 @@ class PricingService:
     50% of the per-adult share of the BASE distance price (distance price / 3).
     This keeps the logic deterministic and simple. Document any changes with
     business if this should instead be 50% of the full adult price.
+
+    `calculate` is served by a `PricingEngine` compiled from `settings.PRICING` (see
+    `get_engine`); `_calculate_reference` is the plain Decimal version it is tested against.
     """
 
     @staticmethod
@@ -26,6 +360,52 @@ class PricingService:
 
     @classmethod
     def calculate(cls, distance_km: float, num_adults: int = 1, num_kids_seated: int = 0, num_kids_carried: int = 0, luggage_count: int = 0) -> dict:
+        return get_engine().calculate(distance_km, num_adults, num_kids_seated, num_kids_carried, luggage_count)
+
+    @classmethod
+    def calculate_many(cls, rows: Iterable[QuoteRow]) -> List[dict]:
+        """Breakdowns for many (distance_km, num_adults, num_kids_seated, num_kids_carried, luggage_count) rows."""
+        return get_engine().calculate_many(rows)
+
+    @classmethod
+    def rules(cls) -> dict:
+        """Versioned export of the current pricing rules (see `PricingEngine.rules`)."""
+        return get_engine().rules()
+
+    @classmethod
+    def quote_matrix(cls, distance_km: float, max_adults: int, max_kids_seated: int, max_luggage: int) -> dict:
+        """All quotes for one route over 1..max_adults, 0..max_kids_seated and 0..max_luggage.
+
+        Fees depend on a single count each and are returned as lists indexed by that count
+        (`extra_adults_fee[a - 1]`, `kids_seated_fee[k]`, `luggage_fee[l]`); totals are rounded
+        from the unrounded subtotal, so they form a grid `totals[a - 1][k][l]`. Every cell equals
+        `calculate(distance_km, a, k, 0, l)`. Kids carried never change the price.
+        """
+        rows = [(distance_km, a, k, 0, l) for a in range(1, max_adults + 1) for k in range(max_kids_seated + 1) for l in range(max_luggage + 1)]
+        quotes = cls.calculate_many(rows)
+        first = quotes[0]
+        n_k, n_l = max_kids_seated + 1, max_luggage + 1
+
+        def cell(a, k, l):
+            return quotes[((a - 1) * n_k + k) * n_l + l]
+
+        return {
+            "distance_km": first["distance_km"],
+            "effective_distance_km": first["effective_distance_km"],
+            "base_distance_price": first["base_distance_price"],
+            "max_adults": max_adults,
+            "max_kids_seated": max_kids_seated,
+            "max_luggage": max_luggage,
+            "extra_adults": [cell(a, 0, 0)["extra_adults"] for a in range(1, max_adults + 1)],
+            "extra_adults_fee": [cell(a, 0, 0)["extra_adults_fee"] for a in range(1, max_adults + 1)],
+            "kids_seated_fee": [cell(1, k, 0)["kids_seated_fee"] for k in range(n_k)],
+            "luggage_fee": [cell(1, 0, l)["luggage_fee"] for l in range(n_l)],
+            "totals": [[[cell(a, k, l)["total"] for l in range(n_l)] for k in range(n_k)] for a in range(1, max_adults + 1)],
+        }
+
+    @classmethod
+    def _calculate_reference(cls, distance_km: float, num_adults: int = 1, num_kids_seated: int = 0, num_kids_carried: int = 0, luggage_count: int = 0) -> dict:
+        """Straightforward Decimal implementation of the rules; `PricingEngine` must match it exactly."""
         if distance_km is None:
             raise ValueError("distance_km is required")
         if num_adults < 1:
@@ -0,0 +1,79 @@
+"""Signed, expiring quote tokens so a booking can reuse the distance and price of its estimate.
+
+`PriceEstimateView` (and `PriceMatrixView`) return a `quote_token` with each quote. The token
+is signed with SECRET_KEY (`django.core.signing`), so the client can carry it but not alter
+it. It holds the route coordinates, the distance, the pricing rules version and, for single
+quotes, the passenger counts and price breakdown. A booking that sends the token back skips
+the second Google distance lookup; when its counts also match it skips pricing as well.
+
+A token is only honoured while it is younger than `settings.QUOTE_TOKEN_MAX_AGE` seconds,
+its coordinates match the booking and the pricing rules have not changed since it was
+issued. Otherwise it is ignored and the booking falls back to the normal lookup and pricing.
+"""
+import logging
+from typing import Optional
+
+from django.conf import settings
+from django.core import signing
+
+from .pricing import PricingService
+
+logger = logging.getLogger(__name__)
+
+COORD_FIELDS = ('pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng')
+COUNT_FIELDS = (('num_adults', 1), ('num_kids_seated', 0), ('num_kids_carried', 0), ('luggage_count', 0))
+
+
+class QuoteService:
+    SALT = 'rides.quote'
+
+    @staticmethod
+    def _coords(data) -> list:
+        # Rounded like the exact distance cache key, so float round trips through the form still match
+        return [None if data.get(f) is None else round(float(data[f]), 6) for f in COORD_FIELDS]
+
+    @staticmethod
+    def _counts(data) -> list:
+        return [int(data.get(f) if data.get(f) is not None else default) for f, default in COUNT_FIELDS]
+
+    @classmethod
+    def issue(cls, data, distance_km: float, breakdown: Optional[dict] = None) -> str:
+        """Sign a quote for the route in `data`; with `breakdown`, also for its passenger counts."""
+        payload = {
+            'c': cls._coords(data),
+            'd': distance_km,
+            'v': PricingService.rules()['version'],
+        }
+        if breakdown is not None:
+            payload['n'] = cls._counts(data)
+            payload['b'] = breakdown
+        return signing.dumps(payload, salt=cls.SALT, compress=True)
+
+    @classmethod
+    def redeem(cls, token: Optional[str], data) -> Optional[dict]:
+        """Return {'distance_km', 'breakdown'} for a valid token matching `data`, else None.
+
+        'breakdown' is None when the token was issued for other passenger counts (or for a
+        whole price matrix); the caller then prices the booking itself.
+        """
+        if not token:
+            return None
+        max_age = getattr(settings, 'QUOTE_TOKEN_MAX_AGE', 900)
+        try:
+            payload = signing.loads(token, salt=cls.SALT, max_age=max_age)
+        except signing.SignatureExpired:
+            logger.info('Quote token expired; recomputing distance')
+            return None
+        except signing.BadSignature:
+            logger.warning('Invalid quote token ignored')
+            return None
+
+        if payload.get('c') != cls._coords(data):
+            logger.info('Quote token issued for another route; recomputing distance')
+            return None
+        if payload.get('v') != PricingService.rules()['version']:
+            logger.info('Quote token issued under pricing rules %s; recomputing', payload.get('v'))
+            return None
+
+        breakdown = payload.get('b') if payload.get('n') == cls._counts(data) else None
+        return {'distance_km': payload['d'], 'breakdown': breakdown}
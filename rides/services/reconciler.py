@@ -0,0 +1,204 @@
+"""Central Paynow reconciliation: one worker polls pending payments instead of every browser.
+
+`manage.py reconcile_payments` repeatedly selects PENDING Paynow payments (through the
+`rides_payment_status_idx` index on status + created_at) and checks the due ones against Paynow
+on a bounded thread pool (`PAYNOW_RECONCILE_WORKERS`). How often a payment is checked depends
+on its age: every 5 s for the first two minutes, when most customers complete the payment,
+then every 15 s, every minute after ten minutes and every 5 minutes after an hour. Payments
+older than `PAYNOW_RECONCILE_MAX_AGE` seconds are no longer checked.
+
+Each result is written to the shared cache (`cached_result`). A paid result makes the PAID
+transition through `PaymentStateService`, and the caller that wins it sends the emails, as
+the poll view and the webhook do.
+
+With `settings.PAYNOW_POLL_MODE = "reconciler"`, `PaynowPollView` answers from the payment
+row and the cached result and never calls Paynow itself. The default "upstream" mode keeps
+the per-request check, through `check_cached`: a result younger than `PAYNOW_POLL_CACHE_TTL`
+seconds is reused by every worker, and concurrent polls for one payment (several open tabs)
+share a single upstream call (`SingleFlight`). The poll response carries the result's
+`cached_age` and the `max_age` so the page can wait before asking again.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from rides.cache import shared_cache
+from rides.models import Payment, RideBooking
+from .email_service import EmailService
+from .payment_refs import poll_url_for
+from .payment_state import PaymentStateService
+from .paynow import PaynowService
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_poll_flight = SingleFlight("paynow-poll", lock_timeout=20, wait_timeout=12)
+_apoll_flight = AsyncSingleFlight()
+
+
+class PaynowReconciler:
+    CACHE_PREFIX = "paynow:poll:"
+    # (payment age below, seconds between checks); older payments use SLOW_INTERVAL
+    SCHEDULE = ((120, 5), (600, 15), (3600, 60))
+    SLOW_INTERVAL = 300
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or getattr(settings, "PAYNOW_RECONCILE_WORKERS", 8)
+        # payment id -> time.monotonic() of its next check; local to this worker process
+        self._next_check = {}
+
+    @staticmethod
+    def enabled() -> bool:
+        return getattr(settings, "PAYNOW_POLL_MODE", "upstream") == "reconciler"
+
+    @classmethod
+    def interval_for(cls, age: timedelta) -> int:
+        seconds = age.total_seconds()
+        for max_age, interval in cls.SCHEDULE:
+            if seconds < max_age:
+                return interval
+        return cls.SLOW_INTERVAL
+
+    @classmethod
+    def cache_key(cls, payment_id) -> str:
+        return f"{cls.CACHE_PREFIX}{payment_id}"
+
+    @classmethod
+    def cached_result(cls, payment_id) -> Optional[dict]:
+        """Last reconciler result for a payment: {'paid', 'status', 'checked_at'} or None."""
+        try:
+            return shared_cache().get(cls.cache_key(payment_id))
+        except Exception:
+            logger.debug("Reconciler cache lookup failed (non-fatal)", exc_info=True)
+            return None
+
+    @classmethod
+    def store_result(cls, payment_id, result: dict, timeout: int) -> dict:
+        """Cache an upstream check result for a payment; returns the cached entry."""
+        entry = {"paid": bool(result.get("paid")), "status": result.get("status"), "checked_at": timezone.now().isoformat()}
+        try:
+            shared_cache().set(cls.cache_key(payment_id), entry, timeout=timeout)
+        except Exception:
+            logger.exception("Failed to cache poll result for payment %s (non-fatal)", payment_id)
+        return entry
+
+    @staticmethod
+    def result_age(entry: Optional[dict]) -> Optional[float]:
+        """Seconds since a cached result was checked upstream, or None."""
+        try:
+            return max((timezone.now() - datetime.fromisoformat(entry["checked_at"])).total_seconds(), 0.0)
+        except (TypeError, KeyError, ValueError):
+            return None
+
+    @classmethod
+    def fresh_result(cls, payment_id) -> Optional[dict]:
+        """The cached result with its `cached_age`, if younger than PAYNOW_POLL_CACHE_TTL; else None."""
+        entry = cls.cached_result(payment_id)
+        age = cls.result_age(entry)
+        if age is None or age >= getattr(settings, "PAYNOW_POLL_CACHE_TTL", 5):
+            return None
+        return dict(entry, cached_age=round(age, 1))
+
+    @classmethod
+    def _check_upstream(cls, payment_id, poll_url: str) -> dict:
+        result = PaynowService().verify_payment(poll_url)
+        return dict(cls.store_result(payment_id, result, timeout=getattr(settings, "PAYNOW_POLL_CACHE_TTL", 5)), cached_age=0.0)
+
+    @classmethod
+    def check_cached(cls, payment: Payment, poll_url: str) -> dict:
+        """Upstream status for a poll request, reusing a fresh cached result or an in-flight check."""
+        fresh = cls.fresh_result(payment.pk)
+        if fresh is not None:
+            return fresh
+        return _poll_flight.do(
+            str(payment.pk),
+            lambda: cls._check_upstream(payment.pk, poll_url),
+            lookup=lambda: cls.fresh_result(payment.pk),
+        )
+
+    @classmethod
+    async def acheck_cached(cls, payment: Payment, poll_url: str) -> dict:
+        """Async `check_cached`; concurrent checks are coalesced within the event loop only."""
+        fresh = await sync_to_async(cls.fresh_result)(payment.pk)
+        if fresh is not None:
+            return fresh
+
+        async def check():
+            result = await PaynowService().averify_payment(poll_url)
+            entry = await sync_to_async(cls.store_result)(payment.pk, result, getattr(settings, "PAYNOW_POLL_CACHE_TTL", 5))
+            return dict(entry, cached_age=0.0)
+
+        return await _apoll_flight.do(str(payment.pk), check)
+
+    def due_payments(self) -> list:
+        now = timezone.now()
+        max_age = timedelta(seconds=getattr(settings, "PAYNOW_RECONCILE_MAX_AGE", 24 * 3600))
+        pending = (
+            Payment.objects.filter(status=Payment.STATUS_PENDING, method="PAYNOW", created_at__gte=now - max_age)
+            .only("id", "booking_id", "paynow_reference", "poll_url", "created_at")
+            .order_by("created_at")
+        )
+        clock = time.monotonic()
+        due = [p for p in pending if self._next_check.get(p.pk, 0) <= clock]
+        # Forget payments that left PENDING or aged out
+        live = {p.pk for p in pending}
+        self._next_check = {pk: t for pk, t in self._next_check.items() if pk in live}
+        return due
+
+    def check(self, payment: Payment) -> str:
+        """Check one payment upstream and record the result; returns paid, pending or skipped."""
+        self._next_check[payment.pk] = time.monotonic() + self.interval_for(timezone.now() - payment.created_at)
+        poll_url = poll_url_for(payment)
+        if not poll_url:
+            return "skipped"
+
+        result = PaynowService().verify_payment(poll_url)
+        self.store_result(payment.pk, result, timeout=getattr(settings, "PAYNOW_RECONCILE_RESULT_TTL", 3600))
+
+        if not result.get("paid"):
+            return "pending"
+        if PaymentStateService.mark_paid(payment.pk):
+            booking = RideBooking.objects.get(pk=payment.booking_id)
+            EmailService.send_payment_confirmation(booking)
+            EmailService.send_owner_notification(booking, payment_status="PAID")
+            logger.info("Payment %s marked PAID by reconciler", payment.pk)
+        return "paid"
+
+    def _check_in_thread(self, payment: Payment) -> str:
+        try:
+            return self.check(payment)
+        except Exception:
+            logger.exception("Reconciler check failed for payment %s (non-fatal)", payment.pk)
+            return "error"
+        finally:
+            # Pool threads open their own DB connections; don't leak them
+            connection.close()
+
+    def run_once(self, payments: Optional[Iterable[Payment]] = None) -> dict:
+        """Check every due payment once; returns counts by outcome."""
+        payments = list(self.due_payments() if payments is None else payments)
+        counts = {}
+        if not payments:
+            return counts
+        if self.workers <= 1:
+            outcomes = []
+            for payment in payments:
+                try:
+                    outcomes.append(self.check(payment))
+                except Exception:
+                    logger.exception("Reconciler check failed for payment %s (non-fatal)", payment.pk)
+                    outcomes.append("error")
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(payments))) as pool:
+                outcomes = list(pool.map(self._check_in_thread, payments))
+        for outcome in outcomes:
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return counts
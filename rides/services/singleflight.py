@@ -0,0 +1,118 @@
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from rides.cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesce concurrent identical upstream calls so only one per key is in flight.
+
+    Within a process, the first caller for a key runs `fn` and every concurrent caller for the
+    same key waits for (and shares) its result or exception.
+
+    Across processes, the in-process leader also takes a short-lived lock in the shared cache
+    (`cache.add`). If another process already holds it, we poll `lookup()` (normally a cache
+    read) until that process publishes the result, the lock disappears, or `wait_timeout`
+    elapses; in the last two cases we call `fn` ourselves. Lock errors are non-fatal: the
+    caller simply proceeds without cross-process coalescing.
+    """
+
+    def __init__(self, name: str, lock_timeout: float = 30, wait_timeout: float = 10, poll_interval: float = 0.1):
+        self.name = name
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _lock_key(self, key: str) -> str:
+        return f"singleflight:{self.name}:{key}"
+
+    def do(self, key: str, fn: Callable, lookup: Optional[Callable] = None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, fn, lookup)
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _do_shared(self, key: str, fn: Callable, lookup: Optional[Callable]):
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        try:
+            acquired = shared_cache().add(lock_key, token, timeout=int(self.lock_timeout) or 1)
+        except Exception:
+            logger.debug("single-flight lock unavailable for %s (non-fatal)", lock_key, exc_info=True)
+            return fn()
+
+        if not acquired and lookup is not None:
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = lookup()
+                if value is not None:
+                    logger.debug("single-flight %s satisfied by another process", lock_key)
+                    return value
+                try:
+                    if shared_cache().get(lock_key) is None:
+                        break
+                except Exception:
+                    break
+            logger.debug("single-flight %s: no result from lock holder; calling upstream", lock_key)
+
+        try:
+            return fn()
+        finally:
+            if acquired:
+                try:
+                    if shared_cache().get(lock_key) == token:
+                        shared_cache().delete(lock_key)
+                except Exception:
+                    logger.debug("Failed to release single-flight lock %s (non-fatal)", lock_key, exc_info=True)
+
+
+class AsyncSingleFlight:
+    """Coalesce concurrent identical coroutine calls within one event loop.
+
+    The first caller for a key starts `fn()` as a task; concurrent callers await the same task.
+    Cancelling one waiter does not cancel the shared call.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        task = self._tasks.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t, key=key: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+        return await asyncio.shield(task)
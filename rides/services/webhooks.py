@@ -0,0 +1,253 @@
+"""Paynow result notification handling, inline or through the webhook inbox.
+
+`WebhookService.process` applies one notification: it resolves the payment, records new
+identifiers and makes the status transition, sending emails when it confirms the payment.
+Transitions are conditional UPDATEs (`PaymentStateService`), so processing a notification
+again is harmless.
+
+With `settings.PAYNOW_WEBHOOK_MODE = "inbox"`, `PaynowResultView` only verifies the
+signature, stores the raw body in `WebhookInbox` (deduplicated by its SHA-256) and returns
+200. `manage.py process_webhooks` then processes rows in arrival order per payment reference:
+a row is not claimed while an earlier row for the same reference is still pending (leased
+or waiting to be retried), so a stale status is never applied after a newer one. Failures
+are retried with their own backoff (`PAYNOW_WEBHOOK_RETRY_BASE` / `_RETRY_MAX`, up to
+`PAYNOW_WEBHOOK_MAX_ATTEMPTS`), and `--replay` re-runs stored notifications. The default "inline" mode processes the notification inside the request as
+before.
+
+Paynow re-sends identical notifications. After a notification has been verified and handled,
+a digest of its raw body, reference and signature header is remembered for `PAYNOW_WEBHOOK_DEDUPE_TTL` seconds
+in the local and shared caches; a repeat is answered 200 before signature verification, the
+payment lookup or any database query. Hits and misses are counted in process (`manage.py cache_stats`).
+"""
+import hashlib
+import logging
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import QueryDict
+from django.utils import timezone
+
+from rides.cache import HitCounter, shared_cache
+from rides.models import Payment, PaymentReference, RideBooking, WebhookInbox
+from .email_service import EmailService
+from .payment_refs import PaymentReferenceService, poll_guid
+from .payment_state import PaymentStateService
+from .paynow_status import PaynowStatusError, status_from_fields
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookService:
+    DEDUPE_PREFIX = "paynow:webhook:seen:"
+    # Dedupe hit/miss counts; kept in process and flushed to the shared cache in batches
+    stats = HitCounter("paynow:webhook:stats")
+
+    @staticmethod
+    def inbox_enabled() -> bool:
+        return getattr(settings, 'PAYNOW_WEBHOOK_MODE', 'inline') == 'inbox'
+
+    @classmethod
+    def dedupe_key(cls, body: bytes, reference: Optional[str], signature: Optional[str] = None) -> str:
+        """Digest of the raw body, reference and signature header (a re-signed copy is not a duplicate)."""
+        return cls.DEDUPE_PREFIX + hashlib.sha256(b"|".join([body, (reference or "").encode(), (signature or "").encode()])).hexdigest()
+
+    @classmethod
+    def seen(cls, key: str) -> bool:
+        """True if this exact notification was already handled (local cache, then shared)."""
+        hit = cache.get(key) is not None
+        if not hit:
+            try:
+                hit = shared_cache().get(key) is not None
+            except Exception:
+                logger.debug("Webhook dedupe lookup failed (non-fatal)", exc_info=True)
+            if hit:
+                cache.set(key, 1, timeout=getattr(settings, "PAYNOW_WEBHOOK_DEDUPE_TTL", 3600))
+        cls.stats.record(hits=int(hit), misses=int(not hit))
+        return hit
+
+    @staticmethod
+    def remember(key: str) -> None:
+        ttl = getattr(settings, "PAYNOW_WEBHOOK_DEDUPE_TTL", 3600)
+        cache.set(key, 1, timeout=ttl)
+        try:
+            shared_cache().set(key, 1, timeout=ttl)
+        except Exception:
+            logger.debug("Failed to remember webhook digest (non-fatal)", exc_info=True)
+
+    @staticmethod
+    def process(data: dict) -> str:
+        """Apply one verified notification; returns the outcome (paid, failed, pending, ignored, unknown)."""
+        logger.info('Paynow webhook data: %s', data)
+        try:
+            status = status_from_fields(data)
+        except PaynowStatusError:
+            status = None
+        status_text = status.status.strip() if status else ''
+
+        # Paynow can send the local reference as 'reference' or 'transaction_id',
+        # but often sends its own 'paynowreference' field — try a few candidates.
+        reference_candidates = [
+            data.get('reference'),
+            data.get('transaction_id'),
+            data.get('paynowreference'),
+            data.get('paynow_reference'),
+            data.get('paynowReference'),
+            poll_guid(data.get('pollurl')),
+        ]
+
+        # One indexed lookup over every identifier the payment is known by (PaymentReference)
+        payment = PaymentReferenceService.resolve(reference_candidates)
+
+        if not payment:
+            # Don't fail the webhook outright (Paynow may retry). Log and ACK to avoid retries.
+            logger.warning('Paynow webhook for unknown reference: %s', reference_candidates)
+            return 'unknown'
+
+        # Ensure payment.paynow_reference is recorded if provided in the webhook
+        payref = data.get('paynowreference') or data.get('paynow_reference') or data.get('paynowReference')
+        PaymentReferenceService.register(payment.pk, [(payref, PaymentReference.KIND_PAYNOW), (poll_guid(data.get('pollurl')), PaymentReference.KIND_POLL)])
+        if payref and not payment.paynow_reference:
+            # Narrow update: a full save() could overwrite a concurrent status transition
+            Payment.objects.filter(pk=payment.pk).update(paynow_reference=payref)
+            payment.paynow_reference = payref
+            logger.debug('Updated payment %s paynow_reference=%s from webhook', payment.id, payref)
+
+        # Each transition is a single conditional UPDATE (see PaymentStateService); whoever
+        # makes the PAID transition sends the emails, so webhook/poll races email exactly once.
+        if payment.status == Payment.STATUS_PAID:
+            logger.info('Webhook for already-PAID payment %s received; ignoring', payment.id)
+            return 'ignored'
+
+        last_webhook = dict(payment.paynow_response or {}, last_webhook=data)
+
+        # If Paynow reports paid, validate amount (if provided) before confirming
+        if status and status.paid:
+            inc_amt = status.amount
+            if data.get('amount') and inc_amt is None:
+                logger.warning('Unable to parse amount from webhook: %s', data.get('amount'))
+            if inc_amt is not None:
+                # If amount doesn't match expected, mark for manual review rather than auto-confirm
+                if inc_amt != payment.amount:
+                    logger.error('Webhook amount mismatch for payment %s: expected=%s got=%s', payment.id, payment.amount, inc_amt)
+                    # Record raw webhook in paynow_response for manual inspection and mark FAILED
+                    PaymentStateService.mark_failed(payment.pk, paynow_response=last_webhook, upstream_status=status_text)
+                    return 'failed'
+
+            # Transition to PAID
+            if not PaymentStateService.mark_paid(payment.pk):
+                logger.info('Webhook for already-PAID payment %s received; ignoring', payment.id)
+                return 'ignored'
+
+            booking = RideBooking.objects.get(pk=payment.booking_id)
+
+            # Send confirmation emails (the transition has already committed)
+            EmailService.send_payment_confirmation(booking)
+            EmailService.send_owner_notification(booking, payment_status='PAID')
+
+            logger.info('Payment %s marked PAID via webhook', payment.id)
+            return 'paid'
+
+        # For explicit failure statuses, mark FAILED
+        if status and status.failed:
+            PaymentStateService.mark_failed(payment.pk, paynow_response=last_webhook, upstream_status=status_text)
+            logger.info('Payment %s marked FAILED via webhook (status=%s)', payment.id, status_text)
+            return 'failed'
+
+        # Otherwise, treat as intermediate: record the webhook but keep PENDING
+        PaymentStateService.record_response(payment.pk, last_webhook, upstream_status=status_text)
+        logger.info('Payment %s received intermediate webhook status=%s; left as PENDING', payment.id, status_text)
+        return 'pending'
+
+    @staticmethod
+    def inbox_reference(body: str) -> str:
+        """The payment reference a stored notification is about; rows are ordered per reference."""
+        data = QueryDict(body)
+        return (data.get('reference') or data.get('paynowreference') or poll_guid(data.get('pollurl')) or '')[:255]
+
+    @classmethod
+    def ingest(cls, body: bytes) -> bool:
+        """Store a verified raw notification; False if the same body was already stored."""
+        digest = hashlib.sha256(body).hexdigest()
+        text = body.decode('utf-8', errors='replace')
+        try:
+            with transaction.atomic():
+                WebhookInbox.objects.create(dedupe_hash=digest, reference=cls.inbox_reference(text), body=text)
+        except IntegrityError:
+            logger.info('Duplicate Paynow webhook %s ignored', digest[:12])
+            return False
+        return True
+
+    @staticmethod
+    def retry_delay(attempts: int) -> timedelta:
+        base = getattr(settings, 'PAYNOW_WEBHOOK_RETRY_BASE', 30)
+        cap = getattr(settings, 'PAYNOW_WEBHOOK_RETRY_MAX', 3600)
+        return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+    @staticmethod
+    def claim(limit: int) -> list:
+        """Lease up to `limit` due inbox rows to this worker, oldest first.
+
+        Only the oldest pending row of each reference is claimable, so one payment's
+        notifications are applied in the order they were received even across retries.
+        """
+        now = timezone.now()
+        lease_until = now + timedelta(seconds=getattr(settings, 'PAYNOW_WEBHOOK_LEASE', 300))
+        due = list(
+            WebhookInbox.objects.filter(status=WebhookInbox.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('received_at', 'id')
+            .values_list('id', 'reference', 'next_attempt_at')[:limit]
+        )
+        # Oldest pending row per reference, counting leased rows and rows waiting for a retry
+        heads = {}
+        pending = (
+            WebhookInbox.objects.filter(status=WebhookInbox.STATUS_PENDING, reference__in={ref for _, ref, _ in due if ref})
+            .order_by('reference', 'received_at', 'id')
+            .values_list('reference', 'id')
+        )
+        for reference, pk in pending:
+            heads.setdefault(reference, pk)
+        claimed = [
+            pk for pk, reference, next_attempt_at in due
+            if (not reference or heads.get(reference) == pk)
+            and WebhookInbox.objects.filter(pk=pk, status=WebhookInbox.STATUS_PENDING, next_attempt_at=next_attempt_at).update(next_attempt_at=lease_until)
+        ]
+        return list(WebhookInbox.objects.filter(pk__in=claimed).order_by('received_at', 'id'))
+
+    @classmethod
+    def process_pending(cls, limit: int = 100) -> dict:
+        """Process one batch of due inbox rows; returns counts by outcome."""
+        counts = {}
+        for row in cls.claim(limit):
+            try:
+                outcome = cls.process(QueryDict(row.body).dict())
+            except Exception as exc:
+                logger.exception('Failed to process webhook %s (attempt %s)', row.pk, row.attempts + 1)
+                attempts = row.attempts + 1
+                failed = attempts >= getattr(settings, 'PAYNOW_WEBHOOK_MAX_ATTEMPTS', 8)
+                WebhookInbox.objects.filter(pk=row.pk).update(
+                    status=WebhookInbox.STATUS_FAILED if failed else WebhookInbox.STATUS_PENDING,
+                    attempts=attempts,
+                    last_error=str(exc)[:2000],
+                    next_attempt_at=timezone.now() + cls.retry_delay(attempts),
+                )
+                outcome = 'error'
+            else:
+                WebhookInbox.objects.filter(pk=row.pk).update(
+                    status=WebhookInbox.STATUS_PROCESSED, outcome=outcome, attempts=row.attempts + 1,
+                    processed_at=timezone.now(), last_error='',
+                )
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return counts
+
+    @staticmethod
+    def replay(ids: Optional[Iterable[int]] = None, since=None) -> int:
+        """Queue stored notifications for processing again; returns how many were queued."""
+        rows = WebhookInbox.objects.all()
+        if ids:
+            rows = rows.filter(pk__in=list(ids))
+        if since is not None:
+            rows = rows.filter(received_at__gte=since)
+        return rows.update(status=WebhookInbox.STATUS_PENDING, next_attempt_at=timezone.now(), attempts=0)
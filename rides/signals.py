@@ -0,0 +1,28 @@
+import logging
+
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Payment
+from .services.payment_refs import PaymentReferenceService, fill_from_response
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(pre_save, sender=Payment)
+def fill_paynow_columns(sender, instance, raw=False, **kwargs):
+    # Poll/redirect URL and upstream status get their own columns so polls skip the JSON
+    if raw or (instance.poll_url and instance.redirect_url and instance.upstream_status):
+        return
+    fill_from_response(instance)
+
+
+@receiver(post_save, sender=Payment)
+def index_payment_references(sender, instance, raw=False, **kwargs):
+    # Keep the webhook alias index (PaymentReference) in step with the payment row
+    if raw:
+        return
+    try:
+        PaymentReferenceService.register(instance.pk, PaymentReferenceService.aliases_for(instance))
+    except Exception:
+        logger.exception('Failed to index references for payment %s (non-fatal)', instance.pk)
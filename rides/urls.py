@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from .views import CreateBookingView, PaynowResultView, PaynowReturnView, PaynowPollView, BookingFormView, BookingSuccessView, PriceEstimateView
+from .views import CreateBookingView, PaynowResultView, PaynowReturnView, PaynowPollView, PaymentStatusWaitView, BookingFormView, BookingSuccessView, PriceEstimateView, PriceBatchView, PriceMatrixView, PriceRulesView
+
+if getattr(settings, 'ASYNC_VIEWS', False):
+    from .async_views import AsyncCreateBookingView as CreateBookingView, AsyncPaynowPollView as PaynowPollView, AsyncPaymentStatusWaitView as PaymentStatusWaitView, AsyncPriceEstimateView as PriceEstimateView
 
 app_name = 'rides'
 
@@ -11,7 +15,12 @@ urlpatterns = [
     # API endpoints
     path('api/bookings/', CreateBookingView.as_view(), name='create_booking'),
     path('api/price/', PriceEstimateView.as_view(), name='price_estimate'),
+    path('api/price/rules/', PriceRulesView.as_view(), name='price_rules'),
+    path('api/price/rules/<str:version>/', PriceRulesView.as_view(), name='price_rules_version'),
+    path('api/price/matrix/', PriceMatrixView.as_view(), name='price_matrix'),
+    path('api/price/batch/', PriceBatchView.as_view(), name='price_batch'),
     path('paynow/result/', PaynowResultView.as_view(), name='paynow_result'),
     path('paynow/return/', PaynowReturnView.as_view(), name='paynow_return'),
     path('paynow/poll/<uuid:pk>/', PaynowPollView.as_view(), name='paynow_poll'),
+    path('paynow/status/<uuid:pk>/', PaymentStatusWaitView.as_view(), name='payment_status_wait'),
 ]
@@ -1,15 +1,26 @@
+import hashlib
 import logging
+from datetime import datetime
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404, redirect, render
 from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.conf import settings
 from django.views.generic import FormView, TemplateView
 
-from .serializers import CreateBookingSerializer, RideBookingSerializer, PaymentSerializer, PriceEstimateSerializer
+from .serializers import CreateBookingSerializer, RideBookingSerializer, PaymentSerializer, PriceEstimateSerializer, PriceBatchSerializer
 from .models import RideBooking, Payment
 from .services.pricing import PricingService
+from .services.quotes import QuoteService
+from .services.payment_state import PaymentStateService
+from .services.payment_events import PaymentEvents
+from .services.payment_refs import poll_url_for
+from .services.reconciler import PaynowReconciler
+from .services.webhooks import WebhookService
 from .services.paynow import PaynowService
 from .services.email_service import EmailService
 from .forms import BookingForm
@@ -17,6 +28,123 @@ from .forms import BookingForm
 logger = logging.getLogger(__name__)
 
 
+def _check_quoted_total(breakdown, quoted_total):
+    """Flag bookings whose client-side quote (static/js/pricing.js) disagrees with the server price."""
+    if quoted_total is None:
+        return
+    breakdown['quoted_total'] = float(quoted_total)
+    if abs(float(quoted_total) - breakdown['total']) >= 0.005:
+        breakdown['quote_mismatch'] = True
+        logger.warning('Client quoted %s but server priced %s (rules version %s)', quoted_total, breakdown['total'], PricingService.rules()['version'])
+
+
+def _create_booking(data, distance, breakdown=None):
+    """Price and persist a booking from validated CreateBookingSerializer/BookingForm data.
+
+    `breakdown` is the signed estimate from a redeemed quote token; without one the booking is priced here.
+    """
+    if breakdown is None:
+        breakdown = PricingService.calculate(
+            distance_km=distance,
+            num_adults=data.get('num_adults', 1),
+            num_kids_seated=data.get('num_kids_seated', 0),
+            num_kids_carried=data.get('num_kids_carried', 0),
+            luggage_count=data.get('luggage_count', 0),
+        )
+    else:
+        breakdown = dict(breakdown)
+    # The server price is always the one charged; a differing client quote is only flagged
+    _check_quoted_total(breakdown, data.get('quoted_total'))
+
+    return RideBooking.objects.create(
+        pickup_address=data['pickup_address'],
+        pickup_lat=data.get('pickup_lat'),
+        pickup_lng=data.get('pickup_lng'),
+        dropoff_address=data['dropoff_address'],
+        dropoff_lat=data.get('dropoff_lat'),
+        dropoff_lng=data.get('dropoff_lng'),
+        distance_km=distance,
+        num_adults=data.get('num_adults', 1),
+        num_kids_seated=data.get('num_kids_seated', 0),
+        num_kids_carried=data.get('num_kids_carried', 0),
+        luggage_count=data.get('luggage_count', 0),
+        pickup_at=data.get('pickup_at'),
+        phone=data['phone'],
+        email=data['email'],
+        payment_option=data['payment_option'],
+        price_breakdown=breakdown,
+        total_amount=breakdown['total'],
+    )
+
+
+def _confirm_pay_on_arrival(booking):
+    # Mark as confirmed (business: booking can be confirmed after selecting Pay on Arrival)
+    booking.status = RideBooking.STATUS_CONFIRMED
+    booking.save()
+
+    # Create a placeholder payment record (unpaid)
+    Payment.objects.create(booking=booking, method=RideBooking.PAYMENT_ON_ARRIVAL, amount=booking.total_amount, status=Payment.STATUS_PENDING)
+
+
+def _record_paynow_initiation(payment, paynow_response):
+    """Store the initiation response on the payment; returns (redirect_url, poll_url)."""
+    # Persist the raw response and try to extract any Paynow reference that can be used
+    # by webhooks to find this Payment later.
+    payment.paynow_response = paynow_response
+    data = (paynow_response.get('response') or {}).get('data') or {}
+    candidates = [
+        paynow_response.get('paynowreference'),
+        paynow_response.get('paynow_reference'),
+        paynow_response.get('reference'),
+        paynow_response.get('transaction_id'),
+        data.get('paynowreference'),
+        data.get('paynow_reference'),
+        data.get('paynowReference'),
+    ]
+    for c in candidates:
+        if c:
+            payment.paynow_reference = str(c)
+            break
+    # Saving copies the poll/redirect URL and upstream status into their columns (rides.signals)
+    payment.save()
+    return payment.redirect_url, payment.poll_url
+
+
+def _record_paynow_failure(payment, exc):
+    payment.status = Payment.STATUS_FAILED
+    payment.paynow_response = {"error": str(exc)}
+    payment.save()
+
+
+def _poll_body(result):
+    """Pending poll response; `cached_age`/`max_age` tell the page how long to wait before asking again."""
+    return {
+        'paid': False,
+        'status': result.get('status'),
+        'cached_age': result.get('cached_age'),
+        'max_age': getattr(settings, 'PAYNOW_POLL_CACHE_TTL', 5),
+    }
+
+
+def _reconciled_status(payment):
+    """Poll response built from the payment row and the reconciler's last result (no upstream call)."""
+    result = PaynowReconciler.cached_result(payment.pk) or {}
+    return {
+        'paid': False,
+        'status': result.get('status') or payment.status,
+        'checked_at': result.get('checked_at'),
+        'cached_age': PaynowReconciler.result_age(result),
+    }
+
+
+def _mark_paid_from_poll(payment):
+    """Transition a polled payment to PAID; returns the booking if this call made the transition."""
+    if not PaymentStateService.mark_paid(payment.pk):
+        logger.info('Poll: payment %s already PAID', payment.pk)
+        return None
+    return RideBooking.objects.get(pk=payment.booking_id)
+
+
 class BookingFormView(FormView):
     template_name = 'rides/booking_form.html'
     form_class = BookingForm
@@ -31,42 +159,15 @@ class BookingFormView(FormView):
     def form_valid(self, form):
         data = form.cleaned_data
 
-        # Compute pricing
-        breakdown = PricingService.calculate(
-            distance_km=data['distance_km'],
-            num_adults=data.get('num_adults', 1),
-            num_kids_seated=data.get('num_kids_seated', 0),
-            num_kids_carried=data.get('num_kids_carried', 0),
-            luggage_count=data.get('luggage_count', 0),
-        )
-
-        booking = RideBooking.objects.create(
-            pickup_address=data['pickup_address'],
-            pickup_lat=data.get('pickup_lat'),
-            pickup_lng=data.get('pickup_lng'),
-            dropoff_address=data['dropoff_address'],
-            dropoff_lat=data.get('dropoff_lat'),
-            dropoff_lng=data.get('dropoff_lng'),
-            distance_km=data['distance_km'],
-            num_adults=data.get('num_adults', 1),
-            num_kids_seated=data.get('num_kids_seated', 0),
-            num_kids_carried=data.get('num_kids_carried', 0),
-            luggage_count=data.get('luggage_count', 0),
-            phone=data['phone'],
-            email=data['email'],
-            payment_option=data['payment_option'],
-            price_breakdown=breakdown,
-            total_amount=breakdown['total'],
-        )
+        # Compute pricing (reusing the estimate when BookingForm.clean redeemed a quote token)
+        quote = data.get('quote') or {}
+        booking = _create_booking(data, data['distance_km'], breakdown=quote.get('breakdown'))
 
         if data['payment_option'] == RideBooking.PAYMENT_ON_ARRIVAL:
-            booking.status = RideBooking.STATUS_CONFIRMED
-            booking.save()
-            Payment.objects.create(booking=booking, method=RideBooking.PAYMENT_ON_ARRIVAL, amount=booking.total_amount, status=Payment.STATUS_PENDING)
+            _confirm_pay_on_arrival(booking)
 
             # Send notifications
-            EmailService.send_owner_notification(booking, payment_status='PAY ON ARRIVAL')
-            EmailService.send_customer_notification(booking, payment_status='PAY ON ARRIVAL')
+            EmailService.send_booking_notifications(booking, payment_status='PAY ON ARRIVAL')
 
             return redirect('rides:booking_success', pk=booking.id)
 
@@ -75,28 +176,7 @@ class BookingFormView(FormView):
         paynow = PaynowService()
         try:
             paynow_response = paynow.create_transaction(amount=float(payment.amount), reference=str(payment.id), email=booking.email, phone=booking.phone)
-            # Persist the raw response and try to extract any Paynow reference that can be used
-            # by webhooks to find this Payment later.
-            payment.paynow_response = paynow_response
-            # Candidate locations for Paynow's reference
-            candidates = [
-                paynow_response.get('paynowreference'),
-                paynow_response.get('paynow_reference'),
-                paynow_response.get('reference'),
-                paynow_response.get('transaction_id'),
-                (paynow_response.get('response') or {}).get('data', {}).get('paynowreference'),
-                (paynow_response.get('response') or {}).get('data', {}).get('paynow_reference'),
-                (paynow_response.get('response') or {}).get('data', {}).get('paynowReference'),
-            ]
-            for c in candidates:
-                if c:
-                    payment.paynow_reference = str(c)
-                    break
-            payment.save()
-
-            redirect_url = paynow_response.get('redirectUrl') or paynow_response.get('redirect_url')
-            # poll url can be returned as 'pollUrl', 'poll_url' or inside response.data
-            poll_url = paynow_response.get('pollUrl') or paynow_response.get('poll_url') or (paynow_response.get('response') or {}).get('poll_url') or (paynow_response.get('response') or {}).get('pollUrl') or (paynow_response.get('response') or {}).get('data', {}).get('poll_url')
+            redirect_url, poll_url = _record_paynow_initiation(payment, paynow_response)
 
             def _is_valid_url(u):
                 try:
@@ -114,6 +194,7 @@ class BookingFormView(FormView):
                     'message': 'Payment initiated. Please follow the instructions or check the payment status via the poll URL.',
                     'payment_id': str(payment.id),
                     'booking_id': str(booking.id),
+                    'wait_url': _status_wait_url(payment.id),
                 }
                 # Save last payment/booking into the session so we can show a friendly summary when user returns without a reference
                 try:
@@ -166,8 +247,13 @@ class CreateBookingView(APIView):
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
-        # Determine distance: either provided by client or calculated using DistanceService
+        # Determine distance: provided by the client, carried by the estimate's quote token, or calculated using DistanceService
         distance = data.get('distance_km')
+        quote = None
+        if distance is None:
+            quote = QuoteService.redeem(data.get('quote_token'), data)
+            if quote:
+                distance = quote['distance_km']
         if distance is None:
             try:
                 from .services.distance import DistanceService
@@ -181,44 +267,13 @@ class CreateBookingView(APIView):
                 return Response({"detail": f"Unable to compute distance: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Calculate price based on the distance and passenger details
-        breakdown = PricingService.calculate(
-            distance_km=distance,
-            num_adults=data.get('num_adults', 1),
-            num_kids_seated=data.get('num_kids_seated', 0),
-            num_kids_carried=data.get('num_kids_carried', 0),
-            luggage_count=data.get('luggage_count', 0),
-        )
-
-        booking = RideBooking.objects.create(
-            pickup_address=data['pickup_address'],
-            pickup_lat=data.get('pickup_lat'),
-            pickup_lng=data.get('pickup_lng'),
-            dropoff_address=data['dropoff_address'],
-            dropoff_lat=data.get('dropoff_lat'),
-            dropoff_lng=data.get('dropoff_lng'),
-            distance_km=distance,
-            num_adults=data.get('num_adults', 1),
-            num_kids_seated=data.get('num_kids_seated', 0),
-            num_kids_carried=data.get('num_kids_carried', 0),
-            luggage_count=data.get('luggage_count', 0),
-            phone=data['phone'],
-            email=data['email'],
-            payment_option=data['payment_option'],
-            price_breakdown=breakdown,
-            total_amount=breakdown['total'],
-        )
+        booking = _create_booking(data, distance, breakdown=quote and quote['breakdown'])
 
         if data['payment_option'] == RideBooking.PAYMENT_ON_ARRIVAL:
-            # Mark as confirmed (business: booking can be confirmed after selecting Pay on Arrival)
-            booking.status = RideBooking.STATUS_CONFIRMED
-            booking.save()
-
-            # Create a placeholder payment record (unpaid)
-            Payment.objects.create(booking=booking, method=RideBooking.PAYMENT_ON_ARRIVAL, amount=booking.total_amount, status=Payment.STATUS_PENDING)
+            _confirm_pay_on_arrival(booking)
 
             # Send emails
-            EmailService.send_owner_notification(booking, payment_status='PAY ON ARRIVAL')
-            EmailService.send_customer_notification(booking, payment_status='PAY ON ARRIVAL')
+            EmailService.send_booking_notifications(booking, payment_status='PAY ON ARRIVAL')
 
             return Response(RideBookingSerializer(booking).data, status=status.HTTP_201_CREATED)
 
@@ -228,27 +283,12 @@ class CreateBookingView(APIView):
 
         try:
             paynow_response = paynow.create_transaction(amount=float(payment.amount), reference=str(payment.id), email=booking.email, phone=booking.phone)
-            payment.paynow_response = paynow_response
-            # Persist any Paynow-assigned reference
-            candidates = [
-                paynow_response.get('paynowreference'),
-                paynow_response.get('paynow_reference'),
-                paynow_response.get('reference'),
-                paynow_response.get('transaction_id'),
-                (paynow_response.get('response') or {}).get('data', {}).get('paynowreference'),
-            ]
-            for c in candidates:
-                if c:
-                    payment.paynow_reference = str(c)
-                    break
-            payment.save()
+            redirect_url, poll_url = _record_paynow_initiation(payment, paynow_response)
             # Return redirect url to client
-            return Response({"payment": PaymentSerializer(payment).data, "redirect_url": paynow_response.get('redirectUrl') or paynow_response.get('redirect_url'), "poll_url": paynow_response.get('pollUrl') or paynow_response.get('poll_url') or (paynow_response.get('response') or {}).get('poll_url')}, status=status.HTTP_201_CREATED)
+            return Response({"payment": PaymentSerializer(payment).data, "redirect_url": redirect_url, "poll_url": poll_url}, status=status.HTTP_201_CREATED)
         except Exception as exc:
             logger.exception("Paynow creation failed")
-            payment.status = Payment.STATUS_FAILED
-            payment.paynow_response = {"error": str(exc)}
-            payment.save()
+            _record_paynow_failure(payment, exc)
             return Response({"detail": "Payment initiation failed"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -261,127 +301,25 @@ class PaynowResultView(APIView):
         paynow = PaynowService()
         # Log incoming webhook (debug): raw body and headers (useful to trace test-mode notifications)
         logger.debug('Incoming Paynow webhook: headers=%s body=%s', {k:v for k,v in request.META.items() if k.startswith('HTTP_')}, request.body[:2000])
+
+        # A byte-identical re-send of a notification we already handled: ACK without verifying again
+        dedupe_key = WebhookService.dedupe_key(request.body, request.POST.get('reference'), request.META.get('HTTP_X_PAYNOW_SIGNATURE'))
+        if WebhookService.seen(dedupe_key):
+            logger.info('Duplicate Paynow webhook acknowledged from cache')
+            return Response({'ok': True})
+
         # Verify signature
         if not paynow.verify_notification(request):
             logger.warning('Paynow webhook failed signature verification')
             return Response({'detail': 'Invalid signature'}, status=status.HTTP_403_FORBIDDEN)
 
-        from decimal import Decimal
-        from django.db import transaction
-
-        data = request.POST.dict()
-        status_text = (data.get('status') or '').strip()
-        logger.info('Paynow webhook data: %s', data)
-
-        # Paynow can send the local reference as 'reference' or 'transaction_id',
-        # but often sends its own 'paynowreference' field — try a few candidates.
-        reference_candidates = [
-            data.get('reference'),
-            data.get('transaction_id'),
-            data.get('paynowreference'),
-            data.get('paynow_reference'),
-        ]
-
-        payment = None
-        for ref in reference_candidates:
-            if not ref:
-                continue
-            # Try to match the Paynow reference stored on the Payment
-            payment = Payment.objects.filter(paynow_reference=ref).first()
-            if payment:
-                logger.debug('Matched payment by paynow_reference: %s', payment.id)
-                break
-            # If the reference looks like our local payment id, try that too
-            try:
-                payment = Payment.objects.get(pk=ref)
-                logger.debug('Matched payment by local id: %s', payment.id)
-                break
-            except Exception:
-                pass
-
-        if not payment:
-            # As a last resort, search payments whose saved paynow_response contains the paynow reference
-            payref = data.get('paynowreference') or data.get('paynow_reference') or data.get('paynowReference')
-            if payref:
-                payment = Payment.objects.filter(paynow_response__icontains=str(payref)).first()
-                if payment:
-                    logger.debug('Matched payment by searching paynow_response for paynowreference: %s', payment.id)
-
-        if not payment:
-            # Don't fail the webhook outright (Paynow may retry). Log and ACK to avoid retries.
-            logger.warning('Paynow webhook for unknown reference: %s', reference_candidates)
-            return Response({'ok': True})
-
-        # Ensure payment.paynow_reference is recorded if provided in the webhook
-        payref = data.get('paynowreference') or data.get('paynow_reference') or data.get('paynowReference')
-        if payref and not payment.paynow_reference:
-            payment.paynow_reference = payref
-            payment.save()
-            logger.debug('Updated payment %s paynow_reference=%s from webhook', payment.id, payref)
-
-        # Only treat explicit 'Paid' as a success. Other statuses may be intermediate and should
-        # not immediately move a PENDING->FAILED state (Paynow may send 'Awaiting Delivery' etc.).
-        FAILURE_STATUSES = { 'failed', 'cancelled', 'expired' }
-
-        with transaction.atomic():
-            # Lock the payment row to avoid races between concurrent webhooks/pollers
-            p = Payment.objects.select_for_update().get(pk=payment.pk)
-
-            # If we've already recorded PAID, ack and do nothing else (idempotent)
-            if p.status == Payment.STATUS_PAID:
-                logger.info('Webhook for already-PAID payment %s received; ignoring', p.id)
-                return Response({'ok': True})
-
-            # If Paynow reports paid, validate amount (if provided) before confirming
-            if status_text and status_text.lower() == 'paid':
-                incoming_amount = data.get('amount')
-                if incoming_amount:
-                    try:
-                        inc_amt = Decimal(incoming_amount)
-                    except Exception:
-                        logger.warning('Unable to parse amount from webhook: %s', incoming_amount)
-                        inc_amt = None
-
-                    # If amount doesn't match expected, mark for manual review rather than auto-confirm
-                    if inc_amt is not None and inc_amt != p.amount:
-                        logger.error('Webhook amount mismatch for payment %s: expected=%s got=%s', p.id, p.amount, inc_amt)
-                        # Record raw webhook in paynow_response for manual inspection and mark FAILED
-                        p.paynow_response = p.paynow_response or {}
-                        p.paynow_response['last_webhook'] = data
-                        p.status = Payment.STATUS_FAILED
-                        p.save()
-                        return Response({'ok': True})
-
-                # Transition to PAID
-                p.status = Payment.STATUS_PAID
-                p.save()
-
-                booking = p.booking
-                booking.status = RideBooking.STATUS_CONFIRMED
-                booking.save()
-
-                # Send confirmation emails (guard must be outside the DB transaction)
-                EmailService.send_payment_confirmation(booking)
-                EmailService.send_owner_notification(booking, payment_status='PAID')
-
-                logger.info('Payment %s marked PAID via webhook', p.id)
-                return Response({'ok': True})
-
-            # For explicit failure statuses, mark FAILED
-            if status_text and status_text.lower() in FAILURE_STATUSES:
-                p.status = Payment.STATUS_FAILED
-                p.paynow_response = p.paynow_response or {}
-                p.paynow_response['last_webhook'] = data
-                p.save()
-                logger.info('Payment %s marked FAILED via webhook (status=%s)', p.id, status_text)
-                return Response({'ok': True})
-
-            # Otherwise, treat as intermediate: record the webhook but keep PENDING
-            p.paynow_response = p.paynow_response or {}
-            p.paynow_response['last_webhook'] = data
-            p.save()
-            logger.info('Payment %s received intermediate webhook status=%s; left as PENDING', p.id, status_text)
-            return Response({'ok': True})
+        # Inbox mode: persist the verified body and ACK at once; `process_webhooks` applies it
+        if WebhookService.inbox_enabled():
+            WebhookService.ingest(request.body)
+        else:
+            WebhookService.process(request.POST.dict())
+        WebhookService.remember(dedupe_key)
+        return Response({'ok': True})
 
 
 class PaynowReturnView(APIView):
@@ -444,6 +382,7 @@ class PaynowReturnView(APIView):
                             'eta_minutes': eta_minutes,
                             'maps_url': maps_url,
                             'poll_url': poll_url,
+                            'wait_url': _status_wait_url(payment.pk),
                             'TAXI_OWNER_PHONE': settings.TAXI_OWNER_PHONE,
                         })
                 except Exception:
@@ -516,41 +455,91 @@ class PaynowReturnView(APIView):
             'eta_minutes': eta_minutes,
             'maps_url': maps_url,
             'poll_url': poll_url,
+            'wait_url': _status_wait_url(payment.pk),
         }
         return render(request, 'rides/paynow_return.html', context)
 
 
+# Columns the poll endpoints read; paynow_response is never loaded
+POLL_FIELDS = ('id', 'booking_id', 'status', 'poll_url', 'paynow_reference')
+
+
+def _poll_validators(pk):
+    """(ETag, Last-Modified timestamp) of a payment's poll response, or None if it must be rebuilt.
+
+    Derived from the payment's status and updated_at (one primary-key lookup of those columns)
+    plus the cached upstream check a pending payment is answered from. A pending payment in
+    upstream mode without a fresh cached check has no validators: the poll has to ask Paynow.
+    """
+    state = Payment.objects.filter(pk=pk).values('status', 'updated_at').first()
+    if state is None:
+        return None
+    checked_at = ''
+    last_modified = state['updated_at']
+    if state['status'] != Payment.STATUS_PAID:
+        if PaynowReconciler.enabled():
+            cached = PaynowReconciler.cached_result(pk)
+        else:
+            cached = PaynowReconciler.fresh_result(pk)
+            if cached is None:
+                return None
+        checked_at = (cached or {}).get('checked_at') or ''
+        if checked_at:
+            last_modified = max(last_modified, datetime.fromisoformat(checked_at))
+    digest = hashlib.sha1(f"{state['status']}|{state['updated_at'].isoformat()}|{checked_at}".encode()).hexdigest()
+    return f'"{digest}"', int(last_modified.timestamp())
+
+
+def _set_poll_validators(response, validators):
+    if validators is not None:
+        response['ETag'] = validators[0]
+        response['Last-Modified'] = http_date(validators[1])
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 class PaynowPollView(APIView):
     """AJAX endpoint to poll Paynow for a payment status.
 
-    GET /rides/paynow/poll/<payment_id>/ => { paid: bool, status: str }
+    GET /rides/paynow/poll/<payment_id>/ => { paid: bool, status: str, cached_age: float, max_age: int }
+
+    Responses carry an ETag and Last-Modified; a poll sending a matching If-None-Match gets
+    304 Not Modified without the payment row being loaded.
     """
 
     def get(self, request, pk):
-        # import locally to keep top-level imports minimal
-        import requests as _requests
-        paynow = PaynowService()
+        validators = _poll_validators(pk)
+        if validators is not None:
+            not_modified = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+            if not_modified is not None:
+                return _set_poll_validators(not_modified, validators)
+
+        response = self._poll(pk)
+        if response.status_code == status.HTTP_200_OK:
+            _set_poll_validators(response, _poll_validators(pk))
+        return response
 
-        payment = get_object_or_404(Payment, pk=pk)
+    def _poll(self, pk):
+        payment = get_object_or_404(Payment.objects.only(*POLL_FIELDS), pk=pk)
 
         # If already paid, short-circuit
         if payment.status == Payment.STATUS_PAID:
             return Response({'paid': True, 'status': 'PAID', 'message': 'Already confirmed'})
 
-        # Try to find poll url where Paynow exposes the check endpoint
-        pr = payment.paynow_response or {}
-        poll_url = pr.get('pollUrl') or pr.get('poll_url') or (pr.get('response') or {}).get('poll_url') or (pr.get('response') or {}).get('pollUrl') or (pr.get('response') or {}).get('data', {}).get('poll_url')
+        # Reconciler mode: `reconcile_payments` does the upstream checks; answer from its result
+        if PaynowReconciler.enabled():
+            return Response(_reconciled_status(payment))
 
-        # As a last resort attempt to compose a Paynow check URL using the paynow_reference
-        if not poll_url and payment.paynow_reference:
-            poll_url = f"https://www.paynow.co.zw/Interface/CheckPayment/?guid={payment.paynow_reference}"
+        # Try to find poll url where Paynow exposes the check endpoint
+        poll_url = poll_url_for(payment)
 
         if not poll_url:
             return Response({'error': 'no_poll_url', 'message': 'No poll URL available for this payment.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Use PaynowService.verify_payment (SDK) if available, otherwise fall back to a simple HTTP probe
+        # Use PaynowService.verify_payment (SDK) if available, otherwise fall back to a simple HTTP probe.
+        # Results are shared for a few seconds and concurrent polls share one upstream call.
         try:
-            status_obj = paynow.verify_payment(poll_url)
+            status_obj = PaynowReconciler.check_cached(payment, poll_url)
         except Exception as e:
             logger.exception('Error checking Paynow status: %s', e)
             return Response({'error': 'verify_failed', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -562,21 +551,9 @@ class PaynowPollView(APIView):
             pass
 
         if status_obj.get('paid'):
-            from django.db import transaction
-            with transaction.atomic():
-                p = Payment.objects.select_for_update().get(pk=payment.pk)
-                if p.status == Payment.STATUS_PAID:
-                    logger.info('Poll: payment %s already PAID', p.id)
-                    return Response({'paid': True, 'status': status_obj.get('status')})
-
-                # Optionally verify amount via status_obj if included (SDK may return amount)
-                # Transition to PAID
-                p.status = Payment.STATUS_PAID
-                p.save()
-
-                booking = p.booking
-                booking.status = RideBooking.STATUS_CONFIRMED
-                booking.save()
+            booking = _mark_paid_from_poll(payment)
+            if booking is None:
+                return Response({'paid': True, 'status': status_obj.get('status')})
 
             # Send notifications outside DB transaction
             EmailService.send_payment_confirmation(booking)
@@ -584,7 +561,51 @@ class PaynowPollView(APIView):
 
             return Response({'paid': True, 'status': status_obj.get('status')})
 
-        return Response({'paid': False, 'status': status_obj.get('status')})
+        return Response(_poll_body(status_obj))
+
+
+def _wait_params(request, cap):
+    """(last seen status, timeout) of a status long-poll; the timeout is capped at `cap` seconds."""
+    try:
+        timeout = float(request.GET.get('timeout', cap))
+    except ValueError:
+        timeout = cap
+    return request.GET.get('status') or None, min(max(timeout, 0), cap)
+
+
+def _wait_body(current, last):
+    return {'paid': current == Payment.STATUS_PAID, 'status': current, 'changed': current != last}
+
+
+def _status_wait_url(pk):
+    """Long-poll URL for the payment pages, or None to make them short-poll the poll endpoint.
+
+    Only the async view waits without holding a worker thread, so pages long-poll only when
+    `ASYNC_VIEWS` routes the endpoint to it.
+    """
+    if not getattr(settings, 'ASYNC_VIEWS', False):
+        return None
+    from django.urls import reverse
+    return reverse('rides:payment_status_wait', args=[pk])
+
+
+class PaymentStatusWaitView(APIView):
+    """Long-poll a payment's status.
+
+    GET /rides/paynow/status/<payment_id>/?status=PENDING&timeout=25 => { paid: bool, status: str, changed: bool }
+
+    Answers as soon as the status differs from `status` (at once when it is omitted) or after
+    `timeout` seconds. Transitions from the webhook, poll and reconciler paths wake it up.
+    This sync variant holds a worker thread while it waits, so its timeout is capped at
+    `PAYMENT_WAIT_SYNC_TIMEOUT` (default 0: answer at once); see `_status_wait_url`.
+    """
+
+    def get(self, request, pk):
+        last, timeout = _wait_params(request, getattr(settings, 'PAYMENT_WAIT_SYNC_TIMEOUT', 0))
+        current = PaymentEvents.wait(pk, last, timeout)
+        if current is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(_wait_body(current, last))
 
 
 class PriceEstimateView(APIView):
@@ -595,13 +616,20 @@ class PriceEstimateView(APIView):
         data = serializer.validated_data
 
         distance = data.get('distance_km')
+        provisional = False
         if distance is None:
             try:
-                from .services.distance import DistanceService
-                distance = DistanceService.get_distance_km(
-                    (data.get('pickup_lat'), data.get('pickup_lng')),
-                    (data.get('dropoff_lat'), data.get('dropoff_lng')),
-                )
+                from .services.distance import DistanceService, is_estimated
+                origin = (data.get('pickup_lat'), data.get('pickup_lng'))
+                destination = (data.get('dropoff_lat'), data.get('dropoff_lng'))
+                if data.get('provisional'):
+                    # Instant quote from the offline estimator; no Google round trip
+                    distance = DistanceService.estimate_distance_km(origin, destination)
+                    provisional = True
+                else:
+                    distance = DistanceService.get_distance_km(origin, destination)
+                    # Google was unavailable and the estimator answered: never sign it into a quote token
+                    provisional = is_estimated(distance)
             except Exception as exc:
                 logger.exception("Distance computation failed in price estimate")
                 return Response({"detail": f"Unable to compute distance: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
@@ -613,5 +641,94 @@ class PriceEstimateView(APIView):
             num_kids_carried=data.get('num_kids_carried', 0),
             luggage_count=data.get('luggage_count', 0),
         )
+        if provisional:
+            breakdown['provisional'] = True
+        else:
+            # Lets the booking reuse this distance and price instead of recomputing them
+            breakdown['quote_token'] = QuoteService.issue(data, distance, breakdown)
+
+        return Response(breakdown)
+
+
+class PriceRulesView(APIView):
+    """Pricing rules for client-side quoting (static/js/pricing.js).
+
+    GET /api/price/rules/ is revalidated by ETag (304 when unchanged) and short-lived in caches;
+    GET /api/price/rules/<version>/ never changes and may be cached indefinitely by browsers and
+    CDNs. Both carry the rules version, which changes whenever settings.PRICING does.
+    """
+    def get(self, request, version=None):
+        rules = PricingService.rules()
+        current_url = reverse('rides:price_rules_version', kwargs={'version': rules['version']})
+        if version is not None and version != rules['version']:
+            return Response({'detail': 'Unknown pricing rules version', 'version': rules['version'], 'url': current_url}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{rules["version"]}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(dict(rules, url=current_url))
+        response['ETag'] = etag
+        if version is None:
+            patch_cache_control(response, public=True, max_age=getattr(settings, 'PRICING_RULES_MAX_AGE', 300))
+        else:
+            patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+        return response
+
+
+class PriceMatrixView(APIView):
+    """Every quote for one route, so the booking form can reprice passenger/luggage changes locally.
+
+    Accepts the same body as PriceEstimateView (passenger counts are ignored) and returns
+    PricingService.quote_matrix over the ranges in settings.PRICE_MATRIX_LIMITS.
+    """
+    def post(self, request):
+        serializer = PriceEstimateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        distance = data.get('distance_km')
+        provisional = False
+        if distance is None:
+            try:
+                from .services.distance import DistanceService, is_estimated
+                origin = (data.get('pickup_lat'), data.get('pickup_lng'))
+                destination = (data.get('dropoff_lat'), data.get('dropoff_lng'))
+                if data.get('provisional'):
+                    distance = DistanceService.estimate_distance_km(origin, destination)
+                    provisional = True
+                else:
+                    distance = DistanceService.get_distance_km(origin, destination)
+                    provisional = is_estimated(distance)
+            except Exception as exc:
+                logger.exception("Distance computation failed in price matrix")
+                return Response({"detail": f"Unable to compute distance: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        limits = getattr(settings, 'PRICE_MATRIX_LIMITS', {})
+        matrix = PricingService.quote_matrix(
+            distance,
+            max_adults=limits.get('num_adults', 8),
+            max_kids_seated=limits.get('num_kids_seated', 6),
+            max_luggage=limits.get('luggage_count', 8),
+        )
+        if provisional:
+            matrix['provisional'] = True
+        else:
+            matrix['quote_token'] = QuoteService.issue(data, distance)
+        return Response(matrix)
+
+
+class PriceBatchView(APIView):
+    """Quote many routes at once from known distances (partner route lists, repricing jobs).
+
+    POST {"rows": [{"distance_km": 14.2, "num_adults": 2, ...}, ...], "breakdown": true}
+    => {"count": n, "results": [breakdown, ...]} or, with "breakdown": false, {"count": n, "totals": [...]}
+    """
+    def post(self, request):
+        serializer = PriceBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data['rows']
 
-        return Response(breakdown)
\ No newline at end of file
+        results = PricingService.calculate_many(rows)
+        if not serializer.validated_data['breakdown']:
+            return Response({'count': len(results), 'totals': [r['total'] for r in results]})
+        return Response({'count': len(results), 'results': results})
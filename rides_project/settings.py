@@ -73,6 +73,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "rides_project.wsgi.application"
+ASGI_APPLICATION = "rides_project.asgi.application"
+# Route the booking, price estimate and Paynow poll endpoints to their async variants
+# (rides/async_views.py). Only useful when served by an ASGI server, e.g.
+#   gunicorn rides_project.asgi:application -k uvicorn.workers.UvicornWorker
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False") == "True"
 
 # Database
 
@@ -97,6 +102,30 @@ else:
         }
     }
 
+# Caches
+# "default" is a per-process in-memory cache; it also acts as the L1 tier in front of "shared".
+# "shared" lives in the database (rides.CacheEntry) so every worker sees the same entries and they
+# survive restarts; it is size-bounded with LRU eviction and needs no external cache service.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "rides-l1",
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+    "shared": {
+        "BACKEND": "rides.cache.LRUDatabaseCache",
+        "TIMEOUT": 6 * 3600,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "50000")),
+            "CULL_FREQUENCY": 10,
+        },
+    },
+}
+# Cache hit/miss counters are kept per process and added to the shared cache every N events
+# or after this many seconds (see rides.cache.HitCounter)
+CACHE_STATS_FLUSH_EVERY = int(os.getenv("CACHE_STATS_FLUSH_EVERY", "100"))
+CACHE_STATS_FLUSH_INTERVAL = int(os.getenv("CACHE_STATS_FLUSH_INTERVAL", "60"))
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = []
@@ -128,6 +157,22 @@ EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "enquiries@easytransit.co.zw")
 
+# Email outbox: when enabled, notifications are queued in the database and delivered by
+# `python manage.py send_outbox` instead of being sent over SMTP inside the request.
+EMAIL_OUTBOX_ENABLED = os.getenv("EMAIL_OUTBOX_ENABLED", "False") == "True"
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+# Retry delay doubles from RETRY_BASE up to RETRY_MAX seconds
+EMAIL_OUTBOX_RETRY_BASE = int(os.getenv("EMAIL_OUTBOX_RETRY_BASE", "30"))
+EMAIL_OUTBOX_RETRY_MAX = int(os.getenv("EMAIL_OUTBOX_RETRY_MAX", "3600"))
+# Seconds a worker holds claimed rows before another worker may retry them
+EMAIL_OUTBOX_LEASE = int(os.getenv("EMAIL_OUTBOX_LEASE", "300"))
+# Owner digest (needs the outbox): non-urgent owner notifications are batched per window into
+# one email. Bookings picked up within OWNER_DIGEST_URGENT_MINUTES, or ASAP, are sent at once.
+OWNER_DIGEST_ENABLED = os.getenv("OWNER_DIGEST_ENABLED", "False") == "True"
+OWNER_DIGEST_WINDOW = int(os.getenv("OWNER_DIGEST_WINDOW", "900"))
+OWNER_DIGEST_URGENT_MINUTES = int(os.getenv("OWNER_DIGEST_URGENT_MINUTES", "120"))
+
 # Google Maps
 # New split keys: use a client key for browser (Maps JS + Places) and a server key for
 # server-to-server calls (Distance Matrix). For backwards compatibility the old
@@ -138,6 +183,34 @@ GOOGLE_MAPS_SERVER_KEY = os.getenv("GOOGLE_MAPS_SERVER_KEY", os.getenv("GOOGLE_M
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", GOOGLE_MAPS_CLIENT_KEY)
 # Cache timeout for distance results (seconds)
 GOOGLE_DISTANCE_CACHE_TIMEOUT = int(os.getenv("GOOGLE_DISTANCE_CACHE_TIMEOUT", str(6 * 3600)))
+# Distance cache key quantization: "exact" (6 decimals), "grid" (metric cells) or "geohash".
+# With grid/geohash nearby endpoints share a cached result; the worst-case error is stored with
+# each entry. Switching mode changes every cache key, so clear the distance cache when you do.
+DISTANCE_CACHE_QUANTIZATION = os.getenv("DISTANCE_CACHE_QUANTIZATION", "exact")
+DISTANCE_CACHE_CELL_METERS = int(os.getenv("DISTANCE_CACHE_CELL_METERS", "100"))
+DISTANCE_CACHE_GEOHASH_PRECISION = int(os.getenv("DISTANCE_CACHE_GEOHASH_PRECISION", "7"))
+# Share one entry for A->B and B->A (road distances are usually, not always, symmetric)
+DISTANCE_CACHE_SYMMETRIC = os.getenv("DISTANCE_CACHE_SYMMETRIC", "False") == "True"
+# How long a distance stays in the per-process L1 cache in front of the shared tier (seconds)
+DISTANCE_L1_CACHE_TIMEOUT = int(os.getenv("DISTANCE_L1_CACHE_TIMEOUT", "300"))
+# How long an expired distance may still be served while it is refreshed in the background (seconds)
+DISTANCE_STALE_TTL = int(os.getenv("DISTANCE_STALE_TTL", str(24 * 3600)))
+# Latency budget for a Distance Matrix request (seconds). When Google is slower than this or
+# fails, DistanceService falls back to the offline estimator (haversine x circuity factor).
+GOOGLE_DISTANCE_TIMEOUT = float(os.getenv("GOOGLE_DISTANCE_TIMEOUT", "5"))
+DISTANCE_ESTIMATE_FALLBACK = os.getenv("DISTANCE_ESTIMATE_FALLBACK", "True") == "True"
+# Road/straight-line ratio used until enough bookings exist to calibrate it
+DISTANCE_CIRCUITY_FACTOR = float(os.getenv("DISTANCE_CIRCUITY_FACTOR", "1.3"))
+DISTANCE_CIRCUITY_MIN_SAMPLES = 20
+DISTANCE_CIRCUITY_SAMPLE_SIZE = 500
+DISTANCE_CIRCUITY_CACHE_TIMEOUT = 24 * 3600
+
+# Pooled upstream HTTP clients (see rides/services/http.py for defaults). Per-client overrides, e.g.
+# {"google": {"pool_maxsize": 20}, "paynow": {"read_timeout": 20, "connect_retries": 1}}
+HTTP_CLIENTS = {}
+# Circuit breakers on the pooled clients (see rides/services/circuit.py for defaults), e.g.
+# {"paynow": {"failure_rate": 0.5, "min_calls": 10, "window": 60, "reset_timeout": 30, "state_ttl": 5, "flush_every": 20}}
+CIRCUIT_BREAKERS = {}
 
 PAYNOW_INTEGRATION_ID='22865'
 PAYNOW_INTEGRATION_KEY='1aa3dd1c-5b72-4205-a3bc-f7a54906f3e5'
@@ -148,6 +221,36 @@ PAYNOW_RESULT_URL = os.getenv("PAYNOW_RESULT_URL", f"{BASE_URL}/rides/paynow/res
 PAYNOW_MERCHANT_EMAIL='mufambisitendaiblessed@gmail.com'
 # Set to False to disable TLS certificate verification for Paynow (use only for local testing)
 PAYNOW_VERIFY_SSL=False
+# "inline" processes result notifications inside the webhook request; "inbox" stores them
+# (deduplicated) and returns 200 at once, leaving them to `python manage.py process_webhooks`
+PAYNOW_WEBHOOK_MODE = os.getenv("PAYNOW_WEBHOOK_MODE", "inline")
+# Inbox processing (independent of the email outbox settings): lease per claimed row, attempts
+# before a row is marked FAILED, and the exponential retry backoff in seconds
+PAYNOW_WEBHOOK_LEASE = int(os.getenv("PAYNOW_WEBHOOK_LEASE", "300"))
+PAYNOW_WEBHOOK_MAX_ATTEMPTS = int(os.getenv("PAYNOW_WEBHOOK_MAX_ATTEMPTS", "8"))
+PAYNOW_WEBHOOK_RETRY_BASE = int(os.getenv("PAYNOW_WEBHOOK_RETRY_BASE", "30"))
+PAYNOW_WEBHOOK_RETRY_MAX = int(os.getenv("PAYNOW_WEBHOOK_RETRY_MAX", "3600"))
+# Identical re-sent notifications are ACKed from cache for this many seconds
+PAYNOW_WEBHOOK_DEDUPE_TTL = int(os.getenv("PAYNOW_WEBHOOK_DEDUPE_TTL", "3600"))
+# "upstream" checks Paynow on every status poll; "reconciler" answers polls from the DB/cache
+# and leaves the checking to `python manage.py reconcile_payments`
+PAYNOW_POLL_MODE = os.getenv("PAYNOW_POLL_MODE", "upstream")
+# Seconds an upstream poll result is reused by every status poll for the same payment
+PAYNOW_POLL_CACHE_TTL = int(os.getenv("PAYNOW_POLL_CACHE_TTL", "5"))
+# Poll replies longer than this are not status messages and are rejected without reading further
+PAYNOW_STATUS_MAX_BYTES = int(os.getenv("PAYNOW_STATUS_MAX_BYTES", "8192"))
+# Status long-poll (rides:payment_status_wait), used by the payment pages only with ASYNC_VIEWS:
+# longest wait per request, how often a waiter re-checks the local cache, and how long a status
+# is kept locally before it is re-read from the shared cache (the delay for transitions made in
+# another process). The sync view holds a worker thread, so it waits at most
+# PAYMENT_WAIT_SYNC_TIMEOUT seconds (0: answer at once).
+PAYMENT_WAIT_TIMEOUT = int(os.getenv("PAYMENT_WAIT_TIMEOUT", "25"))
+PAYMENT_WAIT_INTERVAL = float(os.getenv("PAYMENT_WAIT_INTERVAL", "1.0"))
+PAYMENT_WAIT_REFRESH = int(os.getenv("PAYMENT_WAIT_REFRESH", "5"))
+PAYMENT_WAIT_SYNC_TIMEOUT = int(os.getenv("PAYMENT_WAIT_SYNC_TIMEOUT", "0"))
+PAYNOW_RECONCILE_WORKERS = int(os.getenv("PAYNOW_RECONCILE_WORKERS", "8"))
+PAYNOW_RECONCILE_MAX_AGE = int(os.getenv("PAYNOW_RECONCILE_MAX_AGE", str(24 * 3600)))
+PAYNOW_RECONCILE_RESULT_TTL = int(os.getenv("PAYNOW_RECONCILE_RESULT_TTL", "3600"))
 # Taxi owner contact (defaults to easytransit from user input)
 TAXI_OWNER_EMAIL = os.getenv("TAXI_OWNER_EMAIL", "enquiries@easytransit.co.zw")
 TAXI_OWNER_PHONE = os.getenv("TAXI_OWNER_PHONE", "+263789423154")
@@ -168,6 +271,15 @@ PRICING = {
     "LUGGAGE_FEE": 5.0,
 }
 
+# Cache lifetime (seconds) of the unversioned /api/price/rules/ export; versioned URLs are immutable
+PRICING_RULES_MAX_AGE = int(os.getenv("PRICING_RULES_MAX_AGE", "300"))
+# Lifetime (seconds) of the signed quote_token returned by the price estimate; bookings reuse its distance and price
+QUOTE_TOKEN_MAX_AGE = int(os.getenv("QUOTE_TOKEN_MAX_AGE", "900"))
+# Passenger/luggage ranges covered by /api/price/matrix/; the booking form asks /api/price/ beyond them
+PRICE_MATRIX_LIMITS = {"num_adults": 8, "num_kids_seated": 6, "luggage_count": 8}
+# Maximum rows accepted by /api/price/batch/ per request
+PRICE_BATCH_MAX_ROWS = int(os.getenv("PRICE_BATCH_MAX_ROWS", "5000"))
+
 # Use JSONField default for Django < 3.1 alternative
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import httpx
+import pytest
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.test import AsyncRequestFactory
+
+from rides import async_views
+from rides.async_views import AsyncPaynowPollView, AsyncPriceEstimateView
+from rides.models import Payment, RideBooking
+from rides.services import distance, http, paynow
+from rides.services.distance import DistanceService
+from rides.services.email_service import EmailService
+from rides.services.paynow_status import expected_hash
+
+
+class FakeResponse:
+    def __init__(self, payload=None, text='', status_code=200):
+        self.payload = payload
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+def _matrix(meters):
+    return {"status": "OK", "rows": [{"elements": [{"status": "OK", "distance": {"value": meters}}]}]}
+
+
+def test_async_price_estimate(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+
+    async def fake_arequest(name, method, url, **kwargs):
+        assert name == 'google'
+        return FakeResponse(_matrix(11000))
+
+    monkeypatch.setattr(distance, 'arequest', fake_arequest)
+
+    payload = {'pickup_lat': -17.8, 'pickup_lng': 31.0, 'dropoff_lat': -17.9, 'dropoff_lng': 31.1, 'num_adults': 1}
+    request = AsyncRequestFactory().post('/rides/api/price/', json.dumps(payload), content_type='application/json')
+    resp = async_to_sync(AsyncPriceEstimateView.as_view())(request)
+    assert resp.status_code == 200
+    assert json.loads(resp.content)['distance_km'] == 11.0
+
+
+def test_concurrent_async_lookups_share_one_call(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    calls = {'n': 0}
+
+    async def slow_arequest(name, method, url, **kwargs):
+        calls['n'] += 1
+        await asyncio.sleep(0.05)
+        return FakeResponse(_matrix(7000))
+
+    monkeypatch.setattr(distance, 'arequest', slow_arequest)
+
+    async def run():
+        return await asyncio.gather(*[
+            DistanceService.aget_distance_km((-17.8, 31.0), (-17.9, 31.1)) for _ in range(5)
+        ])
+
+    assert async_to_sync(run)() == [7.0] * 5
+    assert calls['n'] == 1
+
+
+def test_arequest_maps_httpx_errors(monkeypatch):
+    def handler(request):
+        raise httpx.ConnectError('refused', request=request)
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(http, '_get_async_client', lambda name, verify=True: client)
+        with pytest.raises(requests.ConnectionError):
+            await http.arequest('paynow', 'GET', 'https://www.paynow.co.zw/')
+        await client.aclose()
+
+    async_to_sync(run)()
+
+
+@pytest.mark.django_db
+def test_async_poll_marks_paid(monkeypatch):
+    booking = RideBooking.objects.create(
+        pickup_address='A', dropoff_address='B', distance_km=10, phone='077', email='a@b.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=20,
+    )
+    payment = Payment.objects.create(
+        booking=booking, method='PAYNOW', amount=20, status=Payment.STATUS_PENDING,
+        paynow_response={'pollUrl': 'https://www.paynow.co.zw/Interface/CheckPayment/?guid=abc'},
+    )
+    sent = []
+    monkeypatch.setattr(EmailService, 'send_payment_confirmation', staticmethod(lambda b: sent.append('customer')))
+    monkeypatch.setattr(EmailService, 'send_owner_notification', staticmethod(lambda b, payment_status=None: sent.append('owner')))
+    # Emails run in a worker thread; keep them on the test thread so they see the test transaction
+    monkeypatch.setattr(async_views, '_send_emails', _send_inline)
+
+    fields = [('reference', '1'), ('paynowreference', '99'), ('amount', '20.00'), ('status', 'Paid')]
+    body = urlencode(fields + [('hash', expected_hash(fields, settings.PAYNOW_INTEGRATION_KEY))])
+
+    async def fake_arequest(name, method, url, **kwargs):
+        assert name == 'paynow' and method == 'POST' and kwargs['max_bytes']
+        return http.CappedResponse(200, body.encode(), False)
+
+    monkeypatch.setattr(paynow, 'arequest', fake_arequest)
+
+    request = AsyncRequestFactory().get(f'/rides/paynow/poll/{payment.pk}/')
+    resp = async_to_sync(AsyncPaynowPollView.as_view())(request, pk=payment.pk)
+    assert json.loads(resp.content) == {'paid': True, 'status': 'paid'}
+
+    payment.refresh_from_db()
+    booking.refresh_from_db()
+    assert payment.status == Payment.STATUS_PAID
+    assert booking.status == RideBooking.STATUS_CONFIRMED
+    assert sent == ['customer', 'owner']
+
+
+async def _send_inline(*calls):
+    for fn, args, kwargs in calls:
+        fn(*args, **kwargs)
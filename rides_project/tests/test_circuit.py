@@ -0,0 +1,134 @@
+import time
+
+import pytest
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from rides.services import circuit
+from rides.services.circuit import CircuitBreaker, CircuitOpenError, get_breaker
+from rides.services.distance import DistanceService
+from rides.services.distance_estimator import DistanceEstimator
+from rides.services.http import get_session
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.mark.django_db
+def test_breaker_opens_fails_fast_and_probes(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit, 'time', clock)
+    breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=4, window=60, reset_timeout=30)
+
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.before_call()  # 2/3 failed, but below min_calls
+    breaker.record_failure()
+    assert breaker.is_open()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # Another worker without the local hint also sees the open circuit
+    other = CircuitBreaker('test', failure_rate=0.5, min_calls=4, window=60, reset_timeout=30)
+    with pytest.raises(CircuitOpenError):
+        other.before_call()
+
+    # Half-open: exactly one probe is admitted
+    clock.now += 31
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        other.before_call()
+
+    # A failed probe re-opens; a successful one closes
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        other.before_call()
+    clock.now += 31
+    other.before_call()
+    other.record_success()
+    assert not breaker.is_open()
+    breaker.before_call()
+
+
+@pytest.mark.django_db
+def test_successes_are_batched_and_state_reads_cached(monkeypatch, django_assert_num_queries):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit, 'time', clock)
+    breaker = CircuitBreaker('batched', min_calls=4, state_ttl=5, flush_every=20)
+    breaker.before_call()
+
+    # A healthy upstream costs no shared-cache round trips between flushes
+    with django_assert_num_queries(0):
+        for _ in range(10):
+            breaker.before_call()
+            breaker.record_success()
+    assert circuit.shared_cache().get(breaker._key(f"{int(clock.now // 60)}:ok")) is None
+
+    # A failure writes the pending successes along with it, so the rate stays honest
+    breaker.record_failure()
+    counts = circuit.shared_cache().get_many(breaker._bucket_keys(clock.now))
+    assert counts[breaker._key(f"{int(clock.now // 60)}:ok")] == 10
+    assert not breaker.is_open()
+
+
+@pytest.mark.django_db
+def test_open_google_circuit_falls_back_without_network(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    cache.set(DistanceEstimator.CALIBRATION_CACHE_KEY, 1.3)
+    breaker = get_breaker('google')
+    monkeypatch.setattr(breaker, 'min_calls', 2)
+    monkeypatch.setattr(breaker, '_open_until', 0.0)
+    monkeypatch.setattr(breaker, '_opened_at', None)
+    monkeypatch.setattr(breaker, '_state_read_at', None)
+    calls = {'n': 0}
+
+    def unreachable(self, method, url, **kwargs):
+        calls['n'] += 1
+        raise requests.ConnectTimeout('upstream down')
+
+    monkeypatch.setattr(requests.Session, 'request', unreachable)
+
+    for i in range(4):
+        km = DistanceService.get_distance_km((-17.8292, 31.0522 + i / 100), (-17.9318, 31.0928))
+        assert km > 12.0
+
+    # The first two failures opened the circuit; later lookups never reached the network
+    assert calls['n'] == 2
+    assert breaker.is_open()
+
+
+def test_stale_distance_served_while_refreshing(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+
+    class FakeResponse:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"status": "OK", "rows": [{"elements": [{"status": "OK", "distance": {"value": 12000}}]}]}
+
+    monkeypatch.setattr(get_session('google'), 'get', lambda url, params=None, timeout=None: FakeResponse())
+
+    o, d = (-17.8, 31.0), (-17.9, 31.1)
+    key = DistanceService._cache_key(o[0], o[1], d[0], d[1])
+    cache.set(key, {"km": 10.0, "error_km": 0.0, "fresh_until": time.time() - 1})
+
+    # The stale value is returned immediately...
+    assert DistanceService.get_distance_km(o, d) == 10.0
+
+    # ...and replaced in the background
+    deadline = time.monotonic() + 2
+    while cache.get(key)["km"] != 12.0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get(key)["km"] == 12.0
+    assert not DistanceService._is_stale(cache.get(key))
@@ -3,7 +3,10 @@ from django.core.cache import cache
 import requests
 import json
 
+import pytest
+
 from rides.services.distance import DistanceService
+from rides.services.http import get_session
 
 
 class FakeResponse:
@@ -33,7 +36,7 @@ def test_distance_parsing(monkeypatch):
     def fake_get(url, params=None, timeout=None):
         return FakeResponse(data)
 
-    monkeypatch.setattr(requests, 'get', fake_get)
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
 
     dist = DistanceService.get_distance_km((-17.8, 31.0), (-17.9, 31.1))
     assert abs(dist - 12.345) < 0.0001
@@ -57,7 +60,7 @@ def test_distance_caching(monkeypatch):
         }
         return FakeResponse(data)
 
-    monkeypatch.setattr(requests, 'get', fake_get)
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
 
     o = (-17.8, 31.0)
     d = (-17.9, 31.1)
@@ -88,7 +91,202 @@ def test_distance_uses_server_key(monkeypatch):
         }
         return FakeResponse(data)
 
-    monkeypatch.setattr(requests, 'get', fake_get)
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
 
     DistanceService.get_distance_km((-17.8, 31.0), (-17.9, 31.1))
     assert called['params']['key'] == 'server-key'
+
+
+def test_get_distances_km_batches_misses(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        calls.append(params)
+        origins = params['origins'].split('|')
+        destinations = params['destinations'].split('|')
+        rows = []
+        for i, _ in enumerate(origins):
+            rows.append({"elements": [
+                {"status": "OK", "distance": {"value": 1000 * (i + 1) + 100 * j}} for j, _ in enumerate(destinations)
+            ]})
+        return FakeResponse({"status": "OK", "rows": rows})
+
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
+
+    o1, o2 = (-17.8, 31.0), (-17.7, 31.2)
+    d1, d2 = (-17.9, 31.1), (-17.95, 31.05)
+    # Pre-populate one pair so it is served from the cache
+    cache.set(DistanceService._cache_key(o2[0], o2[1], d2[0], d2[1]), 42.0)
+
+    out = DistanceService.get_distances_km([(o1, d1), (o1, d2), (o2, d1), (o2, d2), (o1, d1)])
+
+    # All misses fit a single matrix request
+    assert len(calls) == 1
+    assert out[3] == 42.0
+    assert out[0] == out[4]
+    assert len(set(out)) == 4
+
+    # Results were written back, so a second call is served entirely from the cache
+    assert DistanceService.get_distances_km([(o1, d1), (o2, d1)]) == [out[0], out[2]]
+    assert len(calls) == 1
+
+
+def test_get_distances_km_respects_element_limit(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    calls = []
+
+    def fake_get(url, params=None, timeout=None):
+        origins = params['origins'].split('|')
+        destinations = params['destinations'].split('|')
+        calls.append((len(origins), len(destinations)))
+        rows = [{"elements": [{"status": "NOT_FOUND"} if j == 0 and i == 0 else {"status": "OK", "distance": {"value": 5000}} for j in range(len(destinations))]} for i in range(len(origins))]
+        return FakeResponse({"status": "OK", "rows": rows})
+
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
+
+    pairs = [((-17.0 - i * 0.01, 31.0), (-18.0 - i * 0.01, 31.0)) for i in range(30)]
+    out = DistanceService.get_distances_km(pairs)
+
+    assert len(out) == 30
+    assert all(n_o <= 25 and n_d <= 25 and n_o * n_d <= 100 for n_o, n_d in calls)
+    # An unavailable route yields None without failing the batch
+    assert out.count(None) == len(calls)
+
+
+def test_get_distances_km_bills_few_unused_elements(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    billed = []
+
+    def fake_get(url, params=None, timeout=None):
+        origins = params['origins'].split('|')
+        destinations = params['destinations'].split('|')
+        billed.append(len(origins) * len(destinations))
+        rows = [{"elements": [{"status": "OK", "distance": {"value": 5000}} for _ in destinations]} for _ in origins]
+        return FakeResponse({"status": "OK", "rows": rows})
+
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
+
+    hub = (-17.83, 31.05)
+    airport = (-17.93, 31.09)
+    # 10 unrelated routes, 5 routes from one hub and 5 routes to the airport
+    unrelated = [((-17.0 - i * 0.01, 30.0), (-18.0 - i * 0.01, 30.0)) for i in range(10)]
+    from_hub = [(hub, (-17.5 - i * 0.01, 31.5)) for i in range(5)]
+    to_airport = [((-17.6 - i * 0.01, 31.6), airport) for i in range(5)]
+    pairs = unrelated + from_hub + to_airport
+
+    assert all(km == 5.0 for km in DistanceService.get_distances_km(pairs))
+    # One element per wanted pair, not a 20 x 20 cross product
+    assert sum(billed) <= DistanceService.MAX_ELEMENT_RATIO * len(pairs)
+    assert sum(billed) == len(pairs)
+
+
+@pytest.mark.django_db
+def test_quantized_keys_share_nearby_points(monkeypatch):
+    cache.clear()
+    DistanceService.stats.reset()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    monkeypatch.setattr(settings, 'DISTANCE_CACHE_QUANTIZATION', 'grid')
+    monkeypatch.setattr(settings, 'DISTANCE_CACHE_CELL_METERS', 100)
+    calls = {'n': 0}
+
+    def fake_get(url, params=None, timeout=None):
+        calls['n'] += 1
+        return FakeResponse({"status": "OK", "rows": [{"elements": [{"status": "OK", "distance": {"value": 8000}}]}]})
+
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
+
+    # Two customers a few metres apart at the same pickup, same dropoff
+    DistanceService.get_distance_km((-17.829200, 31.052200), (-17.931800, 31.092800))
+    DistanceService.get_distance_km((-17.829210, 31.052190), (-17.931790, 31.092810))
+    assert calls['n'] == 1
+
+    key = DistanceService._cache_key(-17.8292, 31.0522, -17.9318, 31.0928)
+    entry = cache.get(key)
+    assert entry['km'] == 8.0
+    assert 0 < entry['error_km'] < 0.5
+
+    assert DistanceService.stats.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+@pytest.mark.django_db
+def test_l1_hit_runs_no_sql(monkeypatch, django_assert_num_queries):
+    cache.clear()
+    DistanceService.stats.reset()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    monkeypatch.setattr(
+        get_session('google'), 'get',
+        lambda url, params=None, timeout=None: FakeResponse({"status": "OK", "rows": [{"elements": [{"status": "OK", "distance": {"value": 8000}}]}]}),
+    )
+    DistanceService.get_distance_km((-17.8292, 31.0522), (-17.9318, 31.0928))
+
+    with django_assert_num_queries(0):
+        assert DistanceService.get_distance_km((-17.8292, 31.0522), (-17.9318, 31.0928)) == 8.0
+    # Counted in process until flushed (here, by reading the totals)
+    assert DistanceService.stats.stats()['hits'] == 1
+
+
+def test_symmetric_and_geohash_keys(monkeypatch):
+    a, b = (-17.8292, 31.0522), (-17.9318, 31.0928)
+    monkeypatch.setattr(settings, 'DISTANCE_CACHE_QUANTIZATION', 'geohash')
+    monkeypatch.setattr(settings, 'DISTANCE_CACHE_SYMMETRIC', False)
+    assert DistanceService._cache_key(*a, *b) != DistanceService._cache_key(*b, *a)
+
+    monkeypatch.setattr(settings, 'DISTANCE_CACHE_SYMMETRIC', True)
+    assert DistanceService._cache_key(*a, *b) == DistanceService._cache_key(*b, *a)
+
+    monkeypatch.setattr(settings, 'DISTANCE_CACHE_QUANTIZATION', 'exact')
+    monkeypatch.setattr(settings, 'DISTANCE_CACHE_SYMMETRIC', False)
+    assert DistanceService._cache_key(*a, *b) == 'distance:-17.829200:31.052200:-17.931800:31.092800'
+
+
+def test_concurrent_misses_share_one_upstream_call(monkeypatch):
+    import threading
+    import time
+
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    calls = {'n': 0}
+
+    def slow_get(url, params=None, timeout=None):
+        calls['n'] += 1
+        time.sleep(0.2)
+        return FakeResponse({"status": "OK", "rows": [{"elements": [{"status": "OK", "distance": {"value": 7000}}]}]})
+
+    monkeypatch.setattr(get_session('google'), 'get', slow_get)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(DistanceService.get_distance_km((-17.81, 31.01), (-17.91, 31.11)))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls['n'] == 1
+    assert results == [7.0] * 5
+
+
+@pytest.mark.django_db
+def test_miss_waits_for_other_process_holding_lock(monkeypatch):
+    import threading
+    from rides.cache import shared_cache
+
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+
+    def no_call(url, params=None, timeout=None):
+        raise AssertionError('upstream must not be called while another process holds the lock')
+
+    monkeypatch.setattr(get_session('google'), 'get', no_call)
+
+    o, d = (-17.82, 31.02), (-17.92, 31.12)
+    key = DistanceService._cache_key(o[0], o[1], d[0], d[1])
+    # Another process is already fetching this route...
+    shared_cache().add(f'singleflight:distance:{key}', 'other-process', timeout=30)
+    # ...and publishes its result shortly afterwards
+    threading.Timer(0.3, lambda: cache.set(key, {'km': 6.5, 'error_km': 0})).start()
+
+    assert DistanceService.get_distance_km(o, d) == 6.5
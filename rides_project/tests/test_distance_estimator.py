@@ -0,0 +1,128 @@
+import pytest
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.test import APIClient
+
+from rides.models import RideBooking
+from rides.services.distance import DistanceService, DistanceUnavailable, is_estimated
+from rides.services.http import get_session
+from rides.services.distance_estimator import DistanceEstimator
+
+
+def test_haversine_known_distance():
+    # Harare CBD to Robert Gabriel Mugabe International Airport is ~12.5 km in a straight line
+    km = DistanceEstimator.haversine_km((-17.8292, 31.0522), (-17.9318, 31.0928))
+    assert 12.0 < km < 13.0
+
+
+@pytest.mark.django_db
+def test_circuity_calibrated_from_bookings(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'DISTANCE_CIRCUITY_MIN_SAMPLES', 3)
+
+    origin, destination = (-17.8292, 31.0522), (-17.9318, 31.0928)
+    straight = DistanceEstimator.haversine_km(origin, destination)
+    for ratio in (1.2, 1.4, 1.5):
+        RideBooking.objects.create(
+            pickup_address='A', pickup_lat=origin[0], pickup_lng=origin[1],
+            dropoff_address='B', dropoff_lat=destination[0], dropoff_lng=destination[1],
+            distance_km=round(straight * ratio, 2), phone='077', email='a@b.com',
+            payment_option=RideBooking.PAYMENT_ON_ARRIVAL,
+        )
+
+    factor = DistanceEstimator.calibrate()
+    assert abs(factor - 1.4) < 0.01
+    assert abs(DistanceEstimator.estimate_km(origin, destination) - straight * factor) < 0.01
+
+
+def test_distance_falls_back_to_estimate(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    cache.set(DistanceEstimator.CALIBRATION_CACHE_KEY, 1.25)
+
+    def slow_get(url, params=None, timeout=None):
+        raise requests.Timeout('took too long')
+
+    monkeypatch.setattr(get_session('google'), 'get', slow_get)
+
+    origin, destination = (-17.8292, 31.0522), (-17.9318, 31.0928)
+    km = DistanceService.get_distance_km(origin, destination)
+    assert abs(km - DistanceEstimator.haversine_km(origin, destination) * 1.25) < 0.01
+    assert is_estimated(km)
+
+    # Estimates are not cached as if they were Google results
+    assert cache.get(DistanceService._cache_key(origin[0], origin[1], destination[0], destination[1])) is None
+
+    monkeypatch.setattr(settings, 'DISTANCE_ESTIMATE_FALLBACK', False)
+    with pytest.raises(RuntimeError):
+        DistanceService.get_distance_km(origin, destination)
+
+
+def test_missing_api_key_is_not_masked_by_the_estimate(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', '')
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_API_KEY', '')
+    with pytest.raises(RuntimeError, match='not configured'):
+        DistanceService.get_distance_km((-17.8, 31.0), (-17.9, 31.1))
+
+
+def test_request_denied_is_not_masked_by_the_estimate(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'bad-key')
+
+    class Denied:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'status': 'REQUEST_DENIED', 'error_message': 'The provided API key is invalid.'}
+
+    monkeypatch.setattr(get_session('google'), 'get', lambda url, params=None, timeout=None: Denied())
+    with pytest.raises(RuntimeError, match='REQUEST_DENIED') as excinfo:
+        DistanceService.get_distance_km((-17.8, 31.0), (-17.9, 31.1))
+    assert not isinstance(excinfo.value, DistanceUnavailable)
+
+
+@pytest.mark.django_db
+def test_price_estimate_provisional_skips_google(monkeypatch):
+    cache.clear()
+    cache.set(DistanceEstimator.CALIBRATION_CACHE_KEY, 1.3)
+
+    def no_network(*args, **kwargs):
+        raise AssertionError('provisional quotes must not call Google')
+
+    monkeypatch.setattr(get_session('google'), 'get', no_network)
+
+    payload = {
+        'pickup_lat': -17.8292, 'pickup_lng': 31.0522,
+        'dropoff_lat': -17.9318, 'dropoff_lng': 31.0928,
+        'num_adults': 1, 'provisional': True,
+    }
+    resp = APIClient().post('/rides/api/price/', payload, format='json')
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data['provisional'] is True
+    assert data['distance_km'] > 12.0
+
+
+@pytest.mark.django_db
+def test_price_estimate_from_fallback_is_provisional_without_quote_token(monkeypatch):
+    cache.clear()
+    cache.set(DistanceEstimator.CALIBRATION_CACHE_KEY, 1.3)
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+
+    def slow_get(url, params=None, timeout=None):
+        raise requests.Timeout('took too long')
+
+    monkeypatch.setattr(get_session('google'), 'get', slow_get)
+
+    payload = {
+        'pickup_lat': -17.8292, 'pickup_lng': 31.0522,
+        'dropoff_lat': -17.9318, 'dropoff_lng': 31.0928,
+        'num_adults': 1,
+    }
+    data = APIClient().post('/rides/api/price/', payload, format='json').json()
+    # The server fell back to the estimator: the booking must not be charged this distance unchecked
+    assert data['provisional'] is True
+    assert 'quote_token' not in data
@@ -0,0 +1,133 @@
+import smtplib
+from datetime import timedelta
+
+import pytest
+from django.core import mail
+from django.utils import timezone
+
+from rides.models import EmailOutbox, RideBooking
+from rides.services.email_service import EmailService
+from rides.services.outbox import OutboxService
+
+
+def _booking():
+    return RideBooking.objects.create(
+        pickup_address='A', dropoff_address='B', distance_km=10, phone='077', email='rider@example.com', total_amount=20,
+    )
+
+
+class CountingConnection:
+    """Wraps the locmem backend, counting opens and failing the first `fail` sends."""
+
+    def __init__(self, fail=0):
+        from django.core.mail.backends.locmem import EmailBackend
+        self.backend = EmailBackend()
+        self.opens = 0
+        self.fail = fail
+
+    def open(self):
+        self.opens += 1
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        if self.fail:
+            self.fail -= 1
+            raise smtplib.SMTPServerDisconnected('connection dropped')
+        return self.backend.send_messages(messages)
+
+
+@pytest.mark.django_db
+def test_outbox_queues_in_request_and_delivers_in_one_connection(settings):
+    settings.EMAIL_OUTBOX_ENABLED = True
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    booking = _booking()
+
+    EmailService.send_owner_notification(booking, payment_status='PAY ON ARRIVAL')
+    EmailService.send_customer_notification(booking, payment_status='PAY ON ARRIVAL')
+    EmailService.send_payment_confirmation(booking)
+    assert mail.outbox == []
+    assert EmailOutbox.objects.filter(status=EmailOutbox.STATUS_PENDING).count() == 3
+
+    connection = CountingConnection()
+    assert OutboxService.deliver_batch(connection=connection) == {'sent': 3, 'retried': 0, 'failed': 0}
+    assert connection.opens == 1
+    assert [m.to for m in mail.outbox] == [[settings.TAXI_OWNER_EMAIL], ['rider@example.com'], ['rider@example.com']]
+    assert mail.outbox[0].alternatives and 'PAY ON ARRIVAL' in mail.outbox[0].body
+
+    # Nothing is due any more
+    assert OutboxService.deliver_batch(connection=connection) == {'sent': 0, 'retried': 0, 'failed': 0}
+
+
+@pytest.mark.django_db
+def test_inline_booking_notifications_render_once(settings, monkeypatch):
+    from rides.services.email_renderer import EmailRenderer
+
+    settings.EMAIL_OUTBOX_ENABLED = False
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    booking = _booking()
+    renders = []
+    original = EmailRenderer.shared_context
+    monkeypatch.setattr(EmailRenderer, 'shared_context', staticmethod(lambda **values: renders.append(1) or original(**values)))
+
+    EmailService.send_booking_notifications(booking, payment_status='PAY ON ARRIVAL')
+    # One booking context for both emails
+    assert len(renders) == 1
+    assert [m.to for m in mail.outbox] == [[settings.TAXI_OWNER_EMAIL], ['rider@example.com']]
+    assert all('PAY ON ARRIVAL' in m.body for m in mail.outbox)
+
+
+@pytest.mark.django_db
+def test_outbox_retries_with_backoff_then_gives_up(settings):
+    settings.EMAIL_OUTBOX_ENABLED = True
+    settings.EMAIL_OUTBOX_MAX_ATTEMPTS = 2
+    settings.EMAIL_OUTBOX_RETRY_BASE = 30
+    booking = _booking()
+    EmailService.send_owner_notification(booking)
+    row = EmailOutbox.objects.get()
+
+    assert OutboxService.deliver_batch(connection=CountingConnection(fail=1)) == {'sent': 0, 'retried': 1, 'failed': 0}
+    row.refresh_from_db()
+    assert row.attempts == 1 and 'connection dropped' in row.last_error
+    assert row.next_attempt_at > timezone.now() + timedelta(seconds=25)
+
+    # Not due yet; once due, the second failure is final
+    assert OutboxService.deliver_batch(connection=CountingConnection(fail=1))['retried'] == 0
+    EmailOutbox.objects.update(next_attempt_at=timezone.now())
+    assert OutboxService.deliver_batch(connection=CountingConnection(fail=1)) == {'sent': 0, 'retried': 0, 'failed': 1}
+    assert EmailOutbox.objects.get().status == EmailOutbox.STATUS_FAILED
+
+
+@pytest.mark.django_db
+def test_claimed_rows_are_not_claimed_twice():
+    booking = _booking()
+    OutboxService.enqueue(EmailService.KIND_OWNER, booking)
+    assert len(OutboxService.claim(10)) == 1
+    assert OutboxService.claim(10) == []
+
+
+@pytest.mark.django_db
+def test_owner_digest_batches_scheduled_bookings_and_sends_urgent_ones_at_once(settings):
+    settings.EMAIL_OUTBOX_ENABLED = True
+    settings.OWNER_DIGEST_ENABLED = True
+    settings.OWNER_DIGEST_URGENT_MINUTES = 60
+    later = [_booking() for _ in range(3)]
+    for i, booking in enumerate(later):
+        booking.pickup_at = timezone.now() + timedelta(days=1, hours=i)
+        booking.save()
+        EmailService.send_owner_notification(booking, payment_status='PAY ON ARRIVAL')
+    asap = _booking()
+    EmailService.send_owner_notification(asap, payment_status='PAID')
+
+    # Only the urgent notification is due now
+    assert OutboxService.deliver_batch(connection=CountingConnection()) == {'sent': 1, 'retried': 0, 'failed': 0}
+    assert mail.outbox[0].subject == f'New ride booking: {asap.id}'
+
+    # At the end of the window the rest go out as one email
+    EmailOutbox.objects.filter(status=EmailOutbox.STATUS_PENDING).update(next_attempt_at=timezone.now())
+    assert OutboxService.deliver_batch(connection=CountingConnection()) == {'sent': 3, 'retried': 0, 'failed': 0}
+    assert len(mail.outbox) == 2
+    digest = mail.outbox[1]
+    assert digest.subject == '3 ride booking updates' and digest.to == [settings.TAXI_OWNER_EMAIL]
+    assert all(str(b.id) in digest.body for b in later)
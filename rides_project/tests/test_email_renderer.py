@@ -0,0 +1,34 @@
+from django.template import engines
+
+from rides.models import RideBooking
+from rides.services.email_renderer import EmailRenderer, inline_css
+from rides.services.email_service import EmailService
+
+
+def test_inline_css_applies_simple_rules_once_at_compile():
+    source = (
+        '<html><head><style>/* x */ body{color:#082033} .card{padding:16px} dt, dd{margin:0;} a:hover{color:red}</style></head>'
+        '<body><div class="card big" style="color:blue"><dl><dt>Pickup</dt></dl></div></body></html>'
+    )
+    out = inline_css(source)
+    assert '<body style="color:#082033">' in out
+    assert '<div class="card big" style="padding:16px;color:blue">' in out
+    assert '<dt style="margin:0">' in out
+    assert '<style>' in out  # kept for clients that support it
+
+
+def test_templates_compile_once_and_event_variants_share_context(monkeypatch):
+    EmailRenderer._compiled.clear()
+    engine = engines['django'].engine
+    loads = []
+    original = engine.get_template
+    monkeypatch.setattr(engine, 'get_template', lambda name: loads.append(name) or original(name))
+
+    booking = RideBooking(pickup_address='A', dropoff_address='B', distance_km=10, phone='077', email='rider@example.com', total_amount=20)
+    for _ in range(3):
+        owner, customer = EmailService.build_messages(booking, [('owner', 'PAID'), ('customer', 'PAID')])
+    assert sorted(loads) == ['rides/email_customer.html', 'rides/email_customer.txt', 'rides/email_owner.html', 'rides/email_owner.txt']
+
+    assert 'Payment status: PAID' in owner.body and owner.subject == f'New ride booking: {booking.id}'
+    assert customer.to == ['rider@example.com']
+    assert 'style="font-weight:700"' in customer.alternatives[0][0]
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+import requests
+
+from rides.services import http
+from rides.services.paynow import PaynowService
+
+
+def test_sessions_are_pooled_per_process():
+    session = http.get_session('google')
+    assert http.get_session('google') is session
+    assert http.get_session('paynow') is not session
+
+    adapter = session.get_adapter('https://maps.googleapis.com/')
+    assert adapter._pool_maxsize == http.client_config('google')['pool_maxsize']
+    # Read errors are never retried so the caller's latency budget holds
+    assert adapter.max_retries.read == 0
+    assert 'POST' not in adapter.max_retries.allowed_methods
+
+
+def test_default_timeout_applied_when_missing():
+    session = http.get_session('paynow')
+    seen = {}
+
+    def fake_request(self, method, url, **kwargs):
+        seen['timeout'] = kwargs.get('timeout')
+        resp = requests.Response()
+        resp.status_code = 200
+        return resp
+
+    with patch('requests.Session.request', fake_request):
+        session.post('https://www.paynow.co.zw/interface/initiatetransaction', data={})
+        assert seen['timeout'] == (http.client_config('paynow')['connect_timeout'], 15)
+
+        session.get('https://example.invalid/', timeout=2)
+        assert seen['timeout'] == 2
+
+
+def test_paynow_sdk_client_reused_and_pooled():
+    import paynow.model
+
+    PaynowService._sdk_clients.clear()
+    first = PaynowService()._sdk_client()
+    second = PaynowService()._sdk_client()
+
+    assert first is second
+    assert isinstance(paynow.model.requests, http.SDKTransport)
+    assert paynow.model.requests._session is http.get_session('paynow')
@@ -95,3 +95,38 @@ def test_booking_paynow_initiates_transaction(monkeypatch):
     payment = Payment.objects.get(id=payment_data['id'])
     assert payment.paynow_reference == 'fake-ref-123'
     assert payment.status == Payment.STATUS_PENDING
+
+
+@pytest.mark.django_db
+def test_booking_with_quote_token_skips_distance_lookup(monkeypatch):
+    client = APIClient()
+    calls = {'n': 0}
+
+    def fake_distance(origin, destination, use_cache=True):
+        calls['n'] += 1
+        return 14.0
+
+    monkeypatch.setattr('rides.services.distance.DistanceService.get_distance_km', fake_distance)
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_owner_notification', lambda booking, payment_status='UNPAID': None)
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_customer_notification', lambda booking, payment_status='UNPAID': None)
+
+    route = {'pickup_lat': -17.8, 'pickup_lng': 31.0, 'dropoff_lat': -17.9, 'dropoff_lng': 31.1, 'num_adults': 2}
+    estimate = client.post(reverse('rides:price_estimate'), route, format='json').json()
+    assert calls['n'] == 1
+
+    payload = dict(route, pickup_address='Start', dropoff_address='End', phone='+263789000000', email='test@example.com',
+                   payment_option=RideBooking.PAYMENT_ON_ARRIVAL, quote_token=estimate['quote_token'])
+    resp = client.post(reverse('rides:create_booking'), payload, format='json')
+    assert resp.status_code == 201
+    assert calls['n'] == 1
+    assert resp.data['price_breakdown']['total'] == estimate['total']
+
+    # A token for another route, or a tampered one, falls back to a fresh lookup
+    for bad in (dict(payload, dropoff_lat=-18.0), dict(payload, quote_token=estimate['quote_token'][:-2] + 'xx')):
+        assert client.post(reverse('rides:create_booking'), bad, format='json').status_code == 201
+    assert calls['n'] == 3
+
+    # Other passenger counts reuse the distance but are repriced
+    resp = client.post(reverse('rides:create_booking'), dict(payload, num_adults=4), format='json')
+    assert calls['n'] == 3
+    assert resp.data['price_breakdown']['total'] == PricingService.calculate(14.0, num_adults=4)['total']
@@ -1,5 +1,7 @@
 import hmac
 import hashlib
+import uuid
+from datetime import timedelta
 from django.conf import settings
 import pytest
 from rest_framework.test import APIClient
@@ -155,3 +157,364 @@ def test_paynow_webhook_paid_amount_mismatch_marks_failed(monkeypatch):
     assert payment.status == Payment.STATUS_FAILED
     # Booking should remain pending because payment did not actually confirm
     assert booking.status == RideBooking.STATUS_PENDING
+
+
+@pytest.mark.django_db
+def test_payment_transitions_are_won_exactly_once():
+    from rides.services.payment_state import PaymentStateService
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    payment = Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING)
+
+    assert PaymentStateService.mark_failed(payment.pk, paynow_response={'status': 'Cancelled'}) is True
+    # Paynow can still report success after a failure; only the first caller wins
+    assert PaymentStateService.mark_paid(payment.pk) is True
+    assert PaymentStateService.mark_paid(payment.pk) is False
+    assert PaymentStateService.mark_failed(payment.pk) is False
+    assert PaymentStateService.record_response(payment.pk, {'late': True}) is False
+
+    payment.refresh_from_db()
+    booking.refresh_from_db()
+    assert payment.status == Payment.STATUS_PAID and payment.paynow_response == {'status': 'Cancelled'}
+    assert booking.status == RideBooking.STATUS_CONFIRMED
+
+
+@pytest.mark.django_db
+def test_webhook_resolves_any_alias_in_one_query(monkeypatch, django_assert_num_queries):
+    from rides.services.payment_refs import PaymentReferenceService
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    payment = Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING)
+    payment.paynow_response = {'pollUrl': 'https://www.paynow.co.zw/Interface/CheckPayment/?guid=g-123', 'response': {'data': {'paynowreference': 'PN-9'}}}
+    payment.save()
+
+    for alias in (str(payment.pk), 'PN-9', 'g-123'):
+        with django_assert_num_queries(1):
+            assert PaymentReferenceService.resolve(['not-a-uuid', alias]) == payment
+    assert PaymentReferenceService.resolve(['unknown']) is None
+
+    # A webhook matched by its poll URL alone marks the payment paid
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_payment_confirmation', lambda b: None)
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_owner_notification', lambda b, payment_status='': None)
+    monkeypatch.setattr(settings, 'PAYNOW_INTEGRATION_KEY', 'secret-key')
+    payload = 'pollurl=https%3A%2F%2Fwww.paynow.co.zw%2FInterface%2FCheckPayment%2F%3Fguid%3Dg-123&status=Paid'.encode()
+    signature = hmac.new(b'secret-key', payload, hashlib.sha256).hexdigest()
+    resp = APIClient().post(reverse('rides:paynow_result'), data=payload, content_type='application/x-www-form-urlencoded', HTTP_X_PAYNOW_SIGNATURE=signature)
+    assert resp.status_code == 200
+    payment.refresh_from_db()
+    assert payment.status == Payment.STATUS_PAID
+
+
+@pytest.mark.django_db
+def test_inbox_mode_acks_fast_dedupes_and_processes_later(monkeypatch):
+    from django.core.management import call_command
+    from rides.models import WebhookInbox
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    payment = Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING, paynow_reference='fake-ref-inbox')
+    sent = []
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_payment_confirmation', lambda b: sent.append('customer'))
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_owner_notification', lambda b, payment_status='': sent.append('owner'))
+    monkeypatch.setattr(settings, 'PAYNOW_INTEGRATION_KEY', 'secret-key')
+    monkeypatch.setattr(settings, 'PAYNOW_WEBHOOK_MODE', 'inbox', raising=False)
+
+    payload = 'reference=fake-ref-inbox&status=Paid'.encode()
+    signature = hmac.new(b'secret-key', payload, hashlib.sha256).hexdigest()
+    for _ in range(2):
+        resp = APIClient().post(reverse('rides:paynow_result'), data=payload, content_type='application/x-www-form-urlencoded', HTTP_X_PAYNOW_SIGNATURE=signature)
+        assert resp.status_code == 200
+
+    # Stored once, not yet applied
+    assert WebhookInbox.objects.count() == 1
+    payment.refresh_from_db()
+    assert payment.status == Payment.STATUS_PENDING
+
+    call_command('process_webhooks', '--once')
+    payment.refresh_from_db()
+    row = WebhookInbox.objects.get()
+    assert payment.status == Payment.STATUS_PAID
+    assert row.status == WebhookInbox.STATUS_PROCESSED and row.outcome == 'paid'
+    assert sent == ['customer', 'owner']
+
+    # Replaying is idempotent: the transition is not made (or emailed) twice
+    call_command('process_webhooks', '--replay', str(row.pk))
+    row.refresh_from_db()
+    assert row.outcome == 'ignored' and sent == ['customer', 'owner']
+
+
+@pytest.mark.django_db
+def test_inbox_keeps_per_reference_order_across_retries(monkeypatch):
+    from django.utils import timezone
+    from rides.models import WebhookInbox
+    from rides.services.webhooks import WebhookService
+
+    monkeypatch.setattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 1)
+    monkeypatch.setattr(settings, 'PAYNOW_WEBHOOK_MAX_ATTEMPTS', 3)
+    assert WebhookService.ingest(b'reference=ref-a&status=Sent')
+    assert WebhookService.ingest(b'reference=ref-a&status=Paid')
+    assert WebhookService.ingest(b'reference=ref-b&status=Sent')
+    first, second, other = WebhookInbox.objects.order_by('id')
+    assert first.reference == 'ref-a' and other.reference == 'ref-b'
+
+    applied = []
+
+    def process(data):
+        applied.append(data['status'])
+        if len(applied) == 1:
+            raise RuntimeError('database hiccup')
+        return 'pending'
+
+    monkeypatch.setattr(WebhookService, 'process', staticmethod(process))
+    # ref-a's first row fails; its later row must wait rather than jump ahead
+    assert WebhookService.process_pending() == {'error': 1, 'pending': 1}
+    second.refresh_from_db()
+    assert second.status == WebhookInbox.STATUS_PENDING and second.attempts == 0
+    first.refresh_from_db()
+    # The inbox has its own retry settings, not the email outbox's
+    assert first.status == WebhookInbox.STATUS_PENDING and first.attempts == 1
+    assert WebhookService.process_pending() == {}
+
+    WebhookInbox.objects.filter(pk=first.pk).update(next_attempt_at=timezone.now())
+    assert WebhookService.process_pending() == {'pending': 1}
+    assert WebhookService.process_pending() == {'pending': 1}
+    assert applied == ['Sent', 'Sent', 'Sent', 'Paid']
+
+
+@pytest.mark.django_db
+def test_duplicate_webhook_is_acked_before_verification(monkeypatch, django_assert_num_queries):
+    from rides.services.paynow import PaynowService
+    from rides.services.webhooks import WebhookService
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING, paynow_reference='fake-ref-dup')
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_payment_confirmation', lambda b: None)
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_owner_notification', lambda b, payment_status='': None)
+    monkeypatch.setattr(settings, 'PAYNOW_INTEGRATION_KEY', 'secret-key')
+    verified = []
+    original = PaynowService.verify_notification
+    monkeypatch.setattr(PaynowService, 'verify_notification', lambda self, request: verified.append(1) or original(self, request))
+    WebhookService.stats.reset()
+
+    payload = 'reference=fake-ref-dup&status=Paid'.encode()
+    signature = hmac.new(b'secret-key', payload, hashlib.sha256).hexdigest()
+    for attempt in range(3):
+        if attempt:
+            # Duplicates are answered from the local cache without touching the database
+            with django_assert_num_queries(0):
+                resp = APIClient().post(reverse('rides:paynow_result'), data=payload, content_type='application/x-www-form-urlencoded', HTTP_X_PAYNOW_SIGNATURE=signature)
+        else:
+            resp = APIClient().post(reverse('rides:paynow_result'), data=payload, content_type='application/x-www-form-urlencoded', HTTP_X_PAYNOW_SIGNATURE=signature)
+        assert resp.status_code == 200
+
+    assert len(verified) == 1
+    stats = WebhookService.stats.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 1
+
+    # The same body with a forged signature is not a duplicate
+    resp = APIClient().post(reverse('rides:paynow_result'), data=payload, content_type='application/x-www-form-urlencoded', HTTP_X_PAYNOW_SIGNATURE='forged')
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_reconciler_polls_centrally_and_poll_view_reads_its_result(monkeypatch):
+    from rides.services.reconciler import PaynowReconciler
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    payment = Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING, paynow_reference='g-rec')
+    sent = []
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_payment_confirmation', lambda b: sent.append('customer'))
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_owner_notification', lambda b, payment_status='': sent.append('owner'))
+    monkeypatch.setattr(settings, 'PAYNOW_POLL_MODE', 'reconciler', raising=False)
+    upstream = {'paid': False, 'status': 'sent'}
+    calls = []
+    monkeypatch.setattr('rides.services.paynow.PaynowService.verify_payment', lambda self, url: calls.append(url) or dict(upstream))
+
+    assert PaynowReconciler.interval_for(timedelta(seconds=30)) == 5
+    assert PaynowReconciler.interval_for(timedelta(hours=2)) == PaynowReconciler.SLOW_INTERVAL
+
+    reconciler = PaynowReconciler(workers=1)
+    assert reconciler.run_once() == {'pending': 1}
+    # Not due again until its backoff interval has passed
+    assert reconciler.run_once() == {}
+
+    resp = APIClient().get(reverse('rides:paynow_poll', args=[payment.pk]))
+    assert resp.status_code == 200
+    assert resp.json()['paid'] is False and resp.json()['status'] == 'sent' and resp.json()['checked_at']
+    assert len(calls) == 1
+
+    upstream.update(paid=True, status='paid')
+    assert reconciler.run_once([payment]) == {'paid': 1}
+    payment.refresh_from_db()
+    assert payment.status == Payment.STATUS_PAID and sent == ['customer', 'owner']
+    assert APIClient().get(reverse('rides:paynow_poll', args=[payment.pk])).json()['paid'] is True
+    assert len(calls) == 2
+
+
+@pytest.mark.django_db
+def test_poll_results_are_shared_for_a_few_seconds(monkeypatch):
+    from rides.services.reconciler import PaynowReconciler
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    payment = Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING, paynow_reference='g-cached')
+    monkeypatch.setattr(settings, 'PAYNOW_POLL_CACHE_TTL', 5, raising=False)
+    calls = []
+    monkeypatch.setattr('rides.services.paynow.PaynowService.verify_payment', lambda self, url: calls.append(url) or {'paid': False, 'status': 'sent'})
+
+    first = APIClient().get(reverse('rides:paynow_poll', args=[payment.pk])).json()
+    second = APIClient().get(reverse('rides:paynow_poll', args=[payment.pk])).json()
+    assert len(calls) == 1
+    assert first == {'paid': False, 'status': 'sent', 'cached_age': 0.0, 'max_age': 5}
+    assert second['status'] == 'sent' and 0 <= second['cached_age'] < 5
+
+    # Once the result is older than the TTL the next poll goes upstream again
+    monkeypatch.setattr(PaynowReconciler, 'result_age', staticmethod(lambda entry: 6.0))
+    APIClient().get(reverse('rides:paynow_poll', args=[payment.pk]))
+    assert len(calls) == 2
+
+
+@pytest.mark.django_db
+def test_status_wait_returns_on_transition(monkeypatch, django_capture_on_commit_callbacks, django_assert_num_queries):
+    from rides.services.payment_events import PaymentEvents
+    from rides.services.payment_state import PaymentStateService
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    payment = Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING)
+    url = reverse('rides:payment_status_wait', args=[payment.pk])
+
+    # Without a last-seen status the current one comes back at once
+    assert APIClient().get(url).json() == {'paid': False, 'status': 'PENDING', 'changed': True}
+    assert APIClient().get(url, {'status': 'PENDING', 'timeout': 0}).json()['changed'] is False
+
+    # Pages long-poll only when the async view serves the wait endpoint; sync deployments short-poll
+    page = APIClient().get(reverse('rides:paynow_return'), {'reference': str(payment.pk)})
+    assert url not in page.content.decode()
+    monkeypatch.setattr(settings, 'ASYNC_VIEWS', True)
+    page = APIClient().get(reverse('rides:paynow_return'), {'reference': str(payment.pk)})
+    assert url in page.content.decode()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert PaymentStateService.mark_paid(payment.pk)
+    assert PaymentEvents.current(payment.pk) == Payment.STATUS_PAID
+    assert APIClient().get(url, {'status': 'PENDING', 'timeout': 5}).json() == {'paid': True, 'status': 'PAID', 'changed': True}
+    # Waiters re-check the local cache, not the database
+    with django_assert_num_queries(0):
+        assert PaymentEvents.wait(payment.pk, Payment.STATUS_PAID, 0) == Payment.STATUS_PAID
+
+    assert APIClient().get(reverse('rides:payment_status_wait', args=[uuid.uuid4()])).status_code == 404
+
+
+@pytest.mark.django_db
+def test_poll_answers_304_when_nothing_changed(monkeypatch, django_assert_num_queries):
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    payment = Payment.objects.create(booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING, paynow_reference='g-etag')
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_payment_confirmation', lambda b: None)
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_owner_notification', lambda b, payment_status='': None)
+    upstream = {'paid': False, 'status': 'sent'}
+    monkeypatch.setattr('rides.services.paynow.PaynowService.verify_payment', lambda self, url: dict(upstream))
+    url = reverse('rides:paynow_poll', args=[payment.pk])
+
+    first = APIClient().get(url)
+    etag = first['ETag']
+    assert first.status_code == 200 and first['Last-Modified']
+
+    # Same status, same cached check: 304 from the status/updated_at columns and the cache
+    with django_assert_num_queries(2):
+        resp = APIClient().get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 304 and resp['ETag'] == etag
+
+    # A transition changes the validators
+    upstream.update(paid=True, status='paid')
+    monkeypatch.setattr(settings, 'PAYNOW_POLL_CACHE_TTL', 0, raising=False)
+    resp = APIClient().get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200 and resp.json()['paid'] is True and resp['ETag'] != etag
+    assert APIClient().get(url, HTTP_IF_NONE_MATCH=resp['ETag']).status_code == 304
+
+
+@pytest.mark.django_db
+def test_poll_reads_normalized_columns_not_the_response_json(monkeypatch):
+    from importlib import import_module
+    from django.apps import apps
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    booking = RideBooking.objects.create(
+        pickup_address='Start', dropoff_address='End', distance_km=40.0, phone='+263789000000', email='test@example.com',
+        payment_option=RideBooking.PAYMENT_PAYNOW, total_amount=46.5,
+    )
+    poll_url = 'https://www.paynow.co.zw/Interface/CheckPayment/?guid=g-cols'
+    payment = Payment.objects.create(
+        booking=booking, method='PAYNOW', amount=46.5, status=Payment.STATUS_PENDING,
+        paynow_response={'redirectUrl': 'https://www.paynow.co.zw/Payment/Link/?guid=g-cols', 'pollUrl': poll_url, 'response': {'status': 'Ok'}},
+    )
+    assert (payment.poll_url, payment.redirect_url, payment.upstream_status) == (poll_url, 'https://www.paynow.co.zw/Payment/Link/?guid=g-cols', 'Ok')
+
+    # Rows from before the columns existed are backfilled by the migration
+    Payment.objects.filter(pk=payment.pk).update(poll_url=None, redirect_url=None, upstream_status=None)
+    import_module('rides.migrations.0009_payment_poll_columns').backfill_columns(apps, None)
+    payment.refresh_from_db()
+    assert payment.poll_url == poll_url and payment.upstream_status == 'Ok'
+
+    calls = []
+    monkeypatch.setattr('rides.services.paynow.PaynowService.verify_payment', lambda self, url: calls.append(url) or {'paid': False, 'status': 'sent'})
+    with CaptureQueriesContext(connection) as queries:
+        assert APIClient().get(reverse('rides:paynow_poll', args=[payment.pk])).status_code == 200
+    assert calls == [poll_url]
+    assert not any('paynow_response' in q['sql'] for q in queries.captured_queries)
+
+
+def test_poll_reply_is_parsed_not_keyword_scraped(monkeypatch):
+    from urllib.parse import urlencode
+    from rides.services import paynow
+    from rides.services.http import CappedResponse, read_capped
+    from rides.services.paynow_status import expected_hash, parse_status
+
+    def reply(status, key=settings.PAYNOW_INTEGRATION_KEY):
+        fields = [('reference', 'R1'), ('paynowreference', '99'), ('amount', '46.50'), ('status', status)]
+        return urlencode(fields + [('hash', expected_hash(fields, key))])
+
+    parsed = parse_status(reply('Paid'), settings.PAYNOW_INTEGRATION_KEY)
+    assert parsed.paid and parsed.hash_valid and str(parsed.amount) == '46.50'
+    # "Not paid" contains "paid" but is not Paid
+    assert not parse_status(reply('Not paid'), settings.PAYNOW_INTEGRATION_KEY).paid
+
+    responses = []
+    monkeypatch.setattr(paynow, 'request_capped', lambda *args, **kwargs: responses.pop(0))
+    service = paynow.PaynowService()
+    url = 'https://www.paynow.co.zw/Interface/CheckPayment/?guid=g-parse'
+
+    responses.append(CappedResponse(200, reply('Paid').encode(), False))
+    assert service.verify_payment(url) == {'paid': True, 'status': 'paid'}
+    responses.append(CappedResponse(200, reply('Paid', key='wrong-key').encode(), False))
+    assert service.verify_payment(url) == {'paid': False, 'status': 'poll_error: hash mismatch'}
+    responses.append(CappedResponse(200, b'<html><body>Payment successful</body></html>', False))
+    assert service.verify_payment(url)['status'].startswith('poll_error')
+
+    # Oversized replies are cut off while streaming and never parsed
+    body, truncated = read_capped(iter([b'x' * 1024] * 100), max_bytes=2048)
+    assert truncated and len(body) == 2048
+    responses.append(CappedResponse(200, body, truncated))
+    assert service.verify_payment(url) == {'paid': False, 'status': 'poll_error: reply too large'}
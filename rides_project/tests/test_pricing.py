@@ -1,3 +1,4 @@
+import pytest
 from rides.services.pricing import PricingService
 from decimal import Decimal
 
@@ -24,3 +25,132 @@ def test_extra_adults_and_kids():
     assert out['kids_seated_fee'] == 10.00
     assert out['luggage_fee'] == 5.00
     assert out['total'] == 65.00
+
+
+def test_engine_matches_reference_implementation():
+    import random
+
+    rng = random.Random(42)
+    distances = [0, 5, 12.99, 13, 14, 15, 15.5, 15.999, 16, 20.004, 25.5, 35, 35.0001, 35.005, 40, 123.456789]
+    distances += [round(rng.uniform(0, 200), rng.randint(0, 6)) for _ in range(300)]
+    for d in distances:
+        counts = (rng.randint(1, 8), rng.randint(0, 6), rng.randint(0, 3), rng.randint(0, 6))
+        assert PricingService.calculate(d, *counts) == PricingService._calculate_reference(d, *counts), (d, counts)
+
+
+def test_engine_recompiles_when_pricing_changes(settings):
+    from rides.services.pricing import get_engine
+
+    assert PricingService.calculate(distance_km=14)['total'] == 25.00
+    engine = get_engine()
+    assert get_engine() is engine
+
+    settings.PRICING = dict(settings.PRICING, BRACKETS=[{"min": 13, "max": 15, "price": 25.01}], KID_SEATED_FACTOR=0.5)
+    assert get_engine() is not engine
+    # 25.01 / 3 * 0.5 * 3 is an exact half-cent tie
+    out = PricingService.calculate(distance_km=14, num_kids_seated=3)
+    assert out == PricingService._calculate_reference(distance_km=14, num_kids_seated=3)
+    assert out['kids_seated_fee'] == 12.51
+
+
+def test_calculate_many_matches_scalar(settings):
+    import random
+
+    rng = random.Random(7)
+    rows = [(14, 1, 0, 0, 0), (15.5, 4, 3, 1, 2), (35.0001, 2, 1, 0, 1), (1e12, 1, 1, 0, 0), (20.1234567, 1, 2, 0, 0)]
+    rows += [(round(rng.uniform(0, 150), rng.randint(0, 8)), rng.randint(1, 9), rng.randint(0, 6), rng.randint(0, 3), rng.randint(0, 8)) for _ in range(2000)]
+    assert PricingService.calculate_many(rows) == [PricingService._calculate_reference(*r) for r in rows]
+
+    # Half-cent ties with seated kids are delegated to the scalar path
+    settings.PRICING = dict(settings.PRICING, BRACKETS=[{"min": 13, "max": 15, "price": 25.01}])
+    rows = [(14, 1, 3, 0, 0), (14, 2, 1, 0, 1)]
+    assert PricingService.calculate_many(rows) == [PricingService.calculate(*r) for r in rows]
+
+
+def test_calculate_many_without_numpy(monkeypatch, settings):
+    from rides.services import pricing
+
+    monkeypatch.setattr(pricing, 'np', None)
+    settings.PRICING = dict(settings.PRICING)
+    rows = [(14, 1, 0, 0, 0), (40, 5, 2, 1, 3)]
+    assert PricingService.calculate_many(rows) == [PricingService.calculate(*r) for r in rows]
+
+
+def test_price_batch_endpoint(settings):
+    from rest_framework.test import APIClient
+
+    rows = [{'distance_km': 14, 'num_adults': 1}, {'distance_km': 40, 'num_adults': 5, 'num_kids_seated': 2, 'luggage_count': 1}]
+    resp = APIClient().post('/rides/api/price/batch/', {'rows': rows}, format='json')
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data['count'] == 2
+    assert data['results'][1] == PricingService.calculate(40, 5, 2, 0, 1)
+
+    resp = APIClient().post('/rides/api/price/batch/', {'rows': rows, 'breakdown': False}, format='json')
+    assert resp.json()['totals'] == [25.0, PricingService.calculate(40, 5, 2, 0, 1)['total']]
+
+    settings.PRICE_BATCH_MAX_ROWS = 1
+    assert APIClient().post('/rides/api/price/batch/', {'rows': rows}, format='json').status_code == 400
+    bad = [{'distance_km': 14, 'num_adults': 0}]
+    assert APIClient().post('/rides/api/price/batch/', {'rows': bad}, format='json').status_code == 400
+
+
+def test_price_matrix_endpoint_matches_scalar_quotes(settings):
+    from rest_framework.test import APIClient
+
+    settings.PRICE_MATRIX_LIMITS = {'num_adults': 5, 'num_kids_seated': 3, 'luggage_count': 2}
+    resp = APIClient().post('/rides/api/price/matrix/', {'distance_km': 37.3}, format='json')
+    assert resp.status_code == 200
+    m = resp.json()
+    assert len(m['totals']) == 5 and len(m['totals'][0]) == 4 and len(m['totals'][0][0]) == 3
+    for a in range(1, 6):
+        for k in range(4):
+            for l in range(3):
+                q = PricingService.calculate(37.3, a, k, 0, l)
+                assert m['totals'][a - 1][k][l] == q['total']
+                assert m['extra_adults_fee'][a - 1] == q['extra_adults_fee']
+                assert m['kids_seated_fee'][k] == q['kids_seated_fee']
+                assert m['luggage_fee'][l] == q['luggage_fee']
+
+
+def test_pricing_rules_export_is_versioned_and_cacheable(settings):
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    resp = client.get('/rides/api/price/rules/')
+    assert resp.status_code == 200
+    rules = resp.json()
+    etag = resp['ETag']
+    assert etag == f'"{rules["version"]}"'
+    assert 'max-age=300' in resp['Cache-Control']
+    assert rules['brackets'][0] == {'min': '13', 'max': '15', 'price': '25.0'}
+
+    assert client.get('/rides/api/price/rules/', HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    resp = client.get(rules['url'])
+    assert resp.status_code == 200 and 'immutable' in resp['Cache-Control']
+
+    settings.PRICING = dict(settings.PRICING, LUGGAGE_FEE=6.0)
+    assert client.get('/rides/api/price/rules/', HTTP_IF_NONE_MATCH=etag).status_code == 200
+    assert client.get(rules['url']).status_code == 404
+
+
+@pytest.mark.django_db
+def test_booking_flags_mismatched_client_quote(monkeypatch):
+    from rest_framework.test import APIClient
+    from rides.models import RideBooking
+
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_owner_notification', lambda booking, payment_status='UNPAID': None)
+    monkeypatch.setattr('rides.services.email_service.EmailService.send_customer_notification', lambda booking, payment_status='UNPAID': None)
+    payload = {
+        'pickup_address': 'Start', 'dropoff_address': 'End', 'distance_km': 14.0, 'num_adults': 1,
+        'phone': '+263789000000', 'email': 'test@example.com', 'payment_option': RideBooking.PAYMENT_ON_ARRIVAL,
+    }
+
+    resp = APIClient().post('/rides/api/bookings/', dict(payload, quoted_total='25.00'), format='json')
+    assert resp.status_code == 201
+    assert 'quote_mismatch' not in resp.json()['price_breakdown']
+
+    resp = APIClient().post('/rides/api/bookings/', dict(payload, quoted_total='19.00'), format='json')
+    breakdown = resp.json()['price_breakdown']
+    assert breakdown['quote_mismatch'] is True and breakdown['total'] == 25.0
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+from django.conf import settings
+from django.core.cache import cache
+
+from rides.cache import LRUDatabaseCache, shared_cache
+from rides.models import CacheEntry
+from rides.services.distance import DistanceService
+from rides.services.http import get_session
+
+
+def _backend(**options):
+    return LRUDatabaseCache('', {'TIMEOUT': 60, 'OPTIONS': options})
+
+
+@pytest.mark.django_db
+def test_shared_cache_basic_operations():
+    c = _backend()
+    c.set('a', {'km': 1.5})
+    assert c.get('a') == {'km': 1.5}
+    assert c.get('missing', 'dflt') == 'dflt'
+
+    assert c.add('lock', 1) is True
+    assert c.add('lock', 2) is False
+
+    c.set('n', 1)
+    assert c.incr('n', 4) == 5
+
+    c.set('short', 'x', timeout=1)
+    time.sleep(1.1)
+    assert c.get('short') is None
+    assert c.add('short', 'y') is True
+
+    assert c.get_many(['a', 'n', 'nope']) == {'a': {'km': 1.5}, 'n': 5}
+    c.delete('a')
+    assert not c.has_key('a')
+
+
+@pytest.mark.django_db
+def test_shared_cache_evicts_least_recently_used():
+    c = _backend(MAX_ENTRIES=3, CULL_FREQUENCY=0, CULL_EVERY=1, TOUCH_INTERVAL=0)
+    c.set('k1', 1)
+    c.set('k2', 2)
+    c.set('k3', 3)
+    # Reading k1 makes k2 the least recently used entry
+    assert c.get('k1') == 1
+    c.set('k4', 4)
+
+    assert CacheEntry.objects.count() == 3
+    assert c.get('k2') is None
+    assert c.get('k1') == 1 and c.get('k4') == 4
+
+
+@pytest.mark.django_db
+def test_distance_served_from_shared_tier_after_l1_loss(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(settings, 'GOOGLE_MAPS_SERVER_KEY', 'fake-key')
+    calls = {'n': 0}
+
+    class FakeResponse:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"status": "OK", "rows": [{"elements": [{"status": "OK", "distance": {"value": 9000}}]}]}
+
+    def fake_get(url, params=None, timeout=None):
+        calls['n'] += 1
+        return FakeResponse()
+
+    monkeypatch.setattr(get_session('google'), 'get', fake_get)
+
+    o, d = (-17.8, 31.0), (-17.9, 31.1)
+    assert DistanceService.get_distance_km(o, d) == 9.0
+
+    # Simulate another worker (or a restart): its in-process L1 is empty
+    cache.clear()
+    assert DistanceService.get_distance_km(o, d) == 9.0
+    assert calls['n'] == 1
+    assert shared_cache().get(DistanceService._cache_key(o[0], o[1], d[0], d[1]))['km'] == 9.0
@@ -0,0 +1,91 @@
+/*
+ * Payment status watcher for the Paynow pages.
+ *
+ * With a waitUrl (rendered only when the async views serve it), long-polls
+ * rides:payment_status_wait, which answers as soon as the payment's status changes (webhook,
+ * status poll or reconciler) or after about 25 s. It checks the status poll endpoint (which
+ * may ask Paynow) once at the start and after every wait that saw no change, so a page costs
+ * a couple of requests per half minute instead of one every 5 s.
+ *
+ * Without one (sync deployments, where a wait would hold a worker thread), it short-polls the
+ * poll endpoint from every 5 s, backing off to 15 s and never before the server's cached
+ * result expires. Errors back off up to 15 s. Poll responses are revalidated with
+ * If-None-Match, so an unchanged status comes back as an empty 304.
+ *
+ *   const watcher = RidesPayment.watch({waitUrl, pollUrl, onStatus, onPaid, onError, onGiveUp});
+ *   button.onclick = watcher.check;
+ */
+(function(global){
+  'use strict';
+
+  // url -> {etag, json} of the last response that carried an ETag
+  const lastResponses = {};
+
+  function getJSON(url){
+    const last = lastResponses[url];
+    const headers = last ? {'If-None-Match': last.etag} : {};
+    return fetch(url, {cache: 'no-store', credentials: 'same-origin', headers: headers}).then(function(res){
+      if(res.status === 304 && last) return last.json;
+      return res.json().catch(function(){ return {}; }).then(function(json){
+        if(!res.ok) throw new Error(json.message || json.detail || ('HTTP ' + res.status));
+        const etag = res.headers.get('ETag');
+        if(etag) lastResponses[url] = {etag: etag, json: json};
+        return json;
+      });
+    });
+  }
+
+  function watch(opts){
+    const started = Date.now(), maxMs = opts.maxMs || 10 * 60 * 1000;
+    let status = null, stopped = false, errorDelay = 2000, pollDelay = 5000, lastPoll = null;
+
+    function finish(json){ stopped = true; if(opts.onPaid) opts.onPaid(json); }
+    function report(json){ if(opts.onStatus) opts.onStatus(json); }
+
+    function poll(){
+      return getJSON(opts.pollUrl).then(function(json){ lastPoll = json; if(json.paid) finish(json); else report(json); });
+    }
+
+    // Short-poll delay: back off while pending, but never ask before the cached result expires
+    function nextPollDelay(){
+      pollDelay = Math.min(pollDelay * 1.25, 15000);
+      const fresh = (lastPoll && lastPoll.max_age != null && lastPoll.cached_age != null) ? (lastPoll.max_age - lastPoll.cached_age) * 1000 : 0;
+      return Math.max(pollDelay, fresh);
+    }
+
+    function waitForChange(){
+      const sep = opts.waitUrl.indexOf('?') >= 0 ? '&' : '?';
+      const url = status ? opts.waitUrl + sep + 'status=' + encodeURIComponent(status) : opts.waitUrl;
+      return getJSON(url).then(function(json){
+        if(json.paid) return finish(json);
+        const changed = json.status !== status;
+        status = json.status;
+        if(changed) return report(json);
+        // A whole wait without a change: ask the poll endpoint, which may check Paynow
+        return poll();
+      });
+    }
+
+    function loop(step){
+      if(stopped) return;
+      if(Date.now() - started > maxMs){ stopped = true; if(opts.onGiveUp) opts.onGiveUp(); return; }
+      const next = opts.waitUrl ? waitForChange : poll;
+      step().then(function(){
+        errorDelay = 2000;
+        if(opts.waitUrl) loop(next); else setTimeout(function(){ loop(next); }, nextPollDelay());
+      }, function(err){
+        if(opts.onError) opts.onError(err);
+        errorDelay = Math.min(errorDelay * 2, 15000);
+        setTimeout(function(){ loop(next); }, errorDelay);
+      });
+    }
+
+    loop(poll);
+    return {
+      check: function(){ if(!stopped) poll().catch(function(err){ if(opts.onError) opts.onError(err); }); },
+      stop: function(){ stopped = true; },
+    };
+  }
+
+  global.RidesPayment = {watch: watch};
+})(window);
@@ -0,0 +1,191 @@
+/*
+ * Client-side fare evaluator mirroring rides.services.pricing.PricingService.calculate.
+ *
+ * Rules come from the versioned export at rides:price_rules (decimal strings). They are
+ * evaluated with a small BigInt decimal type that follows Python's default Decimal context
+ * (28 significant digits, round-half-even) step by step, and amounts are rounded half-up to
+ * cents, so quotes match the server to the cent. The server stays authoritative: bookings are
+ * always repriced there.
+ *
+ *   RidesPricing.load(url).then(rules => RidesPricing.quote(rules, 14.2, 2, 1, 0, 1))
+ */
+(function(global){
+  'use strict';
+
+  const PREC = 28;
+
+  function pow10(n){ return 10n ** BigInt(n); }
+  function ndigits(c){ return (c < 0n ? -c : c).toString().length; }
+
+  // Decimal value c * 10**e (c: BigInt, e: Number) from a decimal string or number
+  function dec(value){
+    let s = String(value).trim().toLowerCase();
+    let e = 0;
+    const i = s.indexOf('e');
+    if(i >= 0){
+      e = parseInt(s.slice(i + 1), 10);
+      s = s.slice(0, i);
+    }
+    const neg = s.startsWith('-');
+    if(neg || s.startsWith('+')) s = s.slice(1);
+    const dot = s.indexOf('.');
+    if(dot >= 0){
+      e -= s.length - dot - 1;
+      s = s.slice(0, dot) + s.slice(dot + 1);
+    }
+    const c = BigInt(s || '0');
+    return {c: neg ? -c : c, e: e};
+  }
+
+  // Round to PREC significant digits, half-even (Python's default context)
+  function context(d){
+    const extra = ndigits(d.c) - PREC;
+    if(extra <= 0) return d;
+    const div = pow10(extra);
+    let q = d.c / div;
+    const r = d.c % div;
+    const twice = 2n * (r < 0n ? -r : r);
+    const sign = d.c < 0n ? -1n : 1n;
+    if(twice > div || (twice === div && q % 2n !== 0n)) q += sign;
+    let e = d.e + extra;
+    if(ndigits(q) > PREC){
+      q /= 10n;
+      e += 1;
+    }
+    return {c: q, e: e};
+  }
+
+  function align(a, b){
+    const e = Math.min(a.e, b.e);
+    return [a.c * pow10(a.e - e), b.c * pow10(b.e - e), e];
+  }
+
+  function cmp(a, b){
+    const [x, y] = align(a, b);
+    return x < y ? -1 : (x > y ? 1 : 0);
+  }
+
+  function add(a, b){
+    const [x, y, e] = align(a, b);
+    return context({c: x + y, e: e});
+  }
+
+  function sub(a, b){ return add(a, {c: -b.c, e: b.e}); }
+  function mul(a, b){ return context({c: a.c * b.c, e: a.e + b.e}); }
+
+  function div(a, b){
+    const neg = (a.c < 0n) !== (b.c < 0n);
+    const n = a.c < 0n ? -a.c : a.c;
+    const d = b.c < 0n ? -b.c : b.c;
+    if(n === 0n) return {c: 0n, e: a.e - b.e};
+    let shift = PREC - (ndigits(n) - ndigits(d)) + 1;
+    let q = (n * (shift >= 0 ? pow10(shift) : 1n)) / (d * (shift < 0 ? pow10(-shift) : 1n));
+    while(ndigits(q) > PREC){
+      shift -= 1;
+      q = (n * (shift >= 0 ? pow10(shift) : 1n)) / (d * (shift < 0 ? pow10(-shift) : 1n));
+    }
+    const num = n * (shift >= 0 ? pow10(shift) : 1n);
+    const den = d * (shift < 0 ? pow10(-shift) : 1n);
+    const r = num - q * den;
+    if(2n * r > den || (2n * r === den && q % 2n !== 0n)) q += 1n;
+    return context({c: neg ? -q : q, e: a.e - b.e - shift});
+  }
+
+  // Quantize to 0.01 with ROUND_HALF_UP and return a Number of dollars
+  function money(d){
+    const shift = d.e + 2;
+    let cents;
+    if(shift >= 0){
+      cents = d.c * pow10(shift);
+    } else {
+      const div = pow10(-shift);
+      const m = d.c < 0n ? -d.c : d.c;
+      cents = (2n * m + div) / (2n * div);
+      if(d.c < 0n) cents = -cents;
+    }
+    return Number(cents) / 100;
+  }
+
+  function compile(rules){
+    if(rules._compiled) return rules._compiled;
+    rules._compiled = {
+      min: dec(rules.min_distance_km),
+      brackets: rules.brackets.map(b => ({min: dec(b.min), max: dec(b.max), price: dec(b.price)})),
+      threshold: dec(rules.above_threshold_km),
+      aboveBase: dec(rules.above_base_price),
+      perKm: dec(rules.above_per_km),
+      included: rules.included_adults,
+      extraAdult: dec(rules.extra_adult_fee),
+      kidFactor: dec(rules.kid_seated_factor),
+      luggage: dec(rules.luggage_fee),
+    };
+    return rules._compiled;
+  }
+
+  function quote(rules, distanceKm, numAdults, numKidsSeated, numKidsCarried, luggageCount){
+    numAdults = numAdults === undefined ? 1 : numAdults;
+    numKidsSeated = numKidsSeated || 0;
+    numKidsCarried = numKidsCarried || 0;
+    luggageCount = luggageCount || 0;
+    if(distanceKm === null || distanceKm === undefined) throw new Error('distance_km is required');
+    if(numAdults < 1) throw new Error('At least one adult is required');
+    if(numKidsSeated < 0 || numKidsCarried < 0 || luggageCount < 0) throw new Error('Counts cannot be negative');
+
+    const c = compile(rules);
+    const distance = dec(distanceKm);
+    const effective = cmp(distance, c.min) >= 0 ? distance : c.min;
+
+    let base = null;
+    for(const b of c.brackets){
+      if(cmp(b.min, effective) <= 0 && cmp(effective, b.max) <= 0){
+        base = b.price;
+        break;
+      }
+    }
+    if(base === null){
+      // Distances in a gap between brackets fall back to the first bracket, like the server
+      base = cmp(effective, c.threshold) > 0 ? add(c.aboveBase, mul(c.perKm, sub(effective, c.threshold))) : c.brackets[0].price;
+    }
+
+    const extraAdults = Math.max(0, numAdults - c.included);
+    const extraFee = mul(c.extraAdult, dec(extraAdults));
+    const adultShare = div(base, dec(c.included));
+    const kidsFee = mul(mul(adultShare, c.kidFactor), dec(numKidsSeated));
+    const luggageFee = mul(c.luggage, dec(luggageCount));
+    const subtotal = add(add(add(base, extraFee), kidsFee), luggageFee);
+
+    return {
+      distance_km: Number(distanceKm),
+      effective_distance_km: effective === distance ? Number(distanceKm) : parseFloat(rules.min_distance_km),
+      base_distance_price: money(base),
+      extra_adults: extraAdults,
+      extra_adults_fee: money(extraFee),
+      kids_seated: numKidsSeated,
+      kids_seated_fee: money(kidsFee),
+      kids_carried: numKidsCarried,
+      luggage_count: luggageCount,
+      luggage_fee: money(luggageFee),
+      subtotal: money(subtotal),
+      total: money(subtotal),
+    };
+  }
+
+  // Fetch the rules once per page; the browser/CDN cache revalidates them by ETag
+  let pending = null;
+  function load(url){
+    if(!pending){
+      pending = fetch(url, {headers: {'Accept': 'application/json'}}).then(resp => {
+        if(!resp.ok) throw new Error('Unable to load pricing rules: ' + resp.status);
+        return resp.json();
+      }).catch(err => {
+        pending = null;
+        throw err;
+      });
+    }
+    return pending;
+  }
+
+  const api = {load, quote};
+  if(typeof module !== 'undefined' && module.exports) module.exports = api;
+  global.RidesPricing = api;
+})(typeof window !== 'undefined' ? window : globalThis);